@@ -4,12 +4,13 @@ import threading
 from itertools import chain
 
 import anyio
-import autogen
 import gradio as gr
-from autogen import Agent, AssistantAgent, OpenAIWrapper, UserProxyAgent
-from autogen.code_utils import extract_code
+from autogen import Agent, AssistantAgent, UserProxyAgent
 from gradio import ChatInterface, Request
 from gradio.helpers import special_args
+from llm_cache import CachedOpenAIWrapper
+from session_config import SESSION_CONFIGS, Credentials
+from termination import is_code_free_msg
 
 LOG_LEVEL = "INFO"
 TIMEOUT = 60
@@ -91,23 +92,6 @@ with gr.Blocks() as demo:
         # config.append(msg) if msg is not None else None  # config can be agent_history
         return False, None  # required to ensure the agent communication flow continues
 
-    def _is_termination_msg(message):
-        """Check if a message is a termination message.
-        Terminate when no code block is detected. Currently only detect python code blocks.
-        """
-        if isinstance(message, dict):
-            message = message.get("content")
-            if message is None:
-                return False
-        cb = extract_code(message)
-        contain_code = False
-        for c in cb:
-            # todo: support more languages
-            if c[0] == "python":
-                contain_code = True
-                break
-        return not contain_code
-
     def initialize_agents(config_list):
         assistant = AssistantAgent(
             name="assistant",
@@ -122,7 +106,7 @@ with gr.Blocks() as demo:
         userproxy = UserProxyAgent(
             name="userproxy",
             human_input_mode="NEVER",
-            is_termination_msg=_is_termination_msg,
+            is_termination_msg=is_code_free_msg,
             max_consecutive_auto_reply=5,
             # code_execution_config=False,
             code_execution_config={
@@ -197,7 +181,7 @@ with gr.Blocks() as demo:
                 "config_list": config_list,
             }
             assistant.llm_config.update(llm_config)
-            assistant.client = OpenAIWrapper(**assistant.llm_config)
+            assistant.client = CachedOpenAIWrapper(**assistant.llm_config)
 
         if user_message.strip().lower().startswith("show file:"):
             filename = user_message.strip().lower().replace("show file:", "").strip()
@@ -277,33 +261,13 @@ with gr.Blocks() as demo:
         #### [AutoGen](https://github.com/microsoft/autogen) [Discord](https://discord.gg/pAbnFJrkgZ) [Paper](https://arxiv.org/abs/2308.08155) [SourceCode](https://github.com/thinkall/autogen-demos)
         """
 
-    def update_config():
-        config_list = autogen.config_list_from_models(
-            model_list=[os.environ.get("MODEL", "gpt-35-turbo")],
+    def respond(message, chat_history, model, oai_key, aoai_key, aoai_base, request: Request):
+        # resolved once per session and credentials, without touching os.environ shared by all sessions
+        config = SESSION_CONFIGS.get(
+            request.session_hash,
+            Credentials(model=model, openai_key=oai_key, aoai_key=aoai_key, aoai_base=aoai_base),
         )
-        if not config_list:
-            config_list = [
-                {
-                    "api_key": "",
-                    "base_url": "",
-                    "api_type": "azure",
-                    "api_version": "2023-07-01-preview",
-                    "model": "gpt-35-turbo",
-                }
-            ]
-
-        return config_list
-
-    def set_params(model, oai_key, aoai_key, aoai_base):
-        os.environ["MODEL"] = model
-        os.environ["OPENAI_API_KEY"] = oai_key
-        os.environ["AZURE_OPENAI_API_KEY"] = aoai_key
-        os.environ["AZURE_OPENAI_API_BASE"] = aoai_base
-
-    def respond(message, chat_history, model, oai_key, aoai_key, aoai_base):
-        set_params(model, oai_key, aoai_key, aoai_base)
-        config_list = update_config()
-        chat_history[:] = chatbot_reply(message, chat_history, config_list)
+        chat_history[:] = chatbot_reply(message, chat_history, config.to_config_list())
         if LOG_LEVEL == "DEBUG":
             print(f"return chat_history: {chat_history}")
         return ""
@@ -0,0 +1,135 @@
+import hashlib
+import inspect
+import json
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from functools import lru_cache
+from types import MappingProxyType
+
+import autogen
+
+if "base_urls" in inspect.signature(autogen.get_config_list).parameters:  # pyautogen>=0.2
+    BASE_KEY, BASES_ARG, AOAI_API_VERSION = "base_url", "base_urls", "2023-08-01-preview"
+else:
+    BASE_KEY, BASES_ARG, AOAI_API_VERSION = "api_base", "api_bases", "2023-07-01-preview"
+DEFAULT_MODEL = "gpt-35-turbo"
+MAX_SESSIONS = 1024
+
+
+@dataclass(frozen=True)
+class Credentials:
+    """The LLM settings entered in one session."""
+
+    model: str = DEFAULT_MODEL
+    openai_key: str = ""
+    openai_base: str = ""
+    aoai_key: str = ""
+    aoai_base: str = ""
+    config_file: bytes = b""  # content of an uploaded OAI_CONFIG_LIST
+
+
+@dataclass(frozen=True)
+class SessionConfig:
+    """An immutable config list, identified by the hash of its content."""
+
+    config_list: tuple = field(compare=False, repr=False)
+    key: str
+
+    @property
+    def model(self):
+        return self.config_list[0]["model"]
+
+    def to_config_list(self):
+        """Return a copy of the config list which can be handed to autogen."""
+        return [dict(config) for config in self.config_list]
+
+    def llm_config(self, **kwargs):
+        return {**kwargs, "config_list": self.to_config_list()}
+
+
+def make_config(config_list):
+    config_list = [dict(config) for config in config_list]
+    key = hashlib.sha256(json.dumps(config_list, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+    return SessionConfig(tuple(MappingProxyType(config) for config in config_list), key)
+
+
+def resolve_config(credentials, default_config_list=None):
+    """Resolve `credentials` into a config, the same way as `autogen.config_list_from_models` does from the env
+    vars, but without reading or writing os.environ.
+
+    An uploaded config file wins over `default_config_list`, which wins over the keys.
+    """
+    if credentials.config_file:
+        config_list = json.loads(credentials.config_file)
+    else:
+        config_list = list(default_config_list or [])
+    if not config_list:
+        openai_config = autogen.get_config_list(api_keys=credentials.openai_key.split("\n"))
+        openai_base = credentials.openai_base.strip()
+        if openai_base:
+            for config in openai_config:
+                config[BASE_KEY] = openai_base
+        aoai_config = autogen.get_config_list(
+            api_keys=credentials.aoai_key.split("\n"),
+            api_type="azure",
+            api_version=AOAI_API_VERSION,
+            **{BASES_ARG: credentials.aoai_base.split("\n")},
+        )
+        config_list = [{**config, "model": credentials.model} for config in openai_config + aoai_config]
+    if not config_list:
+        config_list = [
+            {
+                "api_key": "",
+                BASE_KEY: "",
+                "api_type": "azure",
+                "api_version": "2023-07-01-preview",
+                "model": DEFAULT_MODEL,
+            }
+        ]
+    return make_config(config_list)
+
+
+@lru_cache(maxsize=8)
+def _load_config_file(env_or_file, mtime):
+    return tuple(autogen.config_list_from_json(env_or_file, file_location="."))
+
+
+def local_config_list(env_or_file="OAI_CONFIG_LIST"):
+    """Return the config list of the local OAI_CONFIG_LIST, which is parsed again only when the file changes."""
+    try:
+        mtime = os.path.getmtime(env_or_file)
+    except OSError:
+        mtime = None
+    return _load_config_file(env_or_file, mtime)
+
+
+class SessionConfigs:
+    """The resolved config of each session, a session's config is resolved again only when its credentials change."""
+
+    def __init__(self, max_sessions=MAX_SESSIONS):
+        self.max_sessions = max_sessions
+        self._configs = OrderedDict()  # session id -> (credentials, config)
+        self._lock = threading.Lock()
+
+    def get(self, session_id, credentials, default_config_list=None):
+        with self._lock:
+            entry = self._configs.get(session_id)
+            if entry is not None and entry[0] == credentials:
+                self._configs.move_to_end(session_id)
+                return entry[1]
+        config = resolve_config(credentials, default_config_list)
+        with self._lock:
+            self._configs[session_id] = (credentials, config)
+            self._configs.move_to_end(session_id)
+            while len(self._configs) > self.max_sessions:
+                self._configs.popitem(last=False)
+        return config
+
+    def forget(self, session_id):
+        with self._lock:
+            self._configs.pop(session_id, None)
+
+
+SESSION_CONFIGS = SessionConfigs()
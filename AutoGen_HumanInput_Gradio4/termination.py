@@ -0,0 +1,74 @@
+import re
+from functools import lru_cache
+
+from autogen.code_utils import extract_code
+
+TERMINATE = "TERMINATE"
+TAIL_SIZE = 256  # chars scanned at each end of a message, unless they are all padding
+FENCE = "```"
+# autogen's CODE_BLOCK_PATTERN split in two, so that the end of a block is found by a literal search instead of a
+# lazy match over the whole block
+OPEN_FENCE_RE = re.compile(r"```[ \t]*(\w+)?[ \t]*\r?\n")
+CLOSE_FENCE_RE = re.compile(r"\n[ \t]*```")
+
+
+def _has_terminate(text):
+    """Return True if `text`, stripped of whitespace and then of dots, starts or ends with TERMINATE."""
+    truncated = len(text) > TAIL_SIZE
+    tail = text[-TAIL_SIZE:].rstrip().rstrip(".")
+    if truncated and len(tail) < len(TERMINATE):
+        # the scanned tail is mostly padding, the word may start before it
+        tail = text.rstrip().rstrip(".")
+    if tail[-len(TERMINATE) :].upper() == TERMINATE:
+        return True
+    head = text[:TAIL_SIZE].lstrip().lstrip(".")
+    if truncated and len(head) < len(TERMINATE):
+        head = text.lstrip().lstrip(".")
+    return head[: len(TERMINATE)].upper() == TERMINATE
+
+
+def _has_python_code(text):
+    """Return True if `text` has a python code block, stopping at the first one."""
+    pos = text.find(FENCE)
+    while pos != -1:
+        opening = OPEN_FENCE_RE.match(text, pos)
+        if opening is None:
+            pos = text.find(FENCE, pos + 1)
+            continue
+        closing = CLOSE_FENCE_RE.search(text, opening.end())
+        if closing is None:
+            # no later block can be closed either
+            return False
+        # todo: support more languages
+        if opening.group(1) == "python":
+            return True
+        pos = text.find(FENCE, closing.end())
+    return False
+
+
+# Messages are copied into the history of every agent of a chat, but the copies share the content string, whose
+# hash is cached by python, so the verdicts are cached per content instead of per message dict.
+_has_terminate_cached = lru_cache(maxsize=1024)(_has_terminate)
+_has_python_code_cached = lru_cache(maxsize=1024)(_has_python_code)
+
+
+def termination_msg(x):
+    """Check if a message is a termination message."""
+    content = x.get("content", "")
+    if type(content) is not str:
+        content = str(content)
+    return isinstance(x, dict) and _has_terminate_cached(content)
+
+
+def is_code_free_msg(message):
+    """Check if a message is a termination message.
+    Terminate when no code block is detected. Currently only detect python code blocks.
+    """
+    if isinstance(message, dict):
+        message = message.get("content")
+        if message is None:
+            return False
+    if type(message) is not str:
+        # e.g. multimodal content, leave it to autogen
+        return not any(c[0] == "python" for c in extract_code(message))
+    return not _has_python_code_cached(message)
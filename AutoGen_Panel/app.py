@@ -1,23 +1,33 @@
 import asyncio
-import os
 import random
 import time
 from functools import partial
 
-import autogen
+import context_manager
+import pandas as pd
 import panel as pn
-from autogen_utils import (
-    MathUserProxyAgent,
-    RetrieveUserProxyAgent,
-    check_termination_and_human_reply,
-    generate_code,
-    get_retrieve_config,
-    initialize_agents,
+from autogen_utils import MathUserProxyAgent, RetrieveUserProxyAgent, generate_code
+from configs import (
+    CONTEXT_TOKENS,
+    DEFAULT_TERMINATE_MESSAGE,
+    Q1,
+    Q2,
+    Q3,
+    STREAM,
+    TIMEOUT,
+    TITLE,
 )
-from configs import DEFAULT_TERMINATE_MESSAGE, Q1, Q2, Q3, TIMEOUT, TITLE
 from custom_widgets import RowAgentWidget
+from group_chat import TeamSpec, build_team, register_session_replies
 from panel.chat import ChatInterface
-from panel.widgets import Button, CodeEditor, PasswordInput, Switch, TextInput
+from panel.widgets import Button, CodeEditor, IntInput, PasswordInput, Switch, TextInput
+from rag_collections import SHARED_COLLECTIONS
+from rate_limiter import SCHEDULER, session_scope
+from router import ROUTER
+from session_config import SESSION_CONFIGS, Credentials, local_config_list
+from sessions import SESSION_COLUMNS, SESSIONS, SWEEP_PERIOD, sweep, team_memory
+from team_pool import TEAM_POOL
+from token_accounting import session_tokens
 
 pn.extension("codeeditor")
 
@@ -55,59 +65,45 @@ file_cfg = pn.widgets.FileInput(filename="OAI_CONFIG_LIST", sizing_mode="stretch
 template.main.append(pn.Row(txt_model, pwd_openai_key, pwd_openai_url, pwd_aoai_key, pwd_aoai_url, file_cfg))
 
 
-def get_config(tmpfilename="OAI_CONFIG_LIST"):
-    os.makedirs(".chromadb", exist_ok=True)
-    if file_cfg.value:
-        if os.path.exists(f".chromadb/{tmpfilename}"):
-            os.remove(f".chromadb/{tmpfilename}")
-        file_cfg.save(f".chromadb/{tmpfilename}")
-        cfg_fpath = f".chromadb/{tmpfilename}"
-    else:
-        cfg_fpath = "OAI_CONFIG_LIST"  # for local testing
-    config_list = autogen.config_list_from_json(
-        cfg_fpath,
-        file_location=".",
+def get_credentials():
+    return Credentials(
+        model=txt_model.value,
+        openai_key=pwd_openai_key.value,
+        openai_base=pwd_openai_url.value,
+        aoai_key=pwd_aoai_key.value,
+        aoai_base=pwd_aoai_url.value,
+        config_file=file_cfg.value or b"",
     )
-    if not config_list:
-        os.environ["MODEL"] = txt_model.value
-        os.environ["OPENAI_API_KEY"] = pwd_openai_key.value
-        os.environ["OPENAI_API_BASE"] = pwd_openai_url.value
-        os.environ["AZURE_OPENAI_API_KEY"] = pwd_aoai_key.value
-        os.environ["AZURE_OPENAI_API_BASE"] = pwd_aoai_url.value
-
-        config_list = autogen.config_list_from_models(
-            model_list=[os.environ.get("MODEL", "gpt-35-turbo")],
-        )
-        for cfg in config_list:
-            if cfg.get("api_type", "open_ai") == "open_ai":
-                base_url = os.environ.get("OPENAI_API_BASE", "").strip()
-                if base_url:
-                    cfg["base_url"] = base_url
-    if not config_list:
-        config_list = [
-            {
-                "api_key": "",
-                "base_url": "",
-                "api_type": "azure",
-                "api_version": "2023-07-01-preview",
-                "model": "gpt-35-turbo",
-            }
-        ]
 
-    llm_config = {
-        "timeout": TIMEOUT,
-        "cache_seed": 42,
-        "config_list": config_list,
-        "temperature": 0,
-    }
 
-    return llm_config
+def get_config(session_id):
+    """Return the session's config and the llm_config built from it, the config is resolved once per credentials."""
+    # OAI_CONFIG_LIST is for local testing
+    config = SESSION_CONFIGS.get(session_id, get_credentials(), local_config_list())
+    llm_config = config.llm_config(
+        timeout=TIMEOUT,
+        cache_seed=None,  # responses are cached in the shared llm_cache instead
+        temperature=0,
+    )
+    return config, llm_config
 
 
 btn_add = Button(name="+", button_type="success")
 btn_remove = Button(name="-", button_type="danger")
 switch_code = Switch(name="Run Code", sizing_mode="fixed", width=50, height=30, align="end")
-select_speaker_method = pn.widgets.Select(name="", options=["round_robin", "auto", "random"], value="round_robin")
+switch_stream = Switch(name="Stream", value=STREAM, sizing_mode="fixed", width=50, height=30, align="end")
+# local picks the next speaker without an LLM call, see speaker_selection.py
+select_speaker_method = pn.widgets.Select(
+    name="", options=["round_robin", "auto", "random", "local"], value="round_robin"
+)
+# agents of a group reply to the same context at the same time, see parallel_rounds.py
+txt_parallel = TextInput(
+    name="Parallel Rounds",
+    placeholder="agent_a, agent_b; agent_c, agent_d",
+    sizing_mode="stretch_width",
+)
+# max history tokens each agent sends, the older messages are summarized, see context_manager.py
+int_context = IntInput(name="Context Tokens (0 for the full history)", value=CONTEXT_TOKENS, start=0, step=500)
 template.main.append(
     pn.Row(
         pn.pane.Markdown("## Add or Remove Agents: "),
@@ -115,10 +111,13 @@ template.main.append(
         btn_remove,
         pn.pane.Markdown("### Run Code: "),
         switch_code,
+        pn.pane.Markdown("### Stream: "),
+        switch_stream,
         pn.pane.Markdown("### Speaker Selection Method: "),
         select_speaker_method,
     )
 )
+template.main.append(pn.Row(txt_parallel, int_context))
 
 column_agents = pn.Column(
     RowAgentWidget(
@@ -158,89 +157,19 @@ btn_add.on_click(add_agent)
 btn_remove.on_click(remove_agent)
 
 
-async def send_messages(recipient, messages, sender, config):
-    # print(f"{sender.name} -> {recipient.name}: {messages[-1]['content']}")
-    chatiface.send(messages[-1]["content"], user=sender.name, respond=False)
-    return False, None  # required to ensure the agent communication flow continues
-
-
-class myGroupChatManager(autogen.GroupChatManager):
-    def _send_messages(self, message, sender, config):
-        message = self._message_to_dict(message)
-
-        if message.get("role") == "function":
-            content = message["content"]
-        else:
-            content = message.get("content")
-            if content is not None:
-                if "context" in message:
-                    content = autogen.OpenAIWrapper.instantiate(
-                        content,
-                        message["context"],
-                        self.llm_config and self.llm_config.get("allow_format_str_template", False),
-                    )
-            if "function_call" in message:
-                function_call = dict(message["function_call"])
-                content = f"Suggested function Call: {function_call.get('name', '(No function name found)')}"
-        chatiface.send(content, user=sender.name, respond=False)
-        return False, None  # required to ensure the agent communication flow continues
-
-    def _process_received_message(self, message, sender, silent):
-        message = self._message_to_dict(message)
-        # When the agent receives a message, the role of the message is "user". (If 'role' exists and is 'function', it will remain unchanged.)
-        valid = self._append_oai_message(message, "user", sender)
-        if not valid:
-            raise ValueError(
-                "Received message can't be converted into a valid ChatCompletion message. Either content or function_call must be provided."
-            )
-        if not silent:
-            self._print_received_message(message, sender)
-            self._send_messages(message, sender, None)
-
-
-def init_groupchat(event, collection_name):
-    llm_config = get_config(collection_name)
-    agents = []
-    for row_agent in column_agents:
-        agent_name = row_agent[0][0].value
-        system_msg = row_agent[0][1].value
-        agent_type = row_agent[0][2].value
-        docs_path = row_agent[1].value
-        retrieve_config = (
-            get_retrieve_config(
-                docs_path,
-                txt_model.value,
-                collection_name=collection_name,
-            )
-            if agent_type == "RetrieveUserProxyAgent"
-            else None
-        )
-        code_execution_config = (
-            {
-                "work_dir": "coding",
-                "use_docker": False,  # set to True or image name like "python:3" to use docker
-            }
-            if switch_code.value
-            else False
-        )
-        agent = initialize_agents(
-            llm_config, agent_name, system_msg, agent_type, retrieve_config, code_execution_config
-        )
-        agent.register_reply([autogen.Agent, None], reply_func=send_messages, config={"callback": None})
-        agents.append(agent)
-    if len(agents) >= 3:
-        groupchat = autogen.GroupChat(
-            agents=agents,
-            messages=[],
-            max_round=12,
-            speaker_selection_method=select_speaker_method.value,
-            allow_repeat_speaker=False,
-        )
-        manager = myGroupChatManager(groupchat=groupchat, llm_config=llm_config)
-    else:
-        manager = None
-        groupchat = None
-    return agents, manager, groupchat
+def get_team_spec():
+    """Return the team settings of this session's widgets."""
+    return TeamSpec(
+        agents=tuple(
+            (row_agent[0][0].value, row_agent[0][1].value, row_agent[0][2].value, row_agent[1].value)
+            for row_agent in column_agents
+        ),
+        model=txt_model.value,
+        code_execution=switch_code.value,
+        speaker_selection_method=select_speaker_method.value,
+        parallel_groups=txt_parallel.value,
+        context_tokens=int_context.value or 0,
+    )
 
 
 async def agents_chat(init_sender, manager, contents, agents):
@@ -251,22 +180,70 @@ async def agents_chat(init_sender, manager, contents, agents):
         await init_sender.a_initiate_chat(recipient, message=contents)
 
 
-async def reply_chat(contents, user, instance):
-    if hasattr(instance, "collection_name"):
-        collection_name = instance.collection_name
+def hold_collections(instance, agents):
+    """Take references on the shared RAG collections used by the session's agents, releasing the previous ones."""
+    release_collections(instance)
+    instance.collections = [agent._collection_name for agent in agents if isinstance(agent, RetrieveUserProxyAgent)]
+    for name in instance.collections:
+        SHARED_COLLECTIONS.acquire(name)
+
+
+def release_collections(instance):
+    for name in getattr(instance, "collections", []):
+        SHARED_COLLECTIONS.release(name)
+    instance.collections = []
+
+
+def release_session(instance):
+    """Drop the agents, histories and collection references of the session, its next message builds a new team."""
+    release_collections(instance)
+    SESSION_CONFIGS.forget(getattr(instance, "session_id", None))
+    instance.agents = instance.manager = instance.groupchat = instance.team_key = None
+    instance.live_messages = {}
+
+
+def measure_session(instance):
+    """Return the approximate bytes and the number of messages of the session's team."""
+    groupchat = getattr(instance, "groupchat", None)
+    agents = getattr(instance, "agents", None) or []
+    if groupchat is not None:
+        messages = len(groupchat.messages)
     else:
-        collection_name = f"{int(time.time())}_{random.randint(0, 100000)}"
-        instance.collection_name = collection_name
+        messages = max((len(m) for agent in agents for m in agent._oai_messages.values()), default=0)
+    return team_memory(agents, groupchat), messages
 
-    column_agents_list = [[a.value for a in agent[0]] for agent in column_agents] + [switch_code.value]
-    if not hasattr(instance, "agent_list") or instance.agents_list != column_agents_list:
-        agents, manager, groupchat = init_groupchat(None, collection_name)
+
+async def reply_chat(contents, user, instance):
+    if hasattr(instance, "session_id"):
+        session_id = instance.session_id
+    else:
+        session_id = f"{int(time.time())}_{random.randint(0, 100000)}"
+        instance.session_id = session_id
+
+    SESSIONS.register(session_id, partial(release_session, instance), partial(measure_session, instance))
+    # an active session is never released, even while it waits for the LLM or a human input
+    with SESSIONS.active(session_id):
+        return await run_chat(contents, instance, session_id)
+
+
+async def run_chat(contents, instance, session_id):
+    instance.stream_replies = switch_stream.value
+    config, llm_config = get_config(session_id)
+    spec = get_team_spec()
+    key = spec.key(config.key)
+    if getattr(instance, "team_key", None) != key:
+        # the team is built from the settings read above only, then bound to this session's chat interface
+        agents, manager, groupchat = TEAM_POOL.acquire(key, partial(build_team, spec, llm_config))
+        register_session_replies(agents, manager, instance)
+        hold_collections(instance, agents)
         instance.manager = manager
         instance.agents = agents
-        instance.agents_list = column_agents_list
+        instance.groupchat = groupchat
+        instance.team_key = key
     else:
         agents = instance.agents
         manager = instance.manager
+        groupchat = instance.groupchat
 
     if len(agents) <= 1:
         return "Please add more agents."
@@ -276,22 +253,13 @@ async def reply_chat(contents, user, instance):
         if "UserProxy" in str(type(agent)):
             init_sender = agent
             break
-    for agent in agents:
-        # Hack for get human input
-        agent._reply_func_list.pop(1)
-        agent.register_reply(
-            [autogen.Agent, None],
-            partial(check_termination_and_human_reply, instance=instance),
-            1,
-        )
-    if manager is not None:
-        for agent in agents:
-            agent._reply_func_list.pop(0)
 
     if not init_sender:
         init_sender = agents[0]
     await generate_code(agents, manager, contents, code_editor, groupchat)
-    await agents_chat(init_sender, manager, contents, agents)
+    # the LLM calls of the chat share the rate limits fairly with the other sessions
+    with session_scope(session_id):
+        await agents_chat(init_sender, manager, contents, agents)
     return "The task is done. Please start a new task."
 
 
@@ -302,6 +270,44 @@ chatiface = ChatInterface(
 
 template.main.append(chatiface)
 
+
+def get_llm_metrics():
+    """Return the queue depth, waits, hedged calls and summaries of the LLM calls of all sessions, without their
+    endpoints."""
+    return {**SCHEDULER.metrics()["total"], **ROUTER.metrics()["total"], **context_manager.metrics()}
+
+
+llm_metrics = pn.pane.JSON(get_llm_metrics(), sizing_mode="stretch_width")
+# the tokens of the conversations of this session's agents
+llm_tokens = pn.pane.JSON({}, sizing_mode="stretch_width")
+template.main.append(pn.Card(llm_metrics, llm_tokens, title="LLM Calls", collapsed=True, sizing_mode="stretch_width"))
+
+
+# the memory of all the sessions of the process, the sessions are shown by the end of their ids
+sessions_table = pn.widgets.Tabulator(
+    pd.DataFrame(SESSIONS.rows(), columns=SESSION_COLUMNS), disabled=True, show_index=False, sizing_mode="stretch_width"
+)
+template.main.append(pn.Card(sessions_table, title="Sessions", collapsed=True, sizing_mode="stretch_width"))
+
+
+def update_llm_metrics():
+    llm_metrics.object = get_llm_metrics()
+    llm_tokens.object = session_tokens(getattr(chatiface, "agents", None))
+    sessions_table.value = pd.DataFrame(SESSIONS.rows(), columns=SESSION_COLUMNS)
+
+
+pn.state.add_periodic_callback(update_llm_metrics, period=5000)
+
+
+def cleanup_session(session_context):
+    SESSIONS.forget(getattr(chatiface, "session_id", None))
+    release_session(chatiface)
+
+
+pn.state.on_session_destroyed(cleanup_session)
+# one task for all the sessions releases the idle ones
+pn.state.schedule_task("sweep_sessions", sweep, period=SWEEP_PERIOD)
+
 btn_msg1 = Button(name=Q1, sizing_mode="stretch_width")
 btn_msg2 = Button(name=Q2, sizing_mode="stretch_width")
 btn_msg3 = Button(name=Q3, sizing_mode="stretch_width")
@@ -355,6 +361,8 @@ def clear_agents():
 
 def load_example(event):
     clear_agents()
+    txt_parallel.value = ""
+    int_context.value = CONTEXT_TOKENS
     if event.obj.name == "RAG 2 agents":
         column_agents.append(
             RowAgentWidget(
@@ -587,6 +595,8 @@ Explain the plan first. Be clear which step is performed by an engineer, and whi
                 ]
             ),
         )
+        # the opening and closing statements of both teams don't depend on each other
+        txt_parallel.value = "team_one_member_one, team_two_member_one; team_one_member_four, team_two_member_four"
 
 
 btn_example1.on_click(load_example)
@@ -1,17 +1,15 @@
 import asyncio
-import os
-import random
+import contextvars
 import sys
-import textwrap
 import threading
-import time
 from ast import literal_eval
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache, partial
 
 import autogen
-import chromadb
 import isort
 import panel as pn
-from autogen import Agent, AssistantAgent, UserProxyAgent
+from autogen import Agent, AssistantAgent, ConversableAgent, UserProxyAgent
 from autogen.agentchat.contrib.compressible_agent import CompressibleAgent
 from autogen.agentchat.contrib.gpt_assistant_agent import GPTAssistantAgent
 from autogen.agentchat.contrib.llava_agent import LLaVAAgent
@@ -19,16 +17,29 @@ from autogen.agentchat.contrib.math_user_proxy_agent import MathUserProxyAgent
 from autogen.agentchat.contrib.retrieve_assistant_agent import RetrieveAssistantAgent
 from autogen.agentchat.contrib.retrieve_user_proxy_agent import RetrieveUserProxyAgent
 from autogen.agentchat.contrib.teachable_agent import TeachableAgent
-from autogen.code_utils import extract_code
+from chroma_clients import get_chroma_client
+from code_generator import render_script
 from configs import (
     DEFAULT_AUTO_REPLY,
     DEFAULT_SYSTEM_MESSAGE,
+    LLM_WORKERS,
+    MAX_CONVERSATION_TOKENS,
     Q1,
     Q2,
     Q3,
+    STREAM,
     TIMEOUT,
     TITLE,
 )
+from context_manager import context_window
+from embedding_server import get_embedding_function
+from embeddings import embedding_id
+from input_broker import INPUT_BROKER
+from llm_client import StreamingOpenAIWrapper, stream_tokens
+from rag_collections import SHARED_COLLECTIONS, normalize_docs, shared_collection_name
+from role_alternation import alternated_messages
+from termination import is_code_free_msg, termination_msg
+from token_accounting import attach_ledger, get_ledger
 
 try:
     from termcolor import colored
@@ -38,41 +49,50 @@ except ImportError:
         return x
 
 
-def get_retrieve_config(docs_path, model_name, collection_name):
+try:
+    import black
+except ImportError:
+    black = None
+
+FORMAT_EXECUTOR = ThreadPoolExecutor(max_workers=2, thread_name_prefix="format_code")
+# blocking LLM calls of async chats run here, so they never freeze the event loop shared by all sessions
+LLM_EXECUTOR = ThreadPoolExecutor(max_workers=LLM_WORKERS, thread_name_prefix="llm")
+
+
+def run_llm(func, *args, **kwargs):
+    """Run a blocking LLM call in LLM_EXECUTOR, in the context of the caller, e.g. its session for the scheduler."""
+    loop = asyncio.get_running_loop()
+    return loop.run_in_executor(LLM_EXECUTOR, partial(contextvars.copy_context().run, func, *args, **kwargs))
+
+
+def get_retrieve_config(docs_path, model_name, collection_name=None):
+    docs_path = normalize_docs(literal_eval(docs_path))
+    chunk_token_size = 1000
+    embedding_model = "all-mpnet-base-v2"
+    if collection_name is None:
+        # the int8 backend gives other vectors, its collections are kept apart
+        collection_name = shared_collection_name(docs_path, chunk_token_size, embedding_id(embedding_model))
     return {
-        "docs_path": literal_eval(docs_path),
-        "chunk_token_size": 1000,
+        "docs_path": docs_path,
+        "chunk_token_size": chunk_token_size,
         "model": model_name,
-        "embedding_model": "all-mpnet-base-v2",
+        "embedding_model": embedding_model,
+        # the model is loaded once per host by the embedding server, not by every process
+        "embedding_function": get_embedding_function(embedding_model),
         "get_or_create": True,
-        "client": chromadb.PersistentClient(path=".chromadb"),
+        "client": get_chroma_client(".chromadb"),
         "collection_name": collection_name,
     }
 
 
 # autogen.ChatCompletion.start_logging()
-def termination_msg(x):
-    """Check if a message is a termination message."""
-    _msg = str(x.get("content", "")).upper().strip().strip("\n").strip(".")
-    return isinstance(x, dict) and (_msg.endswith("TERMINATE") or _msg.startswith("TERMINATE"))
 
 
-def _is_termination_msg(message):
-    """Check if a message is a termination message.
-    Terminate when no code block is detected. Currently only detect python code blocks.
-    """
-    if isinstance(message, dict):
-        message = message.get("content")
-        if message is None:
-            return False
-    cb = extract_code(message)
-    contain_code = False
-    for c in cb:
-        # todo: support more languages
-        if c[0] == "python":
-            contain_code = True
-            break
-    return not contain_code
+def _alternate_roles(self, messages, sender):
+    """Return the context and the messages with the alternating roles required by ERNIE Bot models."""
+    # handle 336006 https://cloud.baidu.com/doc/WENXINWORKSHOP/s/tlmyncueh
+    _context = messages[-1].pop("context", None)
+    return _context, alternated_messages(self, context_window(self, messages, sender), sender)
 
 
 def new_generate_oai_reply(
@@ -88,24 +108,123 @@ def new_generate_oai_reply(
     if messages is None:
         messages = self._oai_messages[sender]
 
-    # handle 336006 https://cloud.baidu.com/doc/WENXINWORKSHOP/s/tlmyncueh
-    _context = messages[-1].pop("context", None)
-    _messages = self._oai_system_message + messages
-    for idx, msg in enumerate(_messages):
-        if idx == 0:
-            continue
-        if idx % 2 == 1:
-            msg["role"] = "user" if msg.get("role") != "function" else "function"
-        else:
-            msg["role"] = "assistant"
-    if len(_messages) % 2 == 1:
-        _messages.append({"content": DEFAULT_AUTO_REPLY, "role": "user"})
+    _context, _messages = _alternate_roles(self, messages, sender)
     # print(f"messages: {_messages}")
     response = client.create(context=_context, messages=_messages)
     # print(f"{response=}")
     return True, client.extract_text_or_function_call(response)[0]
 
 
+async def a_new_generate_oai_reply(
+    self,
+    messages=None,
+    sender=None,
+    config=None,
+):
+    """Generate a reply using autogen.oai without blocking the event loop, the LLM call runs in LLM_EXECUTOR."""
+    client = self.client if config is None else config
+    if client is None:
+        return False, None
+    if messages is None:
+        messages = self._oai_messages[sender]
+
+    _context, _messages = _alternate_roles(self, messages, sender)
+    response = await run_llm(client.create, context=_context, messages=_messages)
+    return True, client.extract_text_or_function_call(response)[0]
+
+
+class LiveMessage:
+    """A chat message growing with the tokens streamed by an LLM call running in a worker thread.
+
+    Tokens arriving while the event loop is busy are buffered and flushed together, so a fast stream
+    doesn't schedule one ui update per token.
+    """
+
+    def __init__(self, instance, user, loop):
+        self.instance = instance
+        self.user = user
+        self.loop = loop
+        self.message = None
+        self.text = ""
+        self._buffer = []
+        self._scheduled = False
+        self._lock = threading.Lock()
+
+    def push(self, token):
+        """Add a token, called from the thread running the LLM call."""
+        with self._lock:
+            self._buffer.append(token)
+            if self._scheduled:
+                return
+            self._scheduled = True
+        self.loop.call_soon_threadsafe(self.flush)
+
+    def flush(self):
+        with self._lock:
+            chunk = "".join(self._buffer)
+            self._buffer.clear()
+            self._scheduled = False
+        if chunk:
+            self.text += chunk
+            self.message = self.instance.stream(chunk, user=self.user, message=self.message)
+
+
+async def stream_oai_reply(
+    self,
+    messages=None,
+    sender=None,
+    config=None,
+    instance=None,
+):
+    """Generate a reply using autogen.oai, streaming the tokens into a live message of the chat interface.
+
+    The message stored in the agent's history is the same as the one of `generate_oai_reply`. The call runs in
+    LLM_EXECUTOR even when streaming is off, so waiting for the rate limits never blocks the event loop.
+    """
+    client = self.client if config is None else config
+    if client is None or instance is None:
+        return False, None
+    if messages is None:
+        messages = self._oai_messages[sender]
+
+    _context = messages[-1].pop("context", None)
+    _messages = self._oai_system_message + context_window(self, messages, sender, client)
+    if not getattr(instance, "stream_replies", STREAM):
+        response = await run_llm(client.create, context=_context, messages=_messages)
+        return True, client.extract_text_or_function_call(response)[0]
+
+    live = LiveMessage(instance, self.name, asyncio.get_running_loop())
+
+    def _create():
+        with stream_tokens(live.push):
+            return client.create(context=_context, messages=_messages, stream=True)
+
+    response = await run_llm(_create)
+    live.flush()
+    if live.message is not None:
+        # agents of a parallel round stream at the same time, each one's message is posted in turn
+        instance.live_messages = {**getattr(instance, "live_messages", {}), self.name: live}
+    return True, client.extract_text_or_function_call(response)[0]
+
+
+def register_stream_reply(agent, instance):
+    """Register `stream_oai_reply` right before the agent's `generate_oai_reply`, only async chats will use it."""
+    for position, reply_func_tuple in enumerate(agent._reply_func_list):
+        if reply_func_tuple["reply_func"] is ConversableAgent.generate_oai_reply:
+            agent.register_reply([Agent, None], partial(stream_oai_reply, instance=instance), position)
+            return
+
+
+def post_message(instance, content, user):
+    """Show a message in the chat interface, unless it was already streamed there."""
+    live = getattr(instance, "live_messages", {}).pop(user, None)
+    if live is not None:
+        if live.text != content:
+            live.message.object = content
+        return
+    instance.send(content, user=user, respond=False)
+
+
 def initialize_agents(
     llm_config, agent_name, system_msg, agent_type, retrieve_config=None, code_execution_config=False
 ):
@@ -116,13 +235,16 @@ def initialize_agents(
         agent = RetrieveUserProxyAgent(
             name=agent_name,
             system_message=system_msg,
-            is_termination_msg=_is_termination_msg,
+            is_termination_msg=is_code_free_msg,
             human_input_mode="TERMINATE",
             max_consecutive_auto_reply=5,
             retrieve_config=retrieve_config,
             code_execution_config=code_execution_config,  # set to False if you don't want to execute the code
             default_auto_reply=DEFAULT_AUTO_REPLY,
         )
+        # the docs are embedded once into a collection shared by all sessions
+        SHARED_COLLECTIONS.ensure(retrieve_config)
+        agent._collection = True
     elif "GPTAssistantAgent" == agent_type:
         agent = GPTAssistantAgent(
             name=agent_name,
@@ -162,12 +284,17 @@ def initialize_agents(
             system_message=system_msg if system_msg else DEFAULT_SYSTEM_MESSAGE,
             llm_config=llm_config,
         )
+    if type(agent.client) is autogen.OpenAIWrapper:
+        agent.client = StreamingOpenAIWrapper(**agent.llm_config)
+    attach_ledger(agent, llm_config["config_list"][0]["model"])
     # if any(["ernie" in cfg["model"].lower() for cfg in llm_config["config_list"]]):
     if "ernie" in llm_config["config_list"][0]["model"].lower():
         # Hack for ERNIE Bot models
         # print("Hack for ERNIE Bot models.")
         agent._reply_func_list.pop(-1)
         agent.register_reply([Agent, None], new_generate_oai_reply, -1)
+        # a_generate_reply tries both variants in order, generate_reply skips the async one
+        agent.register_reply([Agent, None], a_new_generate_oai_reply, -2)
     return agent
 
 
@@ -178,21 +305,16 @@ async def get_human_input(name, prompt: str, instance=None) -> str:
     get_input_widget = pn.widgets.TextAreaInput(placeholder=prompt, name="", sizing_mode="stretch_width")
     get_input_checkbox = pn.widgets.Checkbox(name="Check to Submit Feedback")
     instance.send(pn.Row(get_input_widget, get_input_checkbox), user=name, respond=False)
-    ts = time.time()
-    while True:
-        if time.time() - ts > TIMEOUT:
-            instance.send(
-                f"You didn't provide your feedback in {TIMEOUT} seconds, exit.",
-                user=name,
-                respond=False,
-            )
-            reply = "exit"
-            break
-        if get_input_widget.value != "" and get_input_checkbox.value is True:
-            get_input_widget.disabled = True
-            reply = get_input_widget.value
-            break
-        await asyncio.sleep(0.1)
+    try:
+        reply = await INPUT_BROKER.wait(get_input_widget, get_input_checkbox, TIMEOUT)
+        get_input_widget.disabled = True
+    except asyncio.TimeoutError:
+        instance.send(
+            f"You didn't provide your feedback in {TIMEOUT} seconds, exit.",
+            user=name,
+            respond=False,
+        )
+        reply = "exit"
     return reply
 
 
@@ -211,6 +333,14 @@ async def check_termination_and_human_reply(
     message = messages[-1]
     reply = ""
     no_human_input_msg = ""
+    # a conversation over its token budget ends like one over its auto replies
+    ledger = get_ledger(self)
+    over_budget = (
+        MAX_CONVERSATION_TOKENS
+        and ledger is not None
+        and sender is not None
+        and ledger.update(self, sender) >= MAX_CONVERSATION_TOKENS
+    )
     if self.human_input_mode == "ALWAYS":
         reply = await get_human_input(
             self.name,
@@ -221,7 +351,7 @@ async def check_termination_and_human_reply(
         # if the human input is empty, and the message is a termination message, then we will terminate the conversation
         reply = reply if reply or not self._is_termination_msg(message) else "exit"
     else:
-        if self._consecutive_auto_reply_counter[sender] >= self._max_consecutive_auto_reply_dict[sender]:
+        if over_budget or self._consecutive_auto_reply_counter[sender] >= self._max_consecutive_auto_reply_dict[sender]:
             if self.human_input_mode == "NEVER":
                 reply = "exit"
             else:
@@ -275,193 +405,23 @@ async def check_termination_and_human_reply(
     return False, None
 
 
-async def format_code(code_to_format: str) -> str:
-    """Format the code using isort and black."""
-    filename = f"temp_code_{int(time.time())}_{random.randint(10000, 99999)}.py"
-    with open(filename, "w") as file:
-        file.write(code_to_format)
-    isort.file(filename, profile="black", known_first_party=["autogen"], float_to_top=True)
-
-    formatted_code = ""
-    with open(filename, "r") as file:
-        formatted_code = file.read()
-    os.remove(filename)
+@lru_cache(maxsize=128)
+def _format_code(code_to_format: str) -> str:
+    formatted_code = isort.code(code_to_format, profile="black", known_first_party=["autogen"], float_to_top=True)
+    if black is not None:
+        try:
+            formatted_code = black.format_str(formatted_code, mode=black.Mode(line_length=120))
+        except Exception:  # noqa
+            pass
     return formatted_code
 
 
-async def generate_code(agents, manager, contents, code_editor, groupchat):
-    code = """import autogen
-import os
-from autogen.agentchat.contrib.retrieve_user_proxy_agent import RetrieveUserProxyAgent
-from autogen.agentchat.contrib.math_user_proxy_agent import MathUserProxyAgent
-from autogen.code_utils import extract_code
-
-config_list = autogen.config_list_from_json(
-    "OAI_CONFIG_LIST",
-    file_location=".",
-)
-if not config_list:
-    os.environ["MODEL"] = "<your model name>"
-    os.environ["OPENAI_API_KEY"] = "<your openai api key>"
-    os.environ["OPENAI_BASE_URL"] = "<your openai base url>" # optional
-
-    config_list = autogen.config_list_from_models(
-        model_list=[os.environ.get("MODEL", "gpt-35-turbo")],
-    )
-
-llm_config = {
-    "timeout": 60,
-    "cache_seed": 42,
-    "config_list": config_list,
-    "temperature": 0,
-}
-
-def termination_msg(x):
-    _msg = str(x.get("content", "")).upper().strip().strip("\\n").strip(".")
-    return isinstance(x, dict) and (_msg.endswith("TERMINATE") or _msg.startswith("TERMINATE"))
-
-def _is_termination_msg(message):
-    if isinstance(message, dict):
-        message = message.get("content")
-        if message is None:
-            return False
-    cb = extract_code(message)
-    contain_code = False
-    for c in cb:
-        # todo: support more languages
-        if c[0] == "python":
-            contain_code = True
-            break
-    return not contain_code
-
-agents = []
-
-"""
-
-    for agent in agents:
-        if isinstance(agent, RetrieveUserProxyAgent):
-            _retrieve_config = agent._retrieve_config
-            _retrieve_config["client"] = 'chromadb.PersistentClient(path=".chromadb")'
-            _code = f"""from autogen.agentchat.contrib.retrieve_user_proxy_agent import RetrieveUserProxyAgent
-import chromadb
-
-agent = RetrieveUserProxyAgent(
-    name="{agent.name}",
-    system_message=\"\"\"{agent.system_message}\"\"\",
-    is_termination_msg=_is_termination_msg,
-    human_input_mode="TERMINATE",
-    max_consecutive_auto_reply=5,
-    retrieve_config={_retrieve_config},
-    code_execution_config={agent._code_execution_config},  # set to False if you don't want to execute the code
-    default_auto_reply="{DEFAULT_AUTO_REPLY}",
-)
-
-"""
-            _code = _code.replace(
-                """'chromadb.PersistentClient(path=".chromadb")'""", "chromadb.PersistentClient(path='.chromadb')"
-            )
-        elif isinstance(agent, GPTAssistantAgent):
-            _code = f"""from auotgen.agentchat.contrib.gpt_assistant_agent import GPTAssistantAgent
-
-agent = GPTAssistantAgent(
-    name="{agent.name}",
-    instructions=\"\"\"{agent.system_message}\"\"\",
-    llm_config=llm_config,
-    is_termination_msg=termination_msg,
-)
-
-"""
-        elif isinstance(agent, CompressibleAgent):
-            _code = f"""from autogen.agentchat.contrib.compressible_agent import CompressibleAgent
-
-compress_config = {{
-    "mode": "COMPRESS",
-    "trigger_count": 600,  # set this to a large number for less frequent compression
-    "verbose": True,  # to allow printing of compression information: contex before and after compression
-    "leave_last_n": 2,
-}}
-
-agent = CompressibleAgent(
-    name="{agent.name}",
-    system_message=\"\"\"{agent.system_message}\"\"\",
-    llm_config=llm_config,
-    compress_config=compress_config,
-    is_termination_msg=termination_msg,
-)
-
-"""
-        elif isinstance(agent, UserProxyAgent):
-            _code = f"""from autogen import UserProxyAgent
-
-agent = UserProxyAgent(
-    name="{agent.name}",
-    is_termination_msg=termination_msg,
-    human_input_mode="TERMINATE",
-    system_message=\"\"\"{agent.system_message}\"\"\",
-    default_auto_reply="{DEFAULT_AUTO_REPLY}",
-    max_consecutive_auto_reply=5,
-    code_execution_config={agent._code_execution_config},
-)
-
-"""
-        elif isinstance(agent, RetrieveAssistantAgent):
-            _code = f"""from autogen.agentchat.contrib.retrieve_assistant_agent import RetrieveAssistantAgent
-
-agent = RetrieveAssistantAgent(
-    name="{agent.name}",
-    system_message=\"\"\"{agent.system_message}\"\"\",
-    llm_config=llm_config,
-    is_termination_msg=termination_msg,
-)
-
-"""
-        elif isinstance(agent, AssistantAgent):
-            _code = f"""from autogen import AssistantAgent
-
-agent = AssistantAgent(
-    name="{agent.name}",
-    system_message=\"\"\"{agent.system_message}\"\"\",
-    llm_config=llm_config,
-    is_termination_msg=termination_msg,
-)
-
-"""
-        code += _code + "\n" + "agents.append(agent)\n\n"
-
-    _code = """
-init_sender = None
-for agent in agents:
-    if "UserProxy" in str(type(agent)):
-        init_sender = agent
-        break
-
-if not init_sender:
-    init_sender = agents[0]
-
-"""
-    code += _code
+async def format_code(code_to_format: str) -> str:
+    """Format the code using isort and black in a worker thread, results are cached by the source code."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(FORMAT_EXECUTOR, _format_code, code_to_format)
 
-    if manager:
-        _code = f"""
-groupchat = autogen.GroupChat(
-    agents=agents, messages=[], max_round=12, speaker_selection_method="{groupchat.speaker_selection_method}", allow_repeat_speaker=False
-)  # todo: auto, sometimes message has no name
-manager = autogen.GroupChatManager(groupchat=groupchat, llm_config=llm_config)
 
-recipient = manager
-"""
-    else:
-        _code = """
-recipient = agents[1] if agents[1] != init_sender else agents[0]
-"""
-    code += _code
-
-    _code = f"""
-if isinstance(init_sender, (RetrieveUserProxyAgent, MathUserProxyAgent)):
-    init_sender.initiate_chat(recipient, problem="{contents}")
-else:
-    init_sender.initiate_chat(recipient, message="{contents}")
-"""
-    code += _code
-    code = textwrap.dedent(code)
+async def generate_code(agents, manager, contents, code_editor, groupchat):
+    code = render_script(agents, manager, contents, groupchat)
     code_editor.value = await format_code(code)
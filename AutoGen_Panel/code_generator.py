@@ -0,0 +1,272 @@
+import inspect
+from functools import lru_cache
+
+import speaker_selection
+from autogen import AssistantAgent, UserProxyAgent
+from autogen.agentchat.contrib.compressible_agent import CompressibleAgent
+from autogen.agentchat.contrib.gpt_assistant_agent import GPTAssistantAgent
+from autogen.agentchat.contrib.retrieve_assistant_agent import RetrieveAssistantAgent
+from autogen.agentchat.contrib.retrieve_user_proxy_agent import RetrieveUserProxyAgent
+from configs import DEFAULT_AUTO_REPLY
+
+HEADER = """import autogen
+import os
+import re
+from autogen.agentchat.contrib.retrieve_user_proxy_agent import RetrieveUserProxyAgent
+from autogen.agentchat.contrib.math_user_proxy_agent import MathUserProxyAgent
+from autogen.code_utils import extract_code
+
+config_list = autogen.config_list_from_json(
+    "OAI_CONFIG_LIST",
+    file_location=".",
+)
+if not config_list:
+    os.environ["MODEL"] = "<your model name>"
+    os.environ["OPENAI_API_KEY"] = "<your openai api key>"
+    os.environ["OPENAI_BASE_URL"] = "<your openai base url>" # optional
+
+    config_list = autogen.config_list_from_models(
+        model_list=[os.environ.get("MODEL", "gpt-35-turbo")],
+    )
+
+llm_config = {
+    "timeout": 60,
+    "cache_seed": 42,
+    "config_list": config_list,
+    "temperature": 0,
+}
+
+OPEN_FENCE_RE = re.compile(r"```[ \\t]*(\\w+)?[ \\t]*\\r?\\n")
+CLOSE_FENCE_RE = re.compile(r"\\n[ \\t]*```")
+
+def termination_msg(x):
+    _msg = str(x.get("content", "")).strip().strip(".")
+    return isinstance(x, dict) and (_msg[-9:].upper() == "TERMINATE" or _msg[:9].upper() == "TERMINATE")
+
+def _is_termination_msg(message):
+    if isinstance(message, dict):
+        message = message.get("content")
+        if message is None:
+            return False
+    if not isinstance(message, str):
+        return not any(c[0] == "python" for c in extract_code(message))
+    # stop at the first python code block, todo: support more languages
+    opening = OPEN_FENCE_RE.search(message)
+    while opening:
+        closing = CLOSE_FENCE_RE.search(message, opening.end())
+        if not closing:
+            return True
+        if opening.group(1) == "python":
+            return False
+        opening = OPEN_FENCE_RE.search(message, closing.end())
+    return True
+
+agents = []
+
+"""
+
+RETRIEVE_USER_PROXY_AGENT = """from autogen.agentchat.contrib.retrieve_user_proxy_agent import RetrieveUserProxyAgent
+import chromadb
+
+agent = RetrieveUserProxyAgent(
+    name="{name}",
+    system_message=\"\"\"{system_message}\"\"\",
+    is_termination_msg=_is_termination_msg,
+    human_input_mode="TERMINATE",
+    max_consecutive_auto_reply=5,
+    retrieve_config={retrieve_config},
+    code_execution_config={code_execution_config},  # set to False if you don't want to execute the code
+    default_auto_reply="{default_auto_reply}",
+)
+
+"""
+
+GPT_ASSISTANT_AGENT = """from autogen.agentchat.contrib.gpt_assistant_agent import GPTAssistantAgent
+
+agent = GPTAssistantAgent(
+    name="{name}",
+    instructions=\"\"\"{system_message}\"\"\",
+    llm_config=llm_config,
+    is_termination_msg=termination_msg,
+)
+
+"""
+
+COMPRESSIBLE_AGENT = """from autogen.agentchat.contrib.compressible_agent import CompressibleAgent
+
+compress_config = {{
+    "mode": "COMPRESS",
+    "trigger_count": 600,  # set this to a large number for less frequent compression
+    "verbose": True,  # to allow printing of compression information: contex before and after compression
+    "leave_last_n": 2,
+}}
+
+agent = CompressibleAgent(
+    name="{name}",
+    system_message=\"\"\"{system_message}\"\"\",
+    llm_config=llm_config,
+    compress_config=compress_config,
+    is_termination_msg=termination_msg,
+)
+
+"""
+
+USER_PROXY_AGENT = """from autogen import UserProxyAgent
+
+agent = UserProxyAgent(
+    name="{name}",
+    is_termination_msg=termination_msg,
+    human_input_mode="TERMINATE",
+    system_message=\"\"\"{system_message}\"\"\",
+    default_auto_reply="{default_auto_reply}",
+    max_consecutive_auto_reply=5,
+    code_execution_config={code_execution_config},
+)
+
+"""
+
+RETRIEVE_ASSISTANT_AGENT = """from autogen.agentchat.contrib.retrieve_assistant_agent import RetrieveAssistantAgent
+
+agent = RetrieveAssistantAgent(
+    name="{name}",
+    system_message=\"\"\"{system_message}\"\"\",
+    llm_config=llm_config,
+    is_termination_msg=termination_msg,
+)
+
+"""
+
+ASSISTANT_AGENT = """from autogen import AssistantAgent
+
+agent = AssistantAgent(
+    name="{name}",
+    system_message=\"\"\"{system_message}\"\"\",
+    llm_config=llm_config,
+    is_termination_msg=termination_msg,
+)
+
+"""
+
+# the first matching class wins, so subclasses must come before their parents
+AGENT_TEMPLATES = [
+    (RetrieveUserProxyAgent, RETRIEVE_USER_PROXY_AGENT),
+    (GPTAssistantAgent, GPT_ASSISTANT_AGENT),
+    (CompressibleAgent, COMPRESSIBLE_AGENT),
+    (UserProxyAgent, USER_PROXY_AGENT),
+    (RetrieveAssistantAgent, RETRIEVE_ASSISTANT_AGENT),
+    (AssistantAgent, ASSISTANT_AGENT),
+]
+
+INIT_SENDER = """
+init_sender = None
+for agent in agents:
+    if "UserProxy" in str(type(agent)):
+        init_sender = agent
+        break
+
+if not init_sender:
+    init_sender = agents[0]
+
+"""
+
+GROUPCHAT_RECIPIENT = """
+groupchat = {groupchat_class}(
+    agents=agents, messages=[], max_round=12, speaker_selection_method="{speaker_selection_method}", allow_repeat_speaker=False
+)  # todo: auto, sometimes message has no name
+manager = autogen.GroupChatManager(groupchat=groupchat, llm_config=llm_config)
+
+recipient = manager
+"""
+
+# the script defines LocalGroupChat itself, it can't import it from the app
+LOCAL_GROUPCHAT = inspect.getsource(speaker_selection)
+
+AGENT_RECIPIENT = """
+recipient = agents[1] if agents[1] != init_sender else agents[0]
+"""
+
+CHAT_START = """
+if isinstance(init_sender, (RetrieveUserProxyAgent, MathUserProxyAgent)):
+    init_sender.initiate_chat(recipient, problem="{contents}")
+else:
+    init_sender.initiate_chat(recipient, message="{contents}")
+"""
+
+
+class _Code(str):
+    """A string rendered as source code, i.e. without quotes, when it is part of a dict in a template."""
+
+    def __repr__(self):
+        return str(self)
+
+
+RETRIEVE_CLIENT = _Code("chromadb.PersistentClient(path='.chromadb')")
+
+
+@lru_cache(maxsize=None)
+def _agent_template(agent_class):
+    for base, template in AGENT_TEMPLATES:
+        if issubclass(agent_class, base):
+            return template
+    return None
+
+
+def agent_spec(agent):
+    """Return the hashable spec of an agent, i.e. everything its code fragment depends on."""
+    retrieve_config = getattr(agent, "_retrieve_config", None)
+    if retrieve_config is not None:
+        # the script embeds with autogen's default embedding function of `embedding_model`
+        retrieve_config = {k: v for k, v in retrieve_config.items() if k != "embedding_function"}
+        retrieve_config = repr({**retrieve_config, "client": RETRIEVE_CLIENT})
+    return (
+        type(agent),
+        agent.name,
+        agent.system_message,
+        repr(getattr(agent, "_code_execution_config", False)),
+        retrieve_config,
+    )
+
+
+@lru_cache(maxsize=256)
+def render_agent(spec):
+    """Render the code fragment creating one agent, cached by the agent spec."""
+    agent_class, name, system_message, code_execution_config, retrieve_config = spec
+    template = _agent_template(agent_class)
+    if template is None:
+        return ""
+    _code = template.format(
+        name=name,
+        system_message=system_message,
+        code_execution_config=code_execution_config,
+        retrieve_config=retrieve_config,
+        default_auto_reply=DEFAULT_AUTO_REPLY,
+    )
+    return _code + "\n" + "agents.append(agent)\n\n"
+
+
+@lru_cache(maxsize=16)
+def render_recipient(speaker_selection_method):
+    if speaker_selection_method is None:
+        return AGENT_RECIPIENT
+    if speaker_selection_method == "local":
+        return LOCAL_GROUPCHAT + GROUPCHAT_RECIPIENT.format(
+            groupchat_class="LocalGroupChat", speaker_selection_method=speaker_selection_method
+        )
+    return GROUPCHAT_RECIPIENT.format(
+        groupchat_class="autogen.GroupChat", speaker_selection_method=speaker_selection_method
+    )
+
+
+@lru_cache(maxsize=64)
+def render_chat_start(contents):
+    return CHAT_START.format(contents=contents)
+
+
+def render_script(agents, manager, contents, groupchat):
+    """Render a standalone script reproducing the chat, only changed fragments are rendered again."""
+    speaker_selection_method = groupchat.speaker_selection_method if manager else None
+    return "".join(
+        [HEADER]
+        + [render_agent(agent_spec(agent)) for agent in agents]
+        + [INIT_SENDER, render_recipient(speaker_selection_method), render_chat_start(contents)]
+    )
@@ -1,6 +1,30 @@
+import os
+
 import autogen
 
 TIMEOUT = 60
+TEAM_POOL_SIZE = 32  # max number of warm agent teams kept in memory
+TEAM_POOL_TTL = 1800  # seconds before a warm agent team is rebuilt
+STREAM = True  # stream the tokens of LLM replies into the chat
+LLM_WORKERS = 16  # max number of LLM calls running at the same time off the event loop
+# requests and tokens per minute allowed per endpoint and model, shared by all sessions, None for no limit
+RATE_LIMITS = {
+    "default": {"requests_per_minute": 300, "tokens_per_minute": 60000},
+    "gpt-4": {"requests_per_minute": 200, "tokens_per_minute": 40000},
+}
+# processes serving the app, e.g. `panel serve --num-procs`, each one schedules its share of the rate limits
+WORKER_PROCS = int(os.environ.get("PANEL_NUM_PROCS", 1))
+LLM_RETRIES = 3  # retries of a rate limited or failed LLM call, coordinated by the scheduler
+HEDGE_REQUESTS = False  # also send a slow LLM call to the next endpoint of the config list, the first reply wins
+HEDGE_QUANTILE = 0.95  # a call is slow once it runs longer than this quantile of its endpoint's latencies
+PARALLEL_REPLIES = 4  # max number of agents of a parallel round generating their replies at the same time
+CONTEXT_TOKENS = 0  # max history tokens an agent sends to the LLM, older ones are summarized, 0 for all, set per team
+SUMMARY_CACHE_SIZE = 1024  # rolling summaries kept in memory, shared by all sessions
+MAX_CONVERSATION_TOKENS = 200000  # tokens of a conversation between two agents before it stops, 0 for no limit
+SESSION_IDLE_TTL = 3600  # seconds before the agents and histories of an idle session are released
+SESSIONS_MEMORY = 1 << 30  # estimated bytes of all the sessions before the least recently active idle ones are released
+MAX_RSS = None  # bytes of the process before idle sessions are released, None for no limit
+COLLECTION_IDLE_TTL = 86400  # seconds before a RAG collection no session uses is deleted from disk
 TITLE = "Microsoft AutoGen Group Chat Playground"
 Q1 = "What's AutoGen?"
 Q2 = "Write a python function to compute the sum of numbers."
@@ -0,0 +1,224 @@
+import contextvars
+import hashlib
+import json
+import logging
+import sys
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from configs import CONTEXT_TOKENS, SUMMARY_CACHE_SIZE
+from shared_store import SHARED_STORE
+from token_accounting import message_tokens
+
+logger = logging.getLogger(__name__)
+
+KEEP_SHARE = 0.5  # share of the budget kept verbatim when the summary is rolled forward
+SUMMARY_SHARE = 0.25  # share of the budget a summary may take
+SUMMARY_TTL = 7 * 24 * 3600  # seconds a summary is kept in the shared store
+SUMMARY_PROMPT = (
+    "You summarize conversations between several participants. Keep the task, the decisions, the open questions, "
+    "the facts, numbers, names and code that later messages may need, and who said what. Be concise, write the "
+    "summary only."
+)
+
+# the summaries are made in the background, the chats never wait for them
+SUMMARY_EXECUTOR = ThreadPoolExecutor(max_workers=4, thread_name_prefix="summary")
+
+
+def _speaker(message):
+    return message.get("name") or message.get("role", "user")
+
+
+class SummaryCache:
+    """The rolling summaries of all the conversations, keyed by the hash of the messages they cover.
+
+    A summary is made once for a given history, e.g. the same preset run by several sessions. The recent ones are
+    kept in memory, all of them in `store`, shared with the other worker processes.
+    """
+
+    def __init__(self, max_size=SUMMARY_CACHE_SIZE, store=SHARED_STORE):
+        self.max_size = max_size
+        self.store = store
+        self._summaries = OrderedDict()  # prefix hash -> summary
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.summarized = 0
+        self.failed = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._summaries.get(key)
+            if entry is not None:
+                self._summaries.move_to_end(key)
+                self.hits += 1
+                return entry
+        # made by another worker process
+        entry = self.store.get(f"summary:{key}") if self.store is not None else None
+        if entry is not None:
+            with self._lock:
+                self.hits += 1
+                self._remember(key, entry)
+        return entry
+
+    def put(self, key, entry):
+        if self.store is not None:
+            self.store.set(f"summary:{key}", entry, ttl=SUMMARY_TTL)
+        with self._lock:
+            self.summarized += 1
+            self._remember(key, entry)
+
+    def _remember(self, key, entry):
+        self._summaries[key] = entry
+        self._summaries.move_to_end(key)
+        while len(self._summaries) > self.max_size:
+            self._summaries.popitem(last=False)
+
+
+SUMMARIES = SummaryCache()
+
+
+class ContextWindow:
+    """The messages of one conversation sent to the LLM, within a token budget.
+
+    While the history fits in `budget` it is sent as is. Beyond, the older messages are replaced by a rolling
+    summary: once the summary and the messages after it exceed the budget, the messages before the newest ones
+    fitting in KEEP_SHARE of the budget are summarized together with the previous summary, in SUMMARY_EXECUTOR.
+    No turn waits for a summary and no message is left out before a summary covers it: until the new summary is
+    ready, the previous one and all the messages after it are sent, even over the budget. The messages sent only
+    change when a summary is ready, so the list sent on a turn starts with the one sent on the previous turn, e.g.
+    for the alternating roles of ERNIE. Each message is counted and hashed once.
+    """
+
+    def __init__(self, budget=CONTEXT_TOKENS, summaries=SUMMARIES):
+        self.budget = budget
+        self.summaries = summaries
+        # the callback of a summary already made runs in the thread submitting it
+        self._lock = threading.RLock()
+        self._model = ""
+        self._reset(None)
+
+    def __sizeof__(self):
+        # the messages are the agent's, the summaries are shared
+        size = object.__sizeof__(self) + sys.getsizeof(self._hashes) + sys.getsizeof(self._tokens)
+        size += sum(sys.getsizeof(h) for h in self._hashes) + sum(sys.getsizeof(t) for t in self._tokens)
+        if self._summary is not None:
+            size += sys.getsizeof(self._summary[1]) + sys.getsizeof(self._summary[1]["content"])
+        return size
+
+    def _reset(self, messages):
+        self._messages = messages
+        self._hashes = []  # hash of the history up to each message
+        self._tokens = []
+        self._summary = None  # (messages covered, summary message, tokens)
+        self._pending = None  # messages covered by the summary being made
+        self._last = None
+
+    def _update(self, messages, model):
+        self._model = model
+        n = len(self._hashes)
+        if messages is not self._messages or len(messages) < n or (n and messages[n - 1] is not self._last):
+            # the history was cleared or rewritten
+            self._reset(messages)
+            n = 0
+        for message in messages[n:]:
+            previous = self._hashes[-1] if self._hashes else ""
+            payload = json.dumps(
+                [previous, message.get("role"), _speaker(message), message.get("content")], default=str
+            )
+            self._hashes.append(hashlib.sha256(payload.encode("utf-8")).hexdigest())
+            self._tokens.append(message_tokens(message, model))
+        self._last = messages[-1] if messages else None
+
+    def _set_summary(self, end, text):
+        if self._summary is None or end > self._summary[0]:
+            message = {"role": "user", "name": "summary", "content": f"Summary of the earlier conversation:\n{text}"}
+            self._summary = (end, message, message_tokens(message, self._model))
+
+    def _summarize(self, client, previous, messages):
+        transcript = "\n\n".join(f"{_speaker(message)}: {message.get('content')}" for message in messages)
+        if previous:
+            transcript = f"Summary so far:\n{previous['content']}\n\nNew messages:\n{transcript}"
+        max_tokens = max(64, int(self.budget * SUMMARY_SHARE))
+        response = client.create(
+            messages=[{"role": "system", "content": SUMMARY_PROMPT}, {"role": "user", "content": transcript}],
+            max_tokens=max_tokens,
+        )
+        return client.extract_text_or_function_call(response)[0] or ""
+
+    def _roll(self, client, end):
+        """Summarize the history up to message `end`, from the cache or in the background."""
+        key = self._hashes[end - 1]
+        text = self.summaries.get(key)
+        if text is not None:
+            self._set_summary(end, text)
+            return
+        start, previous = (self._summary[0], self._summary[1]) if self._summary else (0, None)
+        self._pending = end
+        messages = self._messages
+        # the summary is made in the context of the chat, e.g. its session for the scheduler
+        context = contextvars.copy_context()
+        future = SUMMARY_EXECUTOR.submit(context.run, self._summarize, client, previous, list(messages[start:end]))
+
+        def _done(future):
+            with self._lock:
+                if self._messages is messages:
+                    self._pending = None
+                if future.exception() is not None:
+                    logger.warning(f"failed to summarize the conversation: {future.exception()!r}")
+                    self.summaries.failed += 1
+                    return
+                text = future.result()
+                self.summaries.put(key, text)
+                if self._messages is messages:
+                    self._set_summary(end, text)
+
+        future.add_done_callback(_done)
+
+    def window(self, messages, client, model=""):
+        """Return the messages to send, the newest ones after the summary of the older ones, within the budget once
+        the summaries are made."""
+        if not self.budget or not messages:
+            return messages
+        with self._lock:
+            self._update(messages, model)
+            if sum(self._tokens) <= self.budget:
+                return messages
+            start, summary, summary_tokens = self._summary or (0, None, 0)
+            if summary_tokens + sum(self._tokens[start:]) > self.budget and self._pending is None and client:
+                # roll the summary forward, the newest messages within KEEP_SHARE of the budget are kept
+                end, kept = len(messages) - 1, self._tokens[-1]
+                while end > start and kept + self._tokens[end - 1] <= self.budget * KEEP_SHARE:
+                    end -= 1
+                    kept += self._tokens[end]
+                if end > start:
+                    self._roll(client, end)
+                    start, summary, _ = self._summary or (0, None, 0)
+            # the messages not summarized yet are all sent
+            return [summary] + messages[start:] if summary else messages
+
+
+def context_window(agent, messages, sender, client=None):
+    """Return the messages of `agent` with `sender` to send to the LLM, within the agent's token budget.
+
+    The budget is the agent's `context_tokens`, set for its team, CONTEXT_TOKENS by default, 0 sends the full history.
+    """
+    client = agent.client if client is None else client
+    budget = getattr(agent, "context_tokens", CONTEXT_TOKENS)
+    if not budget or client is None:
+        return messages
+    windows = agent.__dict__.setdefault("_context_windows", {})
+    window = windows.get(sender)
+    if window is None:
+        window = windows[sender] = ContextWindow(budget)
+    config_list = getattr(client, "_config_list", None) or [{}]
+    return window.window(messages, client, config_list[0].get("model", ""))
+
+
+def metrics():
+    """Return the rolling summaries made, reused from the cache and failed, in all sessions."""
+    return {
+        "summaries": SUMMARIES.summarized,
+        "summary_cache_hits": SUMMARIES.hits,
+        "summary_failures": SUMMARIES.failed,
+    }
@@ -0,0 +1,307 @@
+import json
+import logging
+import os
+import queue
+import socket
+import socketserver
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from array import array
+from concurrent.futures import Future
+
+from embeddings import EMBEDDING_BACKEND, LocalEmbeddings, embedding_id, load_backend
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows, the embeddings are computed in each process
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# One server per host, model and backend holds the embedding model, the processes of all the apps embed through it.
+# EMBEDDING_SERVER=0 embeds in each process instead.
+SERVER_ENABLED = os.environ.get("EMBEDDING_SERVER", "1") != "0" and hasattr(socket, "AF_UNIX") and fcntl is not None
+SOCKET_DIR = os.environ.get("EMBEDDING_SOCKET_DIR", tempfile.gettempdir())
+MAX_BATCH = int(os.environ.get("EMBEDDING_MAX_BATCH", 64))  # texts embedded together
+MAX_WAIT = 0.005  # seconds a request waits for the requests of other callers to join its batch
+START_TIMEOUT = 300  # seconds to wait for a server to load its model
+RETRY_AFTER = 30  # seconds the embeddings are computed in the process before the server is tried again
+_HEADER = struct.Struct("!I")
+
+
+def socket_path(model_name, backend=EMBEDDING_BACKEND, directory=SOCKET_DIR):
+    return os.path.join(directory, f"autogen_embeddings_{model_name.replace('/', '_')}_{backend}.sock")
+
+
+def _send(sock, header, payload=b""):
+    data = json.dumps(header).encode("utf-8")
+    sock.sendall(_HEADER.pack(len(data)) + data + _HEADER.pack(len(payload)) + payload)
+
+
+def _recv_exactly(sock, n):
+    buf = bytearray()
+    while len(buf) < n:
+        chunk = sock.recv(n - len(buf))
+        if not chunk:
+            raise ConnectionError("the embedding server closed the connection")
+        buf += chunk
+    return bytes(buf)
+
+
+def _recv(sock):
+    header = json.loads(_recv_exactly(sock, _HEADER.unpack(_recv_exactly(sock, _HEADER.size))[0]))
+    payload = _recv_exactly(sock, _HEADER.unpack(_recv_exactly(sock, _HEADER.size))[0])
+    return header, payload
+
+
+class Batcher:
+    """Embed the texts of concurrent callers together, in batches of up to `max_batch` texts.
+
+    A request waits at most `max_wait` for others to join its batch, a single caller only pays `max_wait` once per
+    call, all of them share the fixed cost of a forward pass.
+    """
+
+    def __init__(self, encode, max_batch=MAX_BATCH, max_wait=MAX_WAIT):
+        self.encode = encode
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._requests = queue.Queue()
+        self.counts = {"requests": 0, "texts": 0, "batches": 0}
+        threading.Thread(target=self._run, daemon=True, name="embedding_batcher").start()
+
+    def embed(self, texts):
+        future = Future()
+        self._requests.put((texts, future))
+        return future.result()
+
+    def _run(self):
+        while True:
+            batch = [self._requests.get()]
+            n_texts = len(batch[0][0])
+            deadline = time.monotonic() + self.max_wait
+            while n_texts < self.max_batch:
+                try:
+                    request = self._requests.get(timeout=max(0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                batch.append(request)
+                n_texts += len(request[0])
+            texts = [text for request_texts, _ in batch for text in request_texts]
+            try:
+                embeddings = self.encode(texts)
+            except Exception as e:  # noqa
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            self.counts["requests"] += len(batch)
+            self.counts["texts"] += len(texts)
+            self.counts["batches"] += 1
+            start = 0
+            for request_texts, future in batch:
+                future.set_result(embeddings[start : start + len(request_texts)])
+                start += len(request_texts)
+
+
+class _Handler(socketserver.BaseRequestHandler):
+    def handle(self):
+        while True:
+            try:
+                header, _ = _recv(self.request)
+            except (ConnectionError, OSError):
+                return
+            try:
+                if header.get("op") == "stats":
+                    _send(self.request, {"model": self.server.model_name, **self.server.batcher.counts})
+                    continue
+                embeddings = self.server.batcher.embed(header["texts"])
+                dim = len(embeddings[0]) if len(embeddings) else 0
+                payload = array("f", [value for embedding in embeddings for value in embedding]).tobytes()
+                _send(self.request, {"n": len(embeddings), "dim": dim}, payload)
+            except Exception as e:  # noqa
+                _send(self.request, {"error": repr(e)})
+
+
+if hasattr(socketserver, "UnixStreamServer"):
+
+    class EmbeddingServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+        """Serve the embeddings of one model over a Unix socket, one thread per connected caller."""
+
+        daemon_threads = True
+
+        def __init__(self, path, encode, model_name, max_batch=MAX_BATCH, max_wait=MAX_WAIT):
+            self.model_name = model_name
+            self.batcher = Batcher(encode, max_batch, max_wait)
+            if os.path.exists(path):
+                os.unlink(path)  # left by a server which died, the caller holds the start lock
+            super().__init__(path, _Handler)
+
+else:
+    EmbeddingServer = None
+
+
+def _connect(path):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except OSError:
+        sock.close()
+        raise
+    return sock
+
+
+def ensure_server(model_name, backend=EMBEDDING_BACKEND, path=None, timeout=START_TIMEOUT):
+    """Connect to the embedding server of `model_name`, starting it if no process of the host has yet."""
+    path = path or socket_path(model_name, backend)
+    try:
+        return _connect(path)
+    except OSError:
+        pass
+    # one process starts the server, the others wait for it
+    with open(path + ".lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            return _connect(path)
+        except OSError:
+            pass
+        logger.info(f"starting the embedding server of {model_name} on {path}")
+        process = subprocess.Popen(
+            [
+                sys.executable,
+                os.path.abspath(__file__),
+                "serve",
+                "--model",
+                model_name,
+                "--backend",
+                backend,
+                "--socket",
+                path,
+            ],
+            stdin=subprocess.DEVNULL,
+            start_new_session=True,  # the server outlives the process starting it, e.g. a recycled worker
+        )
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            try:
+                return _connect(path)
+            except OSError:
+                if process.poll() is not None:
+                    raise RuntimeError(f"the embedding server of {model_name} exited with {process.returncode}")
+                time.sleep(0.2)
+    raise TimeoutError(f"the embedding server of {model_name} didn't start within {timeout} seconds")
+
+
+class EmbeddingClient:
+    """A chromadb embedding function computing the embeddings in the embedding server of the host.
+
+    Each thread keeps its own connection. If the server can't be reached, the embeddings are computed in this process
+    instead, with the same model and backend, and the server is tried again `retry_after` seconds later.
+    """
+
+    def __init__(self, model_name, backend=EMBEDDING_BACKEND, path=None, retry_after=RETRY_AFTER, clock=time.monotonic):
+        self.model_name = model_name
+        self.backend = backend
+        self.path = path or socket_path(model_name, backend)
+        self.retry_after = retry_after
+        self.clock = clock
+        self._local = threading.local()
+        self._fallback = None
+        self._retry_at = None
+        self.fallbacks = 0  # calls embedded in this process
+
+    def _connection(self):
+        sock = getattr(self._local, "sock", None)
+        if sock is None:
+            sock = self._local.sock = ensure_server(self.model_name, self.backend, self.path)
+        return sock
+
+    def _request(self, header):
+        for attempt in range(2):
+            try:
+                sock = self._connection()
+                _send(sock, header)
+                return _recv(sock)
+            except (ConnectionError, OSError):
+                # the server was restarted, connect again once
+                sock, self._local.sock = getattr(self._local, "sock", None), None
+                if sock is not None:
+                    sock.close()
+                if attempt:
+                    raise
+
+    def __call__(self, input):
+        retry_at = self._retry_at
+        if retry_at is None or self.clock() >= retry_at:
+            try:
+                header, payload = self._request({"texts": list(input)})
+            except (ConnectionError, OSError, RuntimeError) as e:
+                logger.warning(
+                    f"embedding in this process for {self.retry_after} s, the embedding server is unavailable: {e!r}"
+                )
+                self._retry_at = self.clock() + self.retry_after
+                if self._fallback is None:
+                    self._fallback = LocalEmbeddings(self.model_name, self.backend)
+            else:
+                if retry_at is not None:
+                    logger.info(
+                        f"embedding in the embedding server again, after {self.fallbacks} calls in this process"
+                    )
+                    self._retry_at = None
+                if "error" in header:
+                    raise RuntimeError(f"embedding server: {header['error']}")
+                values = array("f")
+                values.frombytes(payload)
+                dim = header["dim"]
+                return [values[i * dim : (i + 1) * dim].tolist() for i in range(header["n"])]
+        self.fallbacks += 1
+        return self._fallback(input)
+
+    def stats(self):
+        return {**self._request({"op": "stats"})[0], "fallbacks": self.fallbacks}
+
+
+_CLIENTS = {}
+_CLIENTS_LOCK = threading.Lock()
+
+
+def _forget_after_fork():
+    # a forked process connects on its own, the connections of the parent aren't shared
+    global _CLIENTS_LOCK
+    _CLIENTS.clear()
+    _CLIENTS_LOCK = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_forget_after_fork)
+
+
+def get_embedding_function(model_name, backend=EMBEDDING_BACKEND):
+    """Return the embedding function of `model_name` for a retrieve config, through the server of the host if enabled.
+
+    Collections should be keyed by `embedding_id(model_name, backend)`, the backends don't all give the same vectors.
+    """
+    if not SERVER_ENABLED:
+        return LocalEmbeddings(model_name, backend)
+    with _CLIENTS_LOCK:
+        client = _CLIENTS.get((model_name, backend))
+        if client is None:
+            client = _CLIENTS[(model_name, backend)] = EmbeddingClient(model_name, backend)
+        return client
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="The embedding server of the host.")
+    parser.add_argument("command", choices=["serve"])
+    parser.add_argument("--model", default="all-mpnet-base-v2")
+    parser.add_argument("--backend", default=EMBEDDING_BACKEND)
+    parser.add_argument("--socket", default=None)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    path = args.socket or socket_path(args.model, args.backend)
+    server = EmbeddingServer(path, load_backend(args.model, args.backend), embedding_id(args.model, args.backend))
+    server.serve_forever()
@@ -0,0 +1,169 @@
+import json
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+# torch: the sentence transformer, as autogen embeds by default. onnx: the same model with onnxruntime, the same
+# vectors without torch. onnx-int8: the onnx model with its weights quantized to int8, faster on CPU, slightly
+# different vectors, see `python benchmarks/embeddings.py` for the recall against the torch model.
+BACKENDS = ("torch", "onnx", "onnx-int8")
+EMBEDDING_BACKEND = os.environ.get("EMBEDDING_BACKEND", "torch")
+BATCH_SIZE = int(os.environ.get("EMBEDDING_BATCH_SIZE", 32))  # texts per forward pass
+MODEL_DIR = os.environ.get("EMBEDDING_MODEL_DIR", os.path.join(".cache", "embedding_models"))
+
+
+def available_cores():
+    """Return the cores this process may run on, e.g. the cpuset of its container, not the cores of the host."""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:  # not available on macOS and Windows
+        return os.cpu_count() or 1
+
+
+THREADS = int(os.environ.get("EMBEDDING_THREADS", available_cores()))
+
+
+def embedding_id(model_name, backend=EMBEDDING_BACKEND):
+    """Return the id of the vectors of a model and backend, to keep the vectors of different ids apart.
+
+    The fp32 backends give the same vectors, the int8 one slightly different ones.
+    """
+    return f"{model_name}-int8" if backend.endswith("int8") else model_name
+
+
+def _repo_id(model_name):
+    return model_name if "/" in model_name else f"sentence-transformers/{model_name}"
+
+
+class TorchBackend:
+    """The sentence transformer on CPU, the vectors of autogen's default embedding function."""
+
+    def __init__(self, model_name, batch_size=BATCH_SIZE, threads=THREADS):
+        import torch
+        from sentence_transformers import SentenceTransformer
+
+        torch.set_num_threads(threads)
+        self.batch_size = batch_size
+        self.model = SentenceTransformer(model_name, device="cpu")
+
+    def __call__(self, texts):
+        return self.model.encode(list(texts), batch_size=self.batch_size, convert_to_numpy=True).tolist()
+
+
+def _quantize(onnx_path, model_name, directory=MODEL_DIR):
+    """Return the path of the model with its weights quantized to int8, quantized once per host."""
+    path = os.path.join(directory, f"{model_name.replace('/', '_')}-int8.onnx")
+    if not os.path.exists(path):
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        os.makedirs(directory, exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        quantize_dynamic(onnx_path, tmp, weight_type=QuantType.QInt8)
+        os.replace(tmp, path)
+    return path
+
+
+class OnnxBackend:
+    """The onnx export of a sentence transformer in onnxruntime, with its tokenizer, pooling and normalization.
+
+    The texts are sorted by length, so that the texts of a batch need little padding.
+    """
+
+    def __init__(self, model_name, batch_size=BATCH_SIZE, threads=THREADS, quantize=False):
+        import onnxruntime as ort
+        from huggingface_hub import snapshot_download
+        from tokenizers import Tokenizer
+
+        path = snapshot_download(
+            _repo_id(model_name),
+            allow_patterns=[
+                "onnx/model.onnx",
+                "tokenizer.json",
+                "modules.json",
+                "sentence_bert_config.json",
+                "1_Pooling/config.json",
+            ],
+        )
+        onnx_path = os.path.join(path, "onnx", "model.onnx")
+        if quantize:
+            onnx_path = _quantize(onnx_path, model_name)
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = threads
+        options.inter_op_num_threads = 1
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        session = ort.InferenceSession(onnx_path, options, providers=["CPUExecutionProvider"])
+        with open(os.path.join(path, "sentence_bert_config.json")) as f:
+            max_length = json.load(f).get("max_seq_length", 512)
+        with open(os.path.join(path, "1_Pooling", "config.json")) as f:
+            mean_pooling = json.load(f).get("pooling_mode_mean_tokens", True)
+        with open(os.path.join(path, "modules.json")) as f:
+            normalize = any(module["type"].endswith("Normalize") for module in json.load(f))
+        self._init(session, Tokenizer.from_file(os.path.join(path, "tokenizer.json")), max_length, batch_size)
+        self.mean_pooling = mean_pooling
+        self.normalize = normalize
+
+    def _init(self, session, tokenizer, max_length, batch_size):
+        self.session = session
+        self.input_names = {i.name for i in session.get_inputs()}
+        tokenizer.enable_truncation(max_length=max_length)
+        if tokenizer.padding is None:
+            tokenizer.enable_padding()
+        self.tokenizer = tokenizer
+        self.batch_size = batch_size
+
+    def __call__(self, texts):
+        import numpy as np
+
+        texts = list(texts)
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        embeddings = [None] * len(texts)
+        for start in range(0, len(order), self.batch_size):
+            batch = order[start : start + self.batch_size]
+            encodings = self.tokenizer.encode_batch([texts[i] for i in batch])
+            input_ids = np.array([e.ids for e in encodings], dtype=np.int64)
+            attention_mask = np.array([e.attention_mask for e in encodings], dtype=np.int64)
+            feeds = {"input_ids": input_ids, "attention_mask": attention_mask}
+            if "token_type_ids" in self.input_names:
+                feeds["token_type_ids"] = np.zeros_like(input_ids)
+            tokens = self.session.run(None, feeds)[0]  # batch x tokens x dim
+            if self.mean_pooling:
+                mask = attention_mask[:, :, None].astype(tokens.dtype)
+                pooled = (tokens * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            else:
+                pooled = tokens[:, 0]
+            if self.normalize:
+                pooled = pooled / np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+            for i, embedding in zip(batch, pooled):
+                embeddings[i] = embedding.tolist()
+        return embeddings
+
+
+_BACKENDS = {}
+_BACKENDS_LOCK = threading.Lock()
+
+
+def load_backend(model_name, backend=EMBEDDING_BACKEND, batch_size=BATCH_SIZE, threads=THREADS):
+    """Return the embedding backend of `model_name`, loaded once per process."""
+    if backend not in BACKENDS:
+        raise ValueError(f"EMBEDDING_BACKEND must be one of {BACKENDS}, got {backend}")
+    key = (model_name, backend, batch_size, threads)
+    with _BACKENDS_LOCK:
+        if key not in _BACKENDS:
+            if backend == "torch":
+                _BACKENDS[key] = TorchBackend(model_name, batch_size, threads)
+            else:
+                _BACKENDS[key] = OnnxBackend(model_name, batch_size, threads, quantize=backend == "onnx-int8")
+        return _BACKENDS[key]
+
+
+class LocalEmbeddings:
+    """A chromadb embedding function computing the embeddings in this process, with the backend loaded on first use."""
+
+    def __init__(self, model_name, backend=EMBEDDING_BACKEND):
+        self.model_name = model_name
+        self.backend = backend
+
+    def __call__(self, input):
+        return load_backend(self.model_name, self.backend)(input)
@@ -0,0 +1,139 @@
+from dataclasses import dataclass
+from functools import partial
+
+import autogen
+from autogen.agentchat.contrib.retrieve_user_proxy_agent import RetrieveUserProxyAgent
+from autogen_utils import (
+    check_termination_and_human_reply,
+    get_retrieve_config,
+    initialize_agents,
+    post_message,
+    register_stream_reply,
+)
+from configs import CONTEXT_TOKENS
+from llm_client import StreamingOpenAIWrapper
+from parallel_rounds import ParallelGroupChatManager, parse_parallel_groups
+from speaker_selection import LocalGroupChat
+from team_pool import team_key
+
+
+@dataclass(frozen=True)
+class TeamSpec:
+    """The settings of a team read from the widgets of one session, the teams are built from them only."""
+
+    agents: tuple  # (name, system message, agent type, docs path) of each agent
+    model: str
+    code_execution: bool
+    speaker_selection_method: str
+    parallel_groups: str = ""
+    context_tokens: int = CONTEXT_TOKENS
+
+    def key(self, config_key):
+        agent_specs = [list(agent) for agent in self.agents] + [self.model, self.parallel_groups, self.context_tokens]
+        return team_key(agent_specs, self.speaker_selection_method, self.code_execution, config_key)
+
+
+async def send_messages(recipient, messages, sender, config, instance=None):
+    # print(f"{sender.name} -> {recipient.name}: {messages[-1]['content']}")
+    post_message(instance, messages[-1]["content"], sender.name)
+    return False, None  # required to ensure the agent communication flow continues
+
+
+class myGroupChatManager(ParallelGroupChatManager):
+    # the chat interface of the session using the manager, set by `register_session_replies`
+    chat_instance = None
+
+    def _send_messages(self, message, sender, config):
+        message = self._message_to_dict(message)
+
+        if message.get("role") == "function":
+            content = message["content"]
+        else:
+            content = message.get("content")
+            if content is not None:
+                if "context" in message:
+                    content = autogen.OpenAIWrapper.instantiate(
+                        content,
+                        message["context"],
+                        self.llm_config and self.llm_config.get("allow_format_str_template", False),
+                    )
+            if "function_call" in message:
+                function_call = dict(message["function_call"])
+                content = f"Suggested function Call: {function_call.get('name', '(No function name found)')}"
+        if self.chat_instance is not None:
+            post_message(self.chat_instance, content, sender.name)
+        return False, None  # required to ensure the agent communication flow continues
+
+    def _process_received_message(self, message, sender, silent):
+        message = self._message_to_dict(message)
+        # When the agent receives a message, the role of the message is "user". (If 'role' exists and is 'function', it will remain unchanged.)
+        valid = self._append_oai_message(message, "user", sender)
+        if not valid:
+            raise ValueError(
+                "Received message can't be converted into a valid ChatCompletion message. Either content or function_call must be provided."
+            )
+        if not silent:
+            self._print_received_message(message, sender)
+            self._send_messages(message, sender, None)
+
+
+def build_team(spec, llm_config):
+    """Build the agents, and the group chat and its manager for 3 agents or more, of `spec`."""
+    agents = []
+    for agent_name, system_msg, agent_type, docs_path in spec.agents:
+        retrieve_config = get_retrieve_config(docs_path, spec.model) if agent_type == "RetrieveUserProxyAgent" else None
+        code_execution_config = (
+            {
+                "work_dir": "coding",
+                "use_docker": False,  # set to True or image name like "python:3" to use docker
+            }
+            if spec.code_execution
+            else False
+        )
+        agent = initialize_agents(
+            llm_config, agent_name, system_msg, agent_type, retrieve_config, code_execution_config
+        )
+        agents.append(agent)
+    # the history budget is opt in, a RAG team always sends its full history, the retrieved docs are in its first
+    # message
+    rag = any(isinstance(agent, RetrieveUserProxyAgent) for agent in agents)
+    for agent in agents:
+        agent.context_tokens = 0 if rag else spec.context_tokens
+    if len(agents) >= 3:
+        groupchat = LocalGroupChat(
+            agents=agents,
+            messages=[],
+            max_round=12,
+            speaker_selection_method=spec.speaker_selection_method,
+            allow_repeat_speaker=False,
+        )
+        manager = myGroupChatManager(
+            groupchat=groupchat,
+            llm_config=llm_config,
+            parallel_groups=parse_parallel_groups(spec.parallel_groups, groupchat.agent_names),
+        )
+        manager.client = StreamingOpenAIWrapper(**manager.llm_config)
+    else:
+        manager = None
+        groupchat = None
+    return agents, manager, groupchat
+
+
+def register_session_replies(agents, manager, instance):
+    """Bind a team to the chat interface of a session, the warm team templates stay session free."""
+    for agent in agents:
+        agent.register_reply(
+            [autogen.Agent, None], reply_func=partial(send_messages, instance=instance), config={"callback": None}
+        )
+        # Hack for get human input
+        agent._reply_func_list.pop(1)
+        agent.register_reply(
+            [autogen.Agent, None],
+            partial(check_termination_and_human_reply, instance=instance),
+            1,
+        )
+        register_stream_reply(agent, instance)
+    if manager is not None:
+        manager.chat_instance = instance
+        for agent in agents:
+            agent._reply_func_list.pop(0)
@@ -0,0 +1,50 @@
+import asyncio
+
+
+class InputBroker:
+    """Wait for human input from Panel widgets without polling.
+
+    Every wait registers `param.watch` callbacks on the input widgets and awaits an `asyncio.Future` which the
+    callbacks resolve once feedback is submitted, so a waiting session costs no event loop wakeups.
+    """
+
+    def __init__(self):
+        self._pending = set()
+
+    @property
+    def pending(self):
+        """Number of sessions currently waiting for human input."""
+        return len(self._pending)
+
+    async def wait(self, input_widget, submit_checkbox, timeout):
+        """Return the text of `input_widget` once `submit_checkbox` is checked.
+
+        Raises asyncio.TimeoutError if nothing is submitted within `timeout` seconds.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def _resolve(value):
+            if not future.done():
+                future.set_result(value)
+
+        def _on_change(*events):
+            if input_widget.value != "" and submit_checkbox.value is True:
+                # widget events may be triggered from another thread than the one running the chat
+                loop.call_soon_threadsafe(_resolve, input_widget.value)
+
+        watchers = [
+            (input_widget, input_widget.param.watch(_on_change, "value")),
+            (submit_checkbox, submit_checkbox.param.watch(_on_change, "value")),
+        ]
+        self._pending.add(future)
+        try:
+            _on_change()
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            self._pending.discard(future)
+            for widget, watcher in watchers:
+                widget.param.unwatch(watcher)
+
+
+INPUT_BROKER = InputBroker()
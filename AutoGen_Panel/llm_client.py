@@ -0,0 +1,176 @@
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from configs import LLM_RETRIES
+from llm_cache import CachedOpenAIWrapper
+from openai import APIConnectionError, InternalServerError, RateLimitError
+from openai.types.chat import ChatCompletion
+from openai.types.chat.chat_completion import ChatCompletionMessage, Choice
+from openai.types.completion_usage import CompletionUsage
+from rate_limiter import SCHEDULER, current_session, endpoint_key
+from router import RoutingOpenAIWrapper
+
+try:
+    from autogen.token_count_utils import count_token
+except ImportError:
+    count_token = None
+
+DEFAULT_COMPLETION_TOKENS = 256  # completion tokens expected from a call without max_tokens
+
+_tokenizer_lock = threading.Lock()
+_tokenizer_loaded = False
+
+# the callback receiving the tokens of the completion created in the current context
+_token_callback = ContextVar("token_callback", default=None)
+
+
+@contextmanager
+def stream_tokens(callback):
+    """Pass the tokens of the completions created in this context to `callback` as they arrive."""
+    token = _token_callback.set(callback)
+    try:
+        yield
+    finally:
+        _token_callback.reset(token)
+
+
+def _try_count_tokens(messages, model):
+    global count_token
+    if count_token is None:
+        return 0
+    try:
+        return count_token(messages, model)
+    except OSError:
+        # the tokenizer couldn't be downloaded, e.g. offline, don't try again on every call
+        count_token = None
+        return 0
+    except Exception:  # noqa
+        return 0
+
+
+def count_prompt_tokens(messages, model):
+    """Return the tokens of `messages`, a list of messages or a text, 0 if the tokenizer of `model` isn't available."""
+    global _tokenizer_loaded
+    if not _tokenizer_loaded:
+        # the first call loads the tokenizer, or fails to download it, once for all the threads
+        with _tokenizer_lock:
+            tokens = _try_count_tokens(messages, model)
+            _tokenizer_loaded = True
+            return tokens
+    return _try_count_tokens(messages, model)
+
+
+def _estimate_tokens(params):
+    """Estimate the tokens counted against the rate limit before the call, the prompt and the expected completion."""
+    prompt = params.get("messages") or params.get("prompt") or ""
+    prompt_tokens = count_prompt_tokens(prompt, params.get("model", "").replace("gpt-35", "gpt-3.5"))
+    if not prompt_tokens:
+        prompt_tokens = len(str(prompt)) // 4
+    return prompt_tokens + (params.get("max_tokens") or DEFAULT_COMPLETION_TOKENS) * params.get("n", 1)
+
+
+def _retry_after(error, attempt):
+    """Return the seconds to wait before retrying a failed call, as asked by the provider if it did."""
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        if "retry-after-ms" in headers:
+            return float(headers["retry-after-ms"]) / 1000
+        if "retry-after" in headers:
+            return float(headers["retry-after"])
+    except ValueError:
+        pass
+    return min(2**attempt, 20) * (0.5 + random.random())
+
+
+class StreamingOpenAIWrapper(CachedOpenAIWrapper, RoutingOpenAIWrapper):
+    """An OpenAIWrapper passing streamed tokens to the callback set with `stream_tokens` instead of printing them.
+
+    The returned response is the same ChatCompletion as a non streamed one, so agents store the same message, and
+    it is cached in the shared response cache like any other.
+
+    Calls are admitted by `scheduler`, which keeps them within the rate limits of their endpoint, shared by all
+    sessions, and retries them when they are rate limited or fail, instead of each openai client retrying alone.
+    A cache miss is sent to the endpoints of the config list in the order of the latency router.
+    """
+
+    scheduler = SCHEDULER
+
+    def __init__(self, **base_config):
+        super().__init__(**base_config)
+        # retries go through the scheduler
+        self._scheduled_clients = {id(client): client.with_options(max_retries=0) for client in self._clients}
+
+    def _completions_create(self, client, params):
+        if self.scheduler is None:
+            return self._create(client, params)
+        scheduled_client = self._scheduled_clients.get(id(client), client)
+        key = endpoint_key(client, params.get("model"))
+        tokens = _estimate_tokens(params)
+        session, weight = current_session()
+        for attempt in range(LLM_RETRIES + 1):
+            ticket = self.scheduler.acquire(key, tokens, session, weight)
+            used_tokens = None
+            try:
+                response = self._create(scheduled_client, params)
+                usage = getattr(response, "usage", None)
+                used_tokens = usage.total_tokens if usage is not None else None
+                return response
+            except RateLimitError as e:
+                if attempt == LLM_RETRIES:
+                    raise
+                self.scheduler.penalize(key, _retry_after(e, attempt))
+            except (APIConnectionError, InternalServerError) as e:
+                if attempt == LLM_RETRIES:
+                    raise
+                time.sleep(_retry_after(e, attempt))
+            finally:
+                self.scheduler.release(ticket, used_tokens)
+
+    def _create(self, client, params):
+        callback = _token_callback.get()
+        if (
+            callback is None
+            or not params.get("stream", False)
+            or "messages" not in params
+            or "functions" in params
+            or params.get("n", 1) != 1
+        ):
+            return super()._completions_create(client, params)
+
+        response_content = ""
+        finish_reason = ""
+        completion_tokens = 0
+        chunk = None
+        for chunk in client.chat.completions.create(**params):
+            for choice in chunk.choices:
+                finish_reason = choice.finish_reason or finish_reason
+                content = choice.delta.content
+                if content:
+                    callback(content)
+                    response_content += content
+                    completion_tokens += 1
+        if chunk is None:
+            raise ValueError("The streamed completion is empty.")
+
+        prompt_tokens = count_prompt_tokens(params["messages"], chunk.model.replace("gpt-35", "gpt-3.5"))
+        return ChatCompletion(
+            id=chunk.id,
+            model=chunk.model,
+            created=chunk.created,
+            object="chat.completion",
+            choices=[
+                Choice(
+                    index=0,
+                    finish_reason=finish_reason or "stop",
+                    message=ChatCompletionMessage(role="assistant", content=response_content, function_call=None),
+                )
+            ],
+            usage=CompletionUsage(
+                prompt_tokens=prompt_tokens,
+                completion_tokens=completion_tokens,
+                total_tokens=prompt_tokens + completion_tokens,
+            ),
+        )
@@ -0,0 +1,110 @@
+import asyncio
+
+import autogen
+from autogen_utils import run_llm
+from configs import PARALLEL_REPLIES
+
+
+def parse_parallel_groups(text, agent_names):
+    """Parse groups of agents replying in parallel, e.g. "Critic, Scientist; Engineer, Planner".
+
+    Groups are separated by semicolons or new lines, names by commas. Unknown names, repeated names and groups of
+    a single agent are dropped, each agent is in one group at most.
+    """
+    groups, seen = [], set()
+    for line in (text or "").replace("\n", ";").split(";"):
+        group = []
+        for name in line.split(","):
+            name = name.strip()
+            if name in agent_names and name not in seen:
+                seen.add(name)
+                group.append(name)
+        if len(group) > 1:
+            groups.append(tuple(group))
+    return tuple(groups)
+
+
+class ParallelGroupChatManager(autogen.GroupChatManager):
+    """A GroupChatManager running a parallel round whenever the selected speaker is in one of `parallel_groups`.
+
+    All the agents of the group reply to the same context at the same time, at most `max_parallel` of them
+    generate their replies concurrently, then the replies are added to the chat in the order of the group, as if
+    the agents had spoken one after the other without seeing each other's reply. A round of the group takes as long
+    as its slowest agent instead of the sum of their latencies. Each reply counts as one round of `max_round`.
+    Only async chats, i.e. `a_initiate_chat`, run parallel rounds. The speakers are selected in the LLM executor,
+    the event loop shared by the sessions is never blocked by a speaker selection waiting for the rate limits.
+    """
+
+    def __init__(self, groupchat, parallel_groups=(), max_parallel=PARALLEL_REPLIES, **kwargs):
+        super().__init__(groupchat=groupchat, **kwargs)
+        self.parallel_groups = tuple(tuple(group) for group in parallel_groups)
+        self.max_parallel = max_parallel
+        self.register_reply(
+            autogen.Agent,
+            ParallelGroupChatManager.a_run_chat,
+            config=groupchat,
+            reset_config=autogen.GroupChat.reset,
+        )
+
+    def _parallel_group(self, speaker, groupchat):
+        """Return the agents replying together with `speaker`, in the order of its group, or only `speaker`."""
+        for group in self.parallel_groups:
+            if speaker.name in group:
+                return [groupchat.agent_by_name(name) for name in group if name in groupchat.agent_names]
+        return [speaker]
+
+    async def _a_append(self, message, speaker, groupchat):
+        """Add the message of `speaker` to the chat and broadcast it to the other agents."""
+        # set the name to speaker's name if the role is not function
+        if message["role"] != "function":
+            message["name"] = speaker.name
+        groupchat.messages.append(message)
+        for agent in groupchat.agents:
+            if agent != speaker:
+                await self.a_send(message, agent, request_reply=False, silent=True)
+
+    async def _a_fan_out(self, agents):
+        """Generate the replies of `agents` to the current context concurrently, in the order of `agents`."""
+        semaphore = asyncio.Semaphore(self.max_parallel)
+
+        async def _reply(agent):
+            async with semaphore:
+                return await agent.a_generate_reply(sender=self)
+
+        return await asyncio.gather(*(_reply(agent) for agent in agents))
+
+    async def a_run_chat(self, messages=None, sender=None, config=None):
+        """Run a group chat asynchronously, with parallel rounds."""
+        if messages is None:
+            messages = self._oai_messages[sender]
+        speaker = sender
+        groupchat = config
+        await self._a_append(messages[-1], speaker, groupchat)
+        rounds = 1
+        while rounds < groupchat.max_round:
+            try:
+                # select the next speaker, and the agents replying with it, off the event loop: the "auto" method
+                # asks the LLM and may wait for the rate limits
+                speaker = await run_llm(groupchat.select_speaker, speaker, self)
+                speakers = self._parallel_group(speaker, groupchat)[: groupchat.max_round - rounds]
+                if len(speakers) > 1:
+                    replies = await self._a_fan_out(speakers)
+                else:
+                    replies = [await speaker.a_generate_reply(sender=self)]
+            except KeyboardInterrupt:
+                # let the admin agent speak if interrupted
+                if groupchat.admin_name in groupchat.agent_names:
+                    # admin agent is one of the participants
+                    speaker = groupchat.agent_by_name(groupchat.admin_name)
+                    speakers, replies = [speaker], [await speaker.a_generate_reply(sender=self)]
+                else:
+                    # admin agent is not found in the participants
+                    raise
+            for speaker, reply in zip(speakers, replies):
+                if reply is None:
+                    return True, None
+                # The speaker sends the message without requesting a reply
+                await speaker.a_send(reply, self, request_reply=False)
+                rounds += 1
+                await self._a_append(self.last_message(speaker), speaker, groupchat)
+        return True, None
@@ -0,0 +1,114 @@
+import hashlib
+import json
+import threading
+import time
+from collections import defaultdict
+
+from chromadb.utils.embedding_functions import SentenceTransformerEmbeddingFunction
+from rag_ingest import sync_collection
+
+COLLECTION_PREFIX = "rag_"
+
+
+def normalize_docs(docs_path):
+    """Return a sorted list of unique doc paths or urls."""
+    if isinstance(docs_path, str):
+        docs_path = [docs_path]
+    return sorted({str(doc).strip() for doc in docs_path if str(doc).strip()})
+
+
+def shared_collection_name(docs_path, chunk_token_size, embedding_model):
+    """Return a collection name derived from the content settings, so identical doc sets share one collection."""
+    payload = json.dumps(
+        {"docs": normalize_docs(docs_path), "chunk_token_size": chunk_token_size, "embedding_model": embedding_model},
+        sort_keys=True,
+    )
+    return f"{COLLECTION_PREFIX}{hashlib.sha256(payload.encode('utf-8')).hexdigest()[:40]}"
+
+
+class SharedCollections:
+    """Reference counted, read-only RAG collections shared by all sessions of the process.
+
+    A collection is embedded once by the first session asking for it, and only counts as built once its manifest is
+    written; later sessions just take a reference.
+    Collections nobody references any more can be dropped with `prune`.
+    """
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self._refs = defaultdict(int)
+        self._ready = set()
+        self._idle_since = {}  # name -> time since which no session references the collection
+        self._build_locks = defaultdict(threading.Lock)
+        self._lock = threading.Lock()
+
+    def ensure(self, retrieve_config):
+        """Make sure the collection of `retrieve_config` exists and holds the embedded docs."""
+        name = retrieve_config["collection_name"]
+        if name in self._ready:
+            return
+        with self._build_locks[name]:
+            if name in self._ready:
+                return
+            embedding_function = retrieve_config.get("embedding_function")
+            if embedding_function is None:
+                embedding_function = SentenceTransformerEmbeddingFunction(retrieve_config["embedding_model"])
+            # the manifest of the collection is written once all its chunks are in, a build which was interrupted,
+            # e.g. by a killed process or an embedding error, is completed by the next session instead of being used
+            sync_collection(
+                retrieve_config["client"],
+                name,
+                normalize_docs(retrieve_config["docs_path"]),
+                retrieve_config["chunk_token_size"],
+                embedding_function=embedding_function,
+            )
+            with self._lock:
+                self._ready.add(name)
+                if not self._refs.get(name):
+                    self._idle_since[name] = self.clock()
+
+    def acquire(self, name):
+        with self._lock:
+            self._refs[name] += 1
+            self._idle_since.pop(name, None)
+
+    def release(self, name):
+        with self._lock:
+            if self._refs.get(name, 0) > 1:
+                self._refs[name] -= 1
+            else:
+                self._refs.pop(name, None)
+                self._idle_since[name] = self.clock()
+
+    def idle(self, seconds):
+        """Return the collections no session referenced for `seconds`."""
+        with self._lock:
+            now = self.clock()
+            return [name for name, since in self._idle_since.items() if now - since > seconds]
+
+    def refs(self, name):
+        with self._lock:
+            return self._refs.get(name, 0)
+
+    def prune(self, client, names=None):
+        """Delete the shared collections of `client` which are not referenced by any session, or only `names`."""
+        deleted = []
+        for collection in client.list_collections():
+            name = collection.name
+            if not name.startswith(COLLECTION_PREFIX) or (names is not None and name not in names):
+                continue
+            with self._lock:
+                if self._refs.get(name, 0) > 0:
+                    continue
+                self._ready.discard(name)
+                self._idle_since.pop(name, None)
+            client.delete_collection(name)
+            deleted.append(name)
+        return deleted
+
+    def stats(self):
+        with self._lock:
+            return {"ready": len(self._ready), "refs": dict(self._refs)}
+
+
+SHARED_COLLECTIONS = SharedCollections()
@@ -0,0 +1,153 @@
+import hashlib
+import json
+import logging
+import os
+from contextlib import contextmanager
+
+from autogen.retrieve_utils import get_files_from_dir, is_url, split_files_to_chunks
+from download_cache import fetch
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows, the processes of the host must not ingest at the same time
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_DIR = os.environ.get("RAG_MANIFEST_DIR", os.path.join(".cache", "rag_manifests"))
+UPSERT_BATCH = 1000  # chunks embedded and upserted together
+# the settings of the collections created by autogen's create_vector_db_from_dir
+COLLECTION_METADATA = {"hnsw:space": "ip", "hnsw:construction_ef": 30, "hnsw:M": 32}
+
+
+def _sha256(data):
+    return hashlib.sha256(data if isinstance(data, bytes) else data.encode("utf-8")).hexdigest()
+
+
+def file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def chunk_id(source, chunk):
+    """The id of a chunk of a document, the same as long as the source and the text of the chunk don't change."""
+    return f"{_sha256(source)[:16]}-{_sha256(chunk)[:32]}"
+
+
+def resolve_docs(docs_path, sources=None):
+    """Return (source, local file) for the docs of `docs_path`, a url, file or directory or a list of them.
+
+    `sources` maps local files to the source of their chunks, e.g. an uploaded file, stored at another temp path on
+    each upload, to its original name. The other files are the source of their chunks.
+    """
+    sources = sources or {}
+    docs = []
+    for item in docs_path if isinstance(docs_path, list) else [docs_path]:
+        if is_url(item):
+            docs.append((item, fetch(item)))
+        elif item in sources:
+            docs.append((sources[item], item))
+        else:
+            docs += [(os.path.abspath(file), file) for file in get_files_from_dir(item)]
+    return docs
+
+
+@contextmanager
+def _locked(path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + ".lock", "w") as lock:
+        if fcntl is not None:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+        yield
+
+
+def _load_manifest(path, settings):
+    try:
+        with open(path) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    # other chunk settings give other chunks
+    return manifest if manifest.get("settings") == settings else None
+
+
+def _save_manifest(path, manifest):
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(manifest, f)
+    os.replace(tmp, path)
+
+
+def sync_collection(
+    client,
+    collection_name,
+    docs_path,
+    chunk_token_size,
+    embedding_function=None,
+    chunk_mode="multi_lines",
+    must_break_at_empty_line=True,
+    custom_text_split_function=None,
+    sources=None,
+    manifest_dir=MANIFEST_DIR,
+):
+    """Make the collection hold the chunks of the docs of `docs_path`, and only them, embedding only the new chunks.
+
+    The manifest of the collection records the hash of each document and the ids of its chunks. An unchanged document
+    is neither read nor chunked again. The chunks of a changed document are keyed by their content, so only the
+    chunks which changed are embedded, and its chunks which are gone are deleted, as are the chunks of the documents
+    no longer in `docs_path`. The chunks are keyed by their source, see `resolve_docs` for the `sources` of local
+    files. Return the counts of the sync.
+    """
+    settings = {
+        "chunk_token_size": chunk_token_size,
+        "chunk_mode": chunk_mode,
+        "must_break_at_empty_line": must_break_at_empty_line,
+        "custom_text_split_function": getattr(custom_text_split_function, "__qualname__", None),
+    }
+    path = os.path.join(manifest_dir, f"{collection_name}.json")
+    with _locked(path):
+        collection = client.get_or_create_collection(
+            collection_name, embedding_function=embedding_function, metadata=COLLECTION_METADATA
+        )
+        manifest = _load_manifest(path, settings)
+        known = {i for entry in (manifest or {}).get("docs", {}).values() for i in entry["ids"]}
+        if manifest is None or collection.count() != len(known):
+            # no manifest, or the collection was changed by someone else, e.g. deleted: keep the chunks with a known
+            # id, without embedding them again, and drop the others
+            manifest, known = {"settings": settings, "docs": {}}, set(collection.get(include=[])["ids"])
+        counts = {"docs": 0, "unchanged_docs": 0, "chunks": 0, "embedded": 0, "deleted": 0}
+        docs = {}
+        for source, file in resolve_docs(docs_path, sources):
+            counts["docs"] += 1
+            sha = file_sha256(file)
+            entry = manifest["docs"].get(source)
+            if entry is not None and entry["sha"] == sha:
+                counts["unchanged_docs"] += 1
+            else:
+                if custom_text_split_function is not None:
+                    chunks = split_files_to_chunks([file], custom_text_split_function=custom_text_split_function)
+                else:
+                    chunks = split_files_to_chunks([file], chunk_token_size, chunk_mode, must_break_at_empty_line)
+                chunks = {chunk_id(source, chunk): chunk for chunk in chunks}
+                present = set(collection.get(ids=list(chunks), include=[])["ids"]) if chunks else set()
+                new = [i for i in chunks if i not in present]
+                for start in range(0, len(new), UPSERT_BATCH):
+                    ids = new[start : start + UPSERT_BATCH]
+                    collection.upsert(
+                        ids=ids, documents=[chunks[i] for i in ids], metadatas=[{"source": source}] * len(ids)
+                    )
+                counts["embedded"] += len(new)
+                entry = {"sha": sha, "ids": list(chunks)}
+            docs[source] = entry
+            counts["chunks"] += len(entry["ids"])
+        stale = list(known - {i for entry in docs.values() for i in entry["ids"]})
+        for start in range(0, len(stale), UPSERT_BATCH):
+            collection.delete(ids=stale[start : start + UPSERT_BATCH])
+        counts["deleted"] = len(stale)
+        manifest["docs"] = docs
+        _save_manifest(path, manifest)
+    logger.info(f"synced {collection_name}: {counts}")
+    return counts
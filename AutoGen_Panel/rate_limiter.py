@@ -0,0 +1,250 @@
+import hashlib
+import heapq
+import itertools
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from configs import RATE_LIMITS, WORKER_PROCS
+
+WAIT_SAMPLES = 1024  # recent waits kept per endpoint for the metrics
+
+# the session, and its weight, of the LLM calls made in the current context
+_session = ContextVar("llm_session", default=(None, 1.0))
+
+
+@contextmanager
+def session_scope(session_id, weight=1.0):
+    """Schedule the LLM calls made in this context as the ones of `session_id`."""
+    token = _session.set((session_id, weight))
+    try:
+        yield
+    finally:
+        _session.reset(token)
+
+
+def current_session():
+    return _session.get()
+
+
+def endpoint_key(client, model):
+    """Return the key of the quota used by a call, (endpoint, model), providers limit each api key per model.
+
+    The model is kept apart, its name may contain any separator, e.g. `ft:gpt-3.5-turbo:org::id` or `llama2:13b`.
+    """
+    api_key = getattr(client, "api_key", "") or ""
+    fingerprint = hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:8]
+    return f"{getattr(client, 'base_url', '')}#{fingerprint}", model
+
+
+def endpoint_label(key):
+    """Return the label of an endpoint key in the metrics."""
+    return f"{key[0]} {key[1]}"
+
+
+class TokenBucket:
+    """Allow `per_minute` units per minute, in bursts of up to `capacity` units."""
+
+    def __init__(self, per_minute, capacity=None, clock=time.monotonic):
+        self.rate = per_minute / 60.0
+        self.capacity = capacity or per_minute
+        self.level = self.capacity
+        self.clock = clock
+        self.updated = clock()
+
+    def _refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, amount, now):
+        """Return the seconds to wait before `amount` units can be taken, at most a full bucket is waited for."""
+        self._refill(now)
+        return max(0.0, (min(amount, self.capacity) - self.level) / self.rate)
+
+    def take(self, amount, now):
+        """Take `amount` units, the level may go below zero, e.g. when a call used more tokens than estimated."""
+        self._refill(now)
+        self.level -= amount
+
+    def give(self, amount, now):
+        self._refill(now)
+        self.level = min(self.capacity, self.level + amount)
+
+    def pause(self, seconds, now):
+        """Make the bucket empty for at least `seconds`, e.g. after the provider returned a 429."""
+        self._refill(now)
+        self.level = min(self.level, -seconds * self.rate)
+
+
+class Ticket:
+    """The admission of one LLM call."""
+
+    def __init__(self, key, session, tokens, start, enqueued):
+        self.key = key
+        self.session = session
+        self.tokens = tokens
+        self.start = start
+        self.enqueued = enqueued
+        self.wait = None
+
+
+class _Endpoint:
+    def __init__(self, key, limits, lock, clock):
+        self.key = key
+        rpm, tpm = limits.get("requests_per_minute"), limits.get("tokens_per_minute")
+        self.requests = TokenBucket(rpm, clock=clock) if rpm else None
+        self.tokens = TokenBucket(tpm, clock=clock) if tpm else None
+        self.cond = threading.Condition(lock)
+        self.queue = []  # heap of (virtual finish time, seq, ticket)
+        self.virtual_time = 0.0
+        self.finish = {}  # session -> virtual finish time of its last queued call
+        self.in_flight = 0
+        self.granted = 0
+        self.rate_limited = 0
+        self.max_queue_depth = 0
+        self.waits = deque(maxlen=WAIT_SAMPLES)
+
+    def delay(self, tokens, now):
+        delay = 0.0
+        if self.requests is not None:
+            delay = self.requests.delay(1, now)
+        if self.tokens is not None:
+            delay = max(delay, self.tokens.delay(tokens, now))
+        return delay
+
+    def prune(self):
+        """Forget the sessions which are not ahead of the virtual time, they would restart from it anyway."""
+        if len(self.finish) > 2 * len(self.queue) + 64:
+            self.finish = {s: f for s, f in self.finish.items() if f > self.virtual_time}
+
+
+class RateLimitScheduler:
+    """Admit LLM calls within the rate limits of each endpoint, sharing them fairly between sessions.
+
+    Each endpoint, i.e. base url, api key and model, has token buckets for its requests and tokens per minute.
+    Waiting calls are admitted in the order of their virtual finish time, as in weighted fair queueing, where
+    the cost of a call is its estimated tokens divided by the weight of its session: a session sending many
+    long prompts doesn't delay the first call of another session by more than one of its own calls.
+    With `procs` worker processes, each one admits 1/procs of the limits.
+    """
+
+    def __init__(self, limits=None, clock=time.monotonic, procs=WORKER_PROCS):
+        self.limits = RATE_LIMITS if limits is None else limits
+        self.procs = max(1, procs)
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._endpoints = {}
+        self._seq = itertools.count()
+
+    def _limits(self, key):
+        model = key[1]
+        limits = self.limits.get(model) or self.limits.get("default") or {}
+        return {name: limit / self.procs if limit else limit for name, limit in limits.items()}
+
+    def _endpoint(self, key):
+        endpoint = self._endpoints.get(key)
+        if endpoint is None:
+            endpoint = self._endpoints[key] = _Endpoint(key, self._limits(key), self._lock, self.clock)
+        return endpoint
+
+    def acquire(self, key, tokens, session=None, weight=1.0):
+        """Block until a call of about `tokens` tokens can be sent to endpoint `key`, return its ticket."""
+        with self._lock:
+            endpoint = self._endpoint(key)
+            start = max(endpoint.virtual_time, endpoint.finish.get(session, 0.0))
+            finish = start + max(tokens, 1) / weight
+            endpoint.finish[session] = finish
+            ticket = Ticket(key, session, tokens, start, self.clock())
+            heapq.heappush(endpoint.queue, (finish, next(self._seq), ticket))
+            endpoint.max_queue_depth = max(endpoint.max_queue_depth, len(endpoint.queue))
+            while True:
+                if endpoint.queue[0][2] is not ticket:
+                    endpoint.cond.wait()
+                    continue
+                now = self.clock()
+                delay = endpoint.delay(tokens, now)
+                if delay > 0:
+                    endpoint.cond.wait(delay)
+                    continue
+                heapq.heappop(endpoint.queue)
+                if endpoint.requests is not None:
+                    endpoint.requests.take(1, now)
+                if endpoint.tokens is not None:
+                    endpoint.tokens.take(tokens, now)
+                endpoint.virtual_time = max(endpoint.virtual_time, start)
+                endpoint.prune()
+                endpoint.in_flight += 1
+                endpoint.granted += 1
+                ticket.wait = now - ticket.enqueued
+                endpoint.waits.append(ticket.wait)
+                # the next call in the queue may be admitted right away
+                endpoint.cond.notify_all()
+                return ticket
+
+    def release(self, ticket, used_tokens=None):
+        """End the call of `ticket`, correcting the tokens bucket with the tokens it used if they are known."""
+        with self._lock:
+            endpoint = self._endpoints[ticket.key]
+            endpoint.in_flight -= 1
+            if used_tokens is not None and endpoint.tokens is not None:
+                now = self.clock()
+                if used_tokens < ticket.tokens:
+                    endpoint.tokens.give(ticket.tokens - used_tokens, now)
+                else:
+                    endpoint.tokens.take(used_tokens - ticket.tokens, now)
+            endpoint.cond.notify_all()
+
+    def penalize(self, key, seconds):
+        """Hold all the calls to endpoint `key` for `seconds`, after the provider rate limited one of them."""
+        with self._lock:
+            endpoint = self._endpoint(key)
+            endpoint.rate_limited += 1
+            now = self.clock()
+            for bucket in (endpoint.requests, endpoint.tokens):
+                if bucket is not None:
+                    bucket.pause(seconds, now)
+            if endpoint.requests is None and endpoint.tokens is None:
+                # no limit is configured, learn one from the provider
+                endpoint.requests = TokenBucket(60, capacity=1, clock=self.clock)
+                endpoint.requests.pause(seconds, now)
+            endpoint.cond.notify_all()
+
+    @staticmethod
+    def _wait_stats(waits):
+        waits = sorted(waits)
+        if not waits:
+            return {"wait_avg_s": 0.0, "wait_p50_s": 0.0, "wait_p95_s": 0.0, "wait_max_s": 0.0}
+        return {
+            "wait_avg_s": round(sum(waits) / len(waits), 3),
+            "wait_p50_s": round(waits[len(waits) // 2], 3),
+            "wait_p95_s": round(waits[min(len(waits) - 1, int(len(waits) * 0.95))], 3),
+            "wait_max_s": round(waits[-1], 3),
+        }
+
+    def metrics(self):
+        """Return the queue depth, calls in flight, admissions, 429s and recent waits of all endpoints and in total.
+
+        Endpoint keys contain the base urls, only show the total to the users of a shared deployment.
+        """
+        with self._lock:
+            endpoints = {}
+            for key, endpoint in self._endpoints.items():
+                endpoints[endpoint_label(key)] = {
+                    "queue_depth": len(endpoint.queue),
+                    "max_queue_depth": endpoint.max_queue_depth,
+                    "in_flight": endpoint.in_flight,
+                    "granted": endpoint.granted,
+                    "rate_limited": endpoint.rate_limited,
+                    **self._wait_stats(endpoint.waits),
+                }
+            waits = [w for endpoint in self._endpoints.values() for w in endpoint.waits]
+        total = {
+            name: sum(m[name] for m in endpoints.values())
+            for name in ("queue_depth", "in_flight", "granted", "rate_limited")
+        }
+        return {"total": {**total, **self._wait_stats(waits)}, "endpoints": endpoints}
+
+
+SCHEDULER = RateLimitScheduler()
@@ -0,0 +1,59 @@
+import sys
+
+from configs import DEFAULT_AUTO_REPLY
+
+
+def _alternated_role(idx, msg):
+    if idx == 0:
+        return msg.get("role")
+    if idx % 2 == 1:
+        return "user" if msg.get("role") != "function" else "function"
+    return "assistant"
+
+
+class AlternatingView:
+    """A view of one conversation with the alternating roles required by ERNIE Bot models.
+
+    The agent's history is append only during a chat, so the already alternated prefix is kept and only the new
+    messages are processed on each call. The view holds copies, the agent's stored messages are never modified.
+    If the history was cleared or rewritten, e.g. compressed, the view is rebuilt.
+    """
+
+    def __init__(self):
+        self._sources = []
+        self._messages = []
+        self._offset = None
+
+    def __sizeof__(self):
+        # the copies of the messages, their contents are the agent's
+        size = object.__sizeof__(self) + sys.getsizeof(self._sources) + sys.getsizeof(self._messages)
+        return size + sum(sys.getsizeof(msg) for msg in self._messages)
+
+    def _is_prefix_of(self, messages, offset):
+        n = len(self._sources)
+        if offset != self._offset or len(messages) < n:
+            return False
+        return n == 0 or (messages[0] is self._sources[0] and messages[n - 1] is self._sources[-1])
+
+    def update(self, system_messages, messages):
+        """Return the system messages and `messages` with alternating roles."""
+        offset = len(system_messages)
+        if not self._is_prefix_of(messages, offset):
+            self._sources, self._messages, self._offset = [], [], offset
+        for idx in range(len(self._sources), len(messages)):
+            msg = messages[idx]
+            self._sources.append(msg)
+            self._messages.append({**msg, "role": _alternated_role(offset + idx, msg)})
+        _messages = system_messages + self._messages
+        if len(_messages) % 2 == 1:
+            _messages.append({"content": DEFAULT_AUTO_REPLY, "role": "user"})
+        return _messages
+
+
+def alternated_messages(agent, messages, sender):
+    """Return the messages of `agent` with `sender` with alternating roles, using the agent's view of the chat."""
+    views = agent.__dict__.setdefault("_alternating_views", {})
+    view = views.get(sender)
+    if view is None:
+        view = views[sender] = AlternatingView()
+    return view.update(agent._oai_system_message, messages)
@@ -0,0 +1,250 @@
+import contextvars
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from autogen import OpenAIWrapper
+from autogen.oai.client import ERROR
+from configs import HEDGE_QUANTILE, HEDGE_REQUESTS, LLM_WORKERS
+from rate_limiter import endpoint_key, endpoint_label
+
+try:
+    from openai import APIError
+except ImportError:  # autogen's ERROR is raised by the first call
+    APIError = None
+
+logger = logging.getLogger(__name__)
+
+EWMA_ALPHA = 0.2  # weight of the latest call in the latency and error rate averages
+LATENCY_SAMPLES = 256  # recent latencies kept per endpoint for the hedging deadline
+HEDGE_MIN_SAMPLES = 20  # calls to an endpoint before its deadline is trusted
+MAX_FAILURES = 3  # consecutive failures before an endpoint is skipped
+COOLDOWN = 30  # seconds before a skipped endpoint is tried again
+HEDGE_BUDGET = 0.1  # max share of the calls hedged, backup calls add load to the endpoints
+
+# the hedged calls, the slower call of a pair finishes in the background
+HEDGE_EXECUTOR = ThreadPoolExecutor(max_workers=2 * LLM_WORKERS, thread_name_prefix="hedge")
+
+
+class EndpointStats:
+    """Latency and errors of the calls to one endpoint."""
+
+    def __init__(self):
+        self.latency = None  # EWMA, in seconds
+        self.error_rate = 0.0  # EWMA
+        self.latencies = deque(maxlen=LATENCY_SAMPLES)
+        self.calls = 0
+        self.failures = 0  # consecutive
+        self.down_until = 0.0
+
+    def observe(self, latency, ok, now):
+        self.calls += 1
+        self.error_rate += EWMA_ALPHA * ((0.0 if ok else 1.0) - self.error_rate)
+        if not ok:
+            self.failures += 1
+            if self.failures >= MAX_FAILURES:
+                self.down_until = now + COOLDOWN
+            return
+        self.failures = 0
+        self.down_until = 0.0
+        self.latency = latency if self.latency is None else self.latency + EWMA_ALPHA * (latency - self.latency)
+        self.latencies.append(latency)
+
+    def healthy(self, now):
+        return now >= self.down_until
+
+    def score(self):
+        """Expected seconds of a call, counting the calls to retry elsewhere, unknown endpoints are tried first."""
+        if self.latency is None:
+            # never answered yet
+            return 0.0 if self.calls == 0 else float("inf")
+        return self.latency * (1 + 2 * self.error_rate)
+
+    def quantile(self, q):
+        if len(self.latencies) < HEDGE_MIN_SAMPLES:
+            return None
+        latencies = sorted(self.latencies)
+        return latencies[min(len(latencies) - 1, int(len(latencies) * q))]
+
+
+class Router:
+    """Order the endpoints of a config list by their EWMA latency and error rate, shared by all sessions."""
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._stats = {}
+        self.routed = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+
+    def _get(self, key):
+        stats = self._stats.get(key)
+        if stats is None:
+            stats = self._stats[key] = EndpointStats()
+        return stats
+
+    def order(self, keys):
+        """Return the indexes of `keys`, healthy endpoints first, the fastest first, ties keep the config order."""
+        with self._lock:
+            self.routed += 1
+            now = self.clock()
+            stats = [self._get(key) for key in keys]
+            return sorted(range(len(keys)), key=lambda i: (not stats[i].healthy(now), stats[i].score(), i))
+
+    def observe(self, key, latency, ok):
+        with self._lock:
+            self._get(key).observe(latency, ok, self.clock())
+
+    def deadline(self, key, q=HEDGE_QUANTILE):
+        """Return the seconds after which a call to `key` is slower than usual, None until it is known."""
+        with self._lock:
+            return self._get(key).quantile(q)
+
+    def start_hedge(self):
+        """Return True if a slow call may be hedged, within the hedge budget."""
+        with self._lock:
+            if self.hedged >= HEDGE_BUDGET * self.routed:
+                return False
+            self.hedged += 1
+            return True
+
+    def hedge_won(self):
+        with self._lock:
+            self.hedge_wins += 1
+
+    def metrics(self):
+        """Return the latency, error rate and health of each endpoint, and the hedged calls in total.
+
+        Endpoint keys contain the base urls, only show the total to the users of a shared deployment.
+        """
+        with self._lock:
+            now = self.clock()
+            endpoints = {
+                endpoint_label(key): {
+                    "calls": stats.calls,
+                    "latency_ewma_s": None if stats.latency is None else round(stats.latency, 3),
+                    "latency_p95_s": stats.quantile(0.95),
+                    "error_rate": round(stats.error_rate, 3),
+                    "healthy": stats.healthy(now),
+                }
+                for key, stats in self._stats.items()
+            }
+            total = {
+                "endpoints": len(endpoints),
+                "unhealthy_endpoints": sum(not e["healthy"] for e in endpoints.values()),
+                "hedged": self.hedged,
+                "hedge_wins": self.hedge_wins,
+            }
+        return {"total": total, "endpoints": endpoints}
+
+
+ROUTER = Router()
+
+
+class RoutingOpenAIWrapper(OpenAIWrapper):
+    """An OpenAIWrapper sending each call to the fastest healthy endpoint of its config list first.
+
+    autogen tries the configs in their order and only moves on when a call fails. Here they are tried in the
+    order of `router`, which learns the latency and errors of each endpoint from all the calls. With `hedge`, a
+    call still running after the usual p95 latency of its endpoint is also sent to the next endpoint and the
+    first response wins, for at most HEDGE_BUDGET of the calls. Streamed calls are never hedged, their tokens are
+    already shown.
+    """
+
+    router = ROUTER
+    hedge = HEDGE_REQUESTS
+
+    def _prepare(self, i, config):
+        """Return the endpoint key, the create params and the extra kwargs of config `i`, as autogen does."""
+        full_config = {**config, **self._config_list[i]}
+        create_config, extra_kwargs = self._separate_create_config(full_config)
+        self._process_for_azure(create_config, extra_kwargs, "extra")
+        params = self._construct_create_params(create_config, extra_kwargs)
+        return endpoint_key(self._clients[i], params.get("model")), params, extra_kwargs
+
+    def _timed_create(self, key, client, params):
+        start = time.monotonic()
+        try:
+            response = self._completions_create(client, params)
+        except Exception:  # noqa
+            self.router.observe(key, time.monotonic() - start, False)
+            raise
+        self.router.observe(key, time.monotonic() - start, True)
+        return response
+
+    @staticmethod
+    def _passes_filter(calls, i, response):
+        _, _, extra_kwargs = calls[i]
+        filter_func = extra_kwargs.get("filter_func")
+        return filter_func is None or filter_func(context=extra_kwargs.get("context"), response=response)
+
+    def _hedged_create(self, calls, primary, backup, tried):
+        """Call `primary`, and `backup` too if `primary` is slower than its deadline, return the first response
+        passing the filter of its config, or else the first response, with whether it passed.
+
+        The indexes of the configs called are added to `tried`.
+        """
+        key, params, _ = calls[primary]
+        deadline = self.router.deadline(key) if backup is not None else None
+        tried.add(primary)
+        if deadline is None:
+            response = self._timed_create(key, self._clients[primary], params)
+            return primary, response, self._passes_filter(calls, primary, response)
+
+        def _submit(i):
+            # each call runs in its own copy of the caller's context, e.g. its session for the scheduler
+            key, params, _ = calls[i]
+            context = contextvars.copy_context()
+            return HEDGE_EXECUTOR.submit(context.run, self._timed_create, key, self._clients[i], params)
+
+        futures = {_submit(primary): primary}
+        done, _ = wait(futures, timeout=deadline)
+        if not done and self.router.start_hedge():
+            logger.debug(f"hedging {key} after {deadline:.2f}s")
+            futures[_submit(backup)] = backup
+            tried.add(backup)
+        pending, rejected, failed = set(futures), None, None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is not None:
+                    failed = future
+                    continue
+                i, response = futures[future], future.result()
+                if self._passes_filter(calls, i, response):
+                    if i == backup:
+                        self.router.hedge_won()
+                    return i, response, True
+                # the other call may still pass the filter
+                rejected = rejected or (i, response)
+        if rejected is not None:
+            return (*rejected, False)
+        # both calls failed, raise the error of the last one
+        return futures[failed], failed.result(), False
+
+    def create(self, **config):
+        if ERROR:
+            raise ERROR
+        calls = [self._prepare(i, config) for i in range(len(self._clients))]
+        order = self.router.order([key for key, _, _ in calls])
+        tried = set()
+        for n, i in enumerate(order):
+            if i in tried:
+                continue
+            _, params, _ = calls[i]
+            rest = [j for j in order[n + 1 :] if j not in tried]
+            backup = rest[0] if self.hedge and rest and not params.get("stream", False) else None
+            try:
+                i, response, pass_filter = self._hedged_create(calls, i, backup, tried)
+            except APIError:
+                logger.debug(f"config {i} failed", exc_info=1)
+                if len(tried) == len(order):
+                    raise
+                continue
+            if pass_filter or len(tried) == len(order):
+                response.config_id = i
+                response.pass_filter = pass_filter
+                return response
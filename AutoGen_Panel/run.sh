@@ -1 +1,3 @@
-panel serve app.py
+# PANEL_NUM_PROCS worker processes share the port, the LLM rate limits and the caches, e.g. PANEL_NUM_PROCS=4 bash run.sh
+export PANEL_NUM_PROCS=${PANEL_NUM_PROCS:-1}
+panel serve app.py --num-procs $PANEL_NUM_PROCS
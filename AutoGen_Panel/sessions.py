@@ -0,0 +1,211 @@
+import gc
+import logging
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+from chroma_clients import _rss_bytes, get_chroma_client
+from configs import COLLECTION_IDLE_TTL, MAX_RSS, SESSION_IDLE_TTL, SESSIONS_MEMORY
+from rag_collections import SHARED_COLLECTIONS
+from team_pool import TEAM_POOL
+
+logger = logging.getLogger(__name__)
+
+SWEEP_PERIOD = "60s"  # how often idle sessions are looked for
+SESSION_COLUMNS = ["session", "state", "memory_kb", "messages", "idle_s", "age_s"]
+
+
+def deep_sizeof(obj, seen=None):
+    """Return the approximate bytes of `obj` and of the containers and strings it holds.
+
+    Other objects, e.g. the agents keying the histories, are not walked into, they count their own state in their
+    `__sizeof__` if they hold any, as the context windows do.
+    """
+    seen = set() if seen is None else seen
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_sizeof(k, seen) + deep_sizeof(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(deep_sizeof(v, seen) for v in obj)
+    return size
+
+
+# the members of an agent growing with its conversations, its clients and vector db handles are shared
+AGENT_STATE = ("_oai_messages", "_context_windows", "_alternating_views", "_results", "_doc_contents", "_doc_ids")
+
+
+def team_memory(agents, groupchat=None):
+    """Return the approximate bytes of the histories, context windows and retrieved docs of a team."""
+    seen = set()
+    size = 0
+    for agent in agents or []:
+        for name in AGENT_STATE:
+            value = getattr(agent, name, None)
+            if value is not None:
+                size += deep_sizeof(value, seen)
+    if groupchat is not None:
+        size += deep_sizeof(groupchat.messages, seen)
+    return size
+
+
+class SessionRecord:
+    def __init__(self, session_id, release, measure, now):
+        self.session_id = session_id
+        self.release = release
+        self.measure = measure
+        self.created = now
+        self.last_active = now
+        self.active = 0  # chats running
+        self.memory = 0
+        self.messages = 0
+
+
+class SessionRegistry:
+    """The chat sessions of the process, their last activity and approximate memory.
+
+    Each session registers a `release` callback, dropping its agents, histories and collection references, and a
+    `measure` callback returning (bytes, messages). `sweep` releases the sessions idle for longer than `ttl`, then
+    the least recently active idle ones while the sessions or the process use more memory than allowed. A
+    released session builds a new team on its next message. Sessions in the middle of a chat are never released.
+    """
+
+    def __init__(self, ttl=SESSION_IDLE_TTL, max_memory=SESSIONS_MEMORY, max_rss=MAX_RSS, clock=time.monotonic):
+        self.ttl = ttl
+        self.max_memory = max_memory
+        self.max_rss = max_rss
+        self.clock = clock
+        self._sessions = {}
+        self._lock = threading.RLock()
+        self.evicted = {"idle": 0, "memory": 0}
+
+    def register(self, session_id, release, measure):
+        with self._lock:
+            record = self._sessions.get(session_id)
+            if record is None:
+                record = self._sessions[session_id] = SessionRecord(session_id, release, measure, self.clock())
+            else:
+                record.release, record.measure = release, measure
+            return record
+
+    def touch(self, session_id):
+        with self._lock:
+            record = self._sessions.get(session_id)
+            if record is not None:
+                record.last_active = self.clock()
+
+    @contextmanager
+    def active(self, session_id):
+        """Mark the session as chatting, it is measured when the chat ends."""
+        with self._lock:
+            record = self._sessions.get(session_id)
+            if record is not None:
+                record.active += 1
+                record.last_active = self.clock()
+        try:
+            yield
+        finally:
+            if record is not None:
+                with self._lock:
+                    record.active -= 1
+                    record.last_active = self.clock()
+                self.measure(session_id)
+
+    def measure(self, session_id):
+        with self._lock:
+            record = self._sessions.get(session_id)
+        if record is None:
+            return
+        try:
+            record.memory, record.messages = record.measure()
+        except Exception:  # noqa
+            logger.debug(f"failed to measure session {session_id}", exc_info=1)
+
+    def _release(self, record, reason):
+        try:
+            record.release()
+        except Exception:  # noqa
+            logger.warning(f"failed to release session {record.session_id}", exc_info=1)
+        self._sessions.pop(record.session_id, None)
+        if reason:
+            self.evicted[reason] += 1
+
+    def forget(self, session_id):
+        """Release a session, e.g. when its browser tab is closed."""
+        with self._lock:
+            record = self._sessions.get(session_id)
+            if record is not None:
+                self._release(record, None)
+
+    def sweep(self):
+        """Release the idle sessions over the TTL, then under memory pressure, return their ids."""
+        evicted = []
+        with self._lock:
+            now = self.clock()
+            for record in list(self._sessions.values()):
+                if not record.active and now - record.last_active > self.ttl:
+                    self._release(record, "idle")
+                    evicted.append(record.session_id)
+            total = sum(record.memory for record in self._sessions.values())
+            rss = _rss_bytes()
+            excess = max(
+                total - self.max_memory if self.max_memory else 0,
+                rss - self.max_rss if self.max_rss and rss else 0,
+            )
+            idle = sorted((r for r in self._sessions.values() if not r.active), key=lambda r: r.last_active)
+            for record in idle:
+                if excess <= 0:
+                    break
+                excess -= record.memory
+                self._release(record, "memory")
+                evicted.append(record.session_id)
+        if evicted:
+            logger.info(f"released {len(evicted)} sessions")
+            gc.collect()
+        return evicted
+
+    def rows(self):
+        """Return one row per session for a table, with a short id, its memory, messages and idle time."""
+        with self._lock:
+            now = self.clock()
+            return [
+                {
+                    "session": record.session_id[-8:],
+                    "state": "chatting" if record.active else "idle",
+                    "memory_kb": round(record.memory / 1024, 1),
+                    "messages": record.messages,
+                    "idle_s": int(now - record.last_active),
+                    "age_s": int(now - record.created),
+                }
+                for record in sorted(self._sessions.values(), key=lambda r: r.last_active, reverse=True)
+            ]
+
+    def stats(self):
+        with self._lock:
+            memory = sum(record.memory for record in self._sessions.values())
+            return {"sessions": len(self._sessions), "memory_bytes": memory, "rss_bytes": _rss_bytes(), **self.evicted}
+
+
+SESSIONS = SessionRegistry()
+
+
+def prune_collections(path=".chromadb", idle=COLLECTION_IDLE_TTL):
+    """Delete the shared RAG collections no session used for `idle` seconds, and the warm teams using them."""
+    deleted = SHARED_COLLECTIONS.idle(idle)
+    if not deleted:
+        return []
+    # the warm teams would retrieve from a deleted collection
+    TEAM_POOL.evict_if(lambda team: any(getattr(agent, "_collection_name", None) in deleted for agent in team[0]))
+    return SHARED_COLLECTIONS.prune(get_chroma_client(path), names=deleted)
+
+
+def sweep():
+    """The scheduled task releasing the idle sessions and collections, the same for all sessions."""
+    SESSIONS.sweep()
+    try:
+        prune_collections()
+    except Exception:  # noqa
+        logger.warning("failed to prune the RAG collections", exc_info=1)
@@ -0,0 +1,57 @@
+import json
+import os
+
+import diskcache
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+# e.g. redis://localhost:6379/0 to share the store between hosts, empty for a local store shared by the processes
+# of this host
+STORE_URL = os.environ.get("SHARED_STORE_URL", "")
+STORE_DIR = os.environ.get("SHARED_STORE_DIR", os.path.join(".cache", "shared"))
+STORE_SIZE_LIMIT = int(os.environ.get("SHARED_STORE_SIZE_LIMIT", 2**27))  # 128 MB
+KEY_PREFIX = "autogen_panel:"
+
+
+class LocalStore:
+    """A key value store on disk, shared by the worker processes of one host, e.g. `panel serve --num-procs 4`."""
+
+    def __init__(self, directory=STORE_DIR, size_limit=STORE_SIZE_LIMIT):
+        self._cache = diskcache.Cache(directory, size_limit=size_limit, eviction_policy="least-recently-used")
+
+    def get(self, key):
+        return self._cache.get(KEY_PREFIX + key, default=None, retry=True)
+
+    def set(self, key, value, ttl=None):
+        self._cache.set(KEY_PREFIX + key, value, expire=ttl, retry=True)
+
+
+class RedisStore:
+    """A key value store in redis, shared by the worker processes of several hosts behind a load balancer.
+
+    Values are stored as json.
+    """
+
+    def __init__(self, url):
+        self._client = redis.Redis.from_url(url)
+
+    def get(self, key):
+        value = self._client.get(KEY_PREFIX + key)
+        return None if value is None else json.loads(value)
+
+    def set(self, key, value, ttl=None):
+        self._client.set(KEY_PREFIX + key, json.dumps(value), ex=ttl)
+
+
+def open_store(url=STORE_URL, directory=STORE_DIR):
+    if url:
+        if redis is None:
+            raise ImportError(f"SHARED_STORE_URL is {url}, please install redis with `pip install redis`.")
+        return RedisStore(url)
+    return LocalStore(directory)
+
+
+SHARED_STORE = open_store()
@@ -0,0 +1,145 @@
+import math
+import re
+from collections import Counter
+from functools import lru_cache
+
+import autogen
+
+WORD_RE = re.compile(r"[a-z][a-z0-9]+")
+CODE_BLOCK_RE = re.compile(r"```[ \t]*(\w+)?[ \t]*\r?\n")
+STOP_WORDS = frozenset(
+    "a an and are as at be by can do does don for from has have if in into is it its may not of on or so such that "
+    "the their them then there these this to until was we were which who will with you your".split()
+)
+ADDRESS_SCORE = 3.0  # the last message addresses an agent, e.g. "Engineer, please start." or "@Engineer"
+RULE_SCORE = 2.0  # code goes to an executor, its output back to the author of the code
+ROLE_SCORE = 0.5  # the system message of the last speaker names the agent, e.g. "feedback from admin and critic"
+MENTION_SCORE = 1.0  # the last message names an agent, the first one named scores the most
+ROUND_ROBIN_SCORE = 0.1  # ties go to the next agent in round robin order
+
+
+def _stem(word):
+    if len(word) > 4 and word.endswith("s") and not word.endswith("ss"):
+        word = word[:-1]
+    for suffix in ("ing", "ed", "er", "or"):
+        if len(word) > len(suffix) + 3 and word.endswith(suffix):
+            return word[: -len(suffix)]
+    return word
+
+
+def _terms(text):
+    return Counter(_stem(word) for word in WORD_RE.findall(text.lower()) if word not in STOP_WORDS)
+
+
+@lru_cache(maxsize=64)
+def _role_vectors(roles):
+    """Return the idf of the terms of the roles, i.e. agent names and system messages, and their tf-idf vectors."""
+    terms = [
+        _terms(f"{name.replace('_', ' ')} {name.replace('_', ' ')} {system_message}") for name, system_message in roles
+    ]
+    df = Counter(term for role_terms in terms for term in role_terms)
+    idf = {term: math.log((1 + len(roles)) / (1 + n)) + 1 for term, n in df.items()}
+    vectors = []
+    for role_terms in terms:
+        vector = {term: count * idf[term] for term, count in role_terms.items()}
+        norm = math.sqrt(sum(v * v for v in vector.values())) or 1.0
+        vectors.append({term: v / norm for term, v in vector.items()})
+    return idf, tuple(vectors)
+
+
+@lru_cache(maxsize=256)
+def _name_res(name):
+    """Return the regexes of an agent's name as written or in words, e.g. Senior_Python_Engineer or senior python
+    engineer, mentioned anywhere, and addressed at the start of a sentence or with an @."""
+    words = r"[_\s]+".join(re.escape(word) for word in re.split(r"[_\s]+", name) if word)
+    mention = re.compile(r"(?<!\w)" + words + r"(?!\w)", re.IGNORECASE)
+    address = re.compile(r"(?:(?:^|[.!?]\s|\n)\s*" + words + r"\s*[,:]|@" + words + r"(?!\w))", re.IGNORECASE)
+    return mention, address
+
+
+def _can_execute_code(agent):
+    return bool(getattr(agent, "_code_execution_config", False))
+
+
+def local_scores(groupchat, last_speaker, agents):
+    """Score each candidate as the next speaker after the last message, without calling an LLM.
+
+    - Agents addressed in the last message, then the ones only named in it, the first one named scores the most.
+    - Transition rules: a code block goes to an agent able to execute it, the output of the code goes back to the
+      agent who wrote it.
+    - Agents named in the system message of the last speaker, i.e. the ones its role works with.
+    - The similarity between the last message and each agent's name and system message.
+    - The next agent in round robin order breaks ties.
+    """
+    message = groupchat.messages[-1] if groupchat.messages else {}
+    content = message.get("content") or ""
+    if not isinstance(content, str):
+        content = str(content)
+    scores = {agent.name: 0.0 for agent in agents}
+
+    positions = {}
+    role = getattr(last_speaker, "system_message", "") or ""
+    for agent in agents:
+        mention, address = _name_res(agent.name)
+        if address.search(content):
+            scores[agent.name] += ADDRESS_SCORE
+        found = mention.search(content)
+        if found:
+            positions[agent.name] = found.start()
+        if mention.search(role):
+            scores[agent.name] += ROLE_SCORE
+    for rank, name in enumerate(sorted(positions, key=positions.get)):
+        scores[name] += MENTION_SCORE / (1 + 0.5 * rank)
+
+    if CODE_BLOCK_RE.search(content):
+        executors = [agent for agent in agents if _can_execute_code(agent)]
+        if not executors:
+            # code execution is off, the role still tells who runs the code
+            executors = [agent for agent in agents if "execut" in f"{agent.name} {agent.system_message}".lower()]
+        for agent in executors:
+            scores[agent.name] += RULE_SCORE
+    elif content.lstrip().startswith("exitcode:") and len(groupchat.messages) >= 2:
+        author = groupchat.messages[-2].get("name")
+        if author in scores:
+            scores[author] += RULE_SCORE
+
+    roles = tuple((agent.name, agent.system_message) for agent in groupchat.agents)
+    idf, vectors = _role_vectors(roles)
+    terms = _terms(content)
+    query = {term: count * idf[term] for term, count in terms.items() if term in idf}
+    norm = math.sqrt(sum(v * v for v in query.values())) or 1.0
+    for agent, vector in zip(groupchat.agents, vectors):
+        if agent.name in scores:
+            scores[agent.name] += sum(v * vector.get(term, 0.0) for term, v in query.items()) / norm
+
+    if last_speaker in groupchat.agents:
+        scores[groupchat.next_agent(last_speaker, agents).name] += ROUND_ROBIN_SCORE
+    return scores
+
+
+class LocalGroupChat(autogen.GroupChat):
+    """A GroupChat with the "local" speaker selection method, which picks the next speaker without an LLM call.
+
+    "auto" asks the LLM to read the whole transcript before each turn, "local" scores the agents with
+    `local_scores` instead. The other methods are the ones of autogen.GroupChat.
+    """
+
+    _VALID_SPEAKER_SELECTION_METHODS = autogen.GroupChat._VALID_SPEAKER_SELECTION_METHODS + ["local"]
+
+    def select_speaker(self, last_speaker, selector):
+        if self.speaker_selection_method.lower() != "local":
+            return super().select_speaker(last_speaker, selector)
+        agents = self.agents
+        if self.func_call_filter and self.messages and "function_call" in self.messages[-1]:
+            # only the agents which can execute the suggested function
+            function_name = self.messages[-1]["function_call"].get("name")
+            agents = [agent for agent in agents if agent.can_execute_function(function_name)] or [
+                agent for agent in agents if agent.function_map
+            ]
+            agents = agents or self.agents
+        if not self.allow_repeat_speaker and len(agents) > 1:
+            agents = [agent for agent in agents if agent != last_speaker]
+        if len(agents) == 1:
+            return agents[0]
+        scores = local_scores(self, last_speaker, agents)
+        return max(agents, key=lambda agent: scores[agent.name])
@@ -0,0 +1,144 @@
+import copy
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict, defaultdict
+
+from configs import TEAM_POOL_SIZE, TEAM_POOL_TTL
+
+
+def team_key(agent_specs, speaker_selection_method, code_execution, config_key):
+    """Return a content hash identifying a team built from the given settings."""
+    payload = {
+        "agents": agent_specs,
+        "speaker_selection_method": speaker_selection_method,
+        "code_execution": code_execution,
+        "config": config_key,
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def _copy_value(value, source, target):
+    """Copy one attribute value of an agent so that the clone does not share mutable state with the template."""
+    if callable(value) and getattr(value, "__self__", None) is source:
+        # Methods bound to the template, e.g. default termination checks, must be bound to the clone.
+        return getattr(target, value.__name__)
+    if isinstance(value, defaultdict):
+        factory = value.default_factory
+        if getattr(factory, "__self__", None) is source:
+            factory = getattr(target, factory.__name__)
+        return defaultdict(factory, {k: copy.copy(v) for k, v in value.items()})
+    if isinstance(value, list):
+        return [copy.copy(v) if isinstance(v, dict) else v for v in value]
+    if isinstance(value, (dict, set)):
+        return copy.copy(value)
+    if hasattr(value, "fork"):
+        # per agent state, e.g. a token ledger
+        return value.fork()
+    return value
+
+
+def clone_agent(agent, replacements=None):
+    """Clone a warm agent.
+
+    Clients, vector db handles and other heavy members are shared with the template, while the chat history,
+    reply function list and counters are copied so that each session can use its clone independently.
+    `replacements` maps ids of objects referenced by reply function configs, e.g. a GroupChat, to their clones.
+    """
+    replacements = replacements or {}
+    clone = copy.copy(agent)
+    for name, value in vars(agent).items():
+        setattr(clone, name, _copy_value(value, agent, clone))
+    for reply_func_tuple in clone._reply_func_list:
+        init_config = reply_func_tuple["init_config"]
+        if id(init_config) in replacements:
+            reply_func_tuple["init_config"] = replacements[id(init_config)]
+            reply_func_tuple["config"] = copy.copy(reply_func_tuple["init_config"])
+    return clone
+
+
+def clone_team(agents, manager, groupchat):
+    """Clone a team of agents together with its group chat and manager."""
+    new_agents = [clone_agent(agent) for agent in agents]
+    if groupchat is None:
+        return new_agents, None, None
+    new_groupchat = copy.copy(groupchat)
+    new_groupchat.agents = new_agents
+    new_groupchat.messages = []
+    new_manager = clone_agent(manager, replacements={id(groupchat): new_groupchat})
+    return new_agents, new_manager, new_groupchat
+
+
+class TeamPool:
+    """A process-wide pool of warm agent teams.
+
+    Teams are built once per content key and kept as templates with LRU and TTL eviction. Every caller gets its
+    own clone of the template, so building agents such as RetrieveUserProxyAgent or CompressibleAgent is paid
+    only once for all sessions using the same settings.
+    """
+
+    def __init__(self, max_size=32, ttl=1800):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._templates = OrderedDict()  # key -> (created_at, (agents, manager, groupchat))
+        self._build_locks = defaultdict(threading.Lock)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _get_template(self, key):
+        with self._lock:
+            entry = self._templates.get(key)
+            if entry is None:
+                return None
+            if time.monotonic() - entry[0] > self.ttl:
+                del self._templates[key]
+                return None
+            self._templates.move_to_end(key)
+            return entry[1]
+
+    def _put_template(self, key, team):
+        with self._lock:
+            self._templates[key] = (time.monotonic(), team)
+            self._templates.move_to_end(key)
+            while len(self._templates) > self.max_size:
+                old_key, _ = self._templates.popitem(last=False)
+                self._build_locks.pop(old_key, None)
+
+    def acquire(self, key, builder):
+        """Return a clone of the team for `key`, calling `builder()` to build the template on a miss."""
+        team = self._get_template(key)
+        if team is None:
+            with self._build_locks[key]:
+                team = self._get_template(key)
+                if team is None:
+                    self.misses += 1
+                    team = builder()
+                    self._put_template(key, team)
+                else:
+                    self.hits += 1
+        else:
+            self.hits += 1
+        return clone_team(*team)
+
+    def evict(self, key=None):
+        """Drop one template, or all of them if `key` is None."""
+        with self._lock:
+            if key is None:
+                self._templates.clear()
+            else:
+                self._templates.pop(key, None)
+
+    def evict_if(self, predicate):
+        """Drop the templates for which `predicate((agents, manager, groupchat))` is true."""
+        with self._lock:
+            for key in [key for key, (_, team) in self._templates.items() if predicate(team)]:
+                del self._templates[key]
+
+    def stats(self):
+        with self._lock:
+            return {"size": len(self._templates), "hits": self.hits, "misses": self.misses}
+
+
+TEAM_POOL = TeamPool(max_size=TEAM_POOL_SIZE, ttl=TEAM_POOL_TTL)
@@ -0,0 +1,103 @@
+import json
+import threading
+from functools import lru_cache
+
+from llm_client import count_prompt_tokens
+
+MESSAGE_OVERHEAD = 4  # tokens of the role and separators of a message
+
+
+@lru_cache(maxsize=4096)
+def count_tokens(content, model=""):
+    """Return the tokens of a message content, messages are copied into the history of every agent of a chat but
+    share their content string."""
+    return (count_prompt_tokens(content, model) or len(content) // 4) + MESSAGE_OVERHEAD
+
+
+def message_tokens(message, model=""):
+    content = message.get("content")
+    if content is None:
+        content = json.dumps(message.get("function_call"), default=str)
+    elif not isinstance(content, str):
+        content = str(content)
+    return count_tokens(content, model)
+
+
+class _Conversation:
+    __slots__ = ("messages", "counted", "last", "tokens")
+
+    def __init__(self, messages):
+        self.messages = messages
+        self.counted = 0
+        self.last = None
+        self.tokens = 0
+
+
+class TokenLedger:
+    """Running token totals of the conversations of one agent, one per sender.
+
+    The histories are append only during a chat, so only the messages appended since the last update are counted,
+    each message once. A cleared or rewritten history, e.g. compressed, is counted again.
+    """
+
+    def __init__(self, model=""):
+        self.model = model
+        self._conversations = {}  # sender name -> _Conversation
+        self._lock = threading.Lock()
+
+    def fork(self):
+        """Return an empty ledger for a clone of the agent."""
+        return TokenLedger(self.model)
+
+    def count(self, name, messages):
+        """Count the messages appended to the conversation with `name`, return its total tokens."""
+        with self._lock:
+            conversation = self._conversations.get(name)
+            n = conversation.counted if conversation is not None else 0
+            if (
+                conversation is None
+                or conversation.messages is not messages
+                or len(messages) < n
+                or (n and messages[n - 1] is not conversation.last)
+            ):
+                conversation = self._conversations[name] = _Conversation(messages)
+                n = 0
+            for message in messages[n:]:
+                conversation.tokens += message_tokens(message, self.model)
+            conversation.counted = len(messages)
+            conversation.last = messages[-1] if messages else None
+            return conversation.tokens
+
+    def update(self, agent, sender=None):
+        """Count the new messages of `agent` with `sender`, or with all its senders, return their total tokens."""
+        if sender is not None:
+            return self.count(sender.name, agent._oai_messages[sender])
+        return sum(self.count(other.name, messages) for other, messages in list(agent._oai_messages.items()))
+
+    def totals(self):
+        """Return the messages and tokens counted with each sender."""
+        with self._lock:
+            return {
+                name: {"messages": conversation.counted, "tokens": conversation.tokens}
+                for name, conversation in self._conversations.items()
+            }
+
+
+def attach_ledger(agent, model=""):
+    agent._token_ledger = TokenLedger(model)
+    return agent._token_ledger
+
+
+def get_ledger(agent):
+    return getattr(agent, "_token_ledger", None)
+
+
+def session_tokens(agents):
+    """Return the tokens of the conversations of each agent with each sender, and their total."""
+    per_agent = {}
+    for agent in agents or []:
+        ledger = get_ledger(agent)
+        if ledger is not None:
+            ledger.update(agent)
+            per_agent[agent.name] = {name: total["tokens"] for name, total in ledger.totals().items()}
+    return {"total": sum(sum(totals.values()) for totals in per_agent.values()), "agents": per_agent}
@@ -1,102 +1,39 @@
-import multiprocessing as mp
+import logging
 import os
 from pathlib import Path
 
-import autogen
-import chromadb
 import gradio as gr
-from autogen.agentchat.contrib.retrieve_assistant_agent import RetrieveAssistantAgent
-from autogen.agentchat.contrib.retrieve_user_proxy_agent import (
-    PROMPT_CODE,
-    RetrieveUserProxyAgent,
-)
-from autogen.retrieve_utils import TEXT_FORMATS, get_file_from_url, is_url
+from autogen.agentchat.contrib.retrieve_user_proxy_agent import PROMPT_CODE
+from autogen.retrieve_utils import TEXT_FORMATS, is_url
+from download_cache import fetch
+from rag_agents import TIMEOUT, answer, init_worker
+from rag_workers import WorkerPool
+from session_config import SESSION_CONFIGS, Credentials
 
-TIMEOUT = 60
+logger = logging.getLogger(__name__)
 
+# the warm RAG workers, each loads the embedding model and builds the agents once instead of once per question
+RAG_POOL = WorkerPool(init_worker, answer)
+# the context and prompt of the chat, the same for all sessions, the workers rebuild their agents when it changes
+rag_context = {"docs_path": None, "source": None, "version": 0, "prompt": PROMPT_CODE}
 
-def initialize_agents(config_list, docs_path=None):
-    if isinstance(config_list, gr.State):
-        _config_list = config_list.value
-    else:
-        _config_list = config_list
-    if docs_path is None:
-        docs_path = "https://raw.githubusercontent.com/microsoft/autogen/main/README.md"
 
-    assistant = RetrieveAssistantAgent(
-        name="assistant",
-        system_message="You are a helpful assistant.",
-    )
-
-    ragproxyagent = RetrieveUserProxyAgent(
-        name="ragproxyagent",
-        human_input_mode="NEVER",
-        max_consecutive_auto_reply=5,
-        retrieve_config={
-            "task": "code",
-            "docs_path": docs_path,
-            "chunk_token_size": 2000,
-            "model": _config_list[0]["model"],
-            "client": chromadb.PersistentClient(path="/tmp/chromadb"),
-            "embedding_model": "all-mpnet-base-v2",
-            "customized_prompt": PROMPT_CODE,
-            "get_or_create": True,
-            "collection_name": "autogen_rag",
-        },
-    )
-
-    return assistant, ragproxyagent
-
-
-def initiate_chat(config_list, problem, queue, n_results=3):
-    global assistant, ragproxyagent
-    if isinstance(config_list, gr.State):
-        _config_list = config_list.value
-    else:
-        _config_list = config_list
-    if len(_config_list[0].get("api_key", "")) < 2:
-        queue.put(["Hi, nice to meet you! Please enter your API keys in below text boxs."])
-        return
-    else:
-        llm_config = (
-            {
-                "request_timeout": TIMEOUT,
-                # "seed": 42,
-                "config_list": _config_list,
-                "use_cache": False,
-            },
-        )
-        assistant.llm_config.update(llm_config[0])
-    assistant.reset()
-    try:
-        ragproxyagent.initiate_chat(assistant, problem=problem, silent=False, n_results=n_results)
-        messages = ragproxyagent.chat_messages
-        messages = [messages[k] for k in messages.keys()][0]
-        messages = [m["content"] for m in messages if m["role"] == "user"]
-        print("messages: ", messages)
-    except Exception as e:
-        messages = [str(e)]
-    queue.put(messages)
-
-
-def chatbot_reply(input_text):
+def chatbot_reply(input_text, config_list):
     """Chat with the agent through terminal."""
-    queue = mp.Queue()
-    process = mp.Process(
-        target=initiate_chat,
-        args=(config_list, input_text, queue),
-    )
-    process.start()
+    if len(config_list[0].get("api_key", "")) < 2:
+        return ["Hi, nice to meet you! Please enter your API keys in below text boxs."]
     try:
-        # process.join(TIMEOUT+2)
-        messages = queue.get(timeout=TIMEOUT)
+        messages = RAG_POOL.run(
+            config_list,
+            input_text,
+            rag_context["docs_path"],
+            rag_context["version"],
+            rag_context["prompt"],
+            rag_context["source"],
+            timeout=TIMEOUT,
+        )
     except Exception as e:
         messages = [str(e) if len(str(e)) > 0 else "Invalid Request to OpenAI, please check your API keys."]
-    finally:
-        try:
-            process.terminate()
-        except:  # noqa
-            pass
     return messages
 
 
@@ -110,26 +47,7 @@ def get_description_text():
     """
 
 
-global assistant, ragproxyagent
-
 with gr.Blocks() as demo:
-    config_list, assistant, ragproxyagent = (
-        gr.State(
-            [
-                {
-                    "api_key": "",
-                    "api_base": "",
-                    "api_type": "azure",
-                    "api_version": "2023-07-01-preview",
-                    "model": "gpt-35-turbo",
-                }
-            ]
-        ),
-        None,
-        None,
-    )
-    assistant, ragproxyagent = initialize_agents(config_list)
-
     gr.Markdown(get_description_text())
     chatbot = gr.Chatbot(
         [],
@@ -147,40 +65,6 @@ with gr.Blocks() as demo:
     )
 
     with gr.Row():
-
-        def update_config(config_list):
-            global assistant, ragproxyagent
-            config_list = autogen.config_list_from_models(
-                model_list=[os.environ.get("MODEL", "gpt-35-turbo")],
-            )
-            if not config_list:
-                config_list = [
-                    {
-                        "api_key": "",
-                        "api_base": "",
-                        "api_type": "azure",
-                        "api_version": "2023-07-01-preview",
-                        "model": "gpt-35-turbo",
-                    }
-                ]
-            llm_config = (
-                {
-                    "request_timeout": TIMEOUT,
-                    # "seed": 42,
-                    "config_list": config_list,
-                },
-            )
-            assistant.llm_config.update(llm_config[0])
-            ragproxyagent._model = config_list[0]["model"]
-            return config_list
-
-        def set_params(model, oai_key, aoai_key, aoai_base):
-            os.environ["MODEL"] = model
-            os.environ["OPENAI_API_KEY"] = oai_key
-            os.environ["AZURE_OPENAI_API_KEY"] = aoai_key
-            os.environ["AZURE_OPENAI_API_BASE"] = aoai_base
-            return model, oai_key, aoai_key, aoai_base
-
         txt_model = gr.Dropdown(
             label="Model",
             choices=[
@@ -224,8 +108,11 @@ with gr.Blocks() as demo:
 
     with gr.Row():
 
-        def upload_file(file):
-            return update_context_url(file.name)
+        def upload_file(file, model):
+            # each upload is stored at another temp path, its chunks are keyed by the name of the uploaded file
+            return update_context_url(
+                file.name, model, source=getattr(file, "orig_name", None) or os.path.basename(file.name)
+            )
 
         upload_button = gr.UploadButton(
             "Click to upload a context file or enter a url in the right textbox",
@@ -251,11 +138,13 @@ with gr.Blocks() as demo:
         show_copy_button=True,
     )
 
-    def respond(message, chat_history, model, oai_key, aoai_key, aoai_base):
-        global config_list
-        set_params(model, oai_key, aoai_key, aoai_base)
-        config_list = update_config(config_list)
-        messages = chatbot_reply(message)
+    def respond(message, chat_history, model, oai_key, aoai_key, aoai_base, request: gr.Request):
+        # resolved once per session and credentials, without touching os.environ shared by all sessions
+        config = SESSION_CONFIGS.get(
+            request.session_hash,
+            Credentials(model=model, openai_key=oai_key, aoai_key=aoai_key, aoai_base=aoai_base),
+        )
+        messages = chatbot_reply(message, config.to_config_list())
         _msg = (
             messages[-1]
             if len(messages) > 0 and messages[-1] != "TERMINATE"
@@ -267,34 +156,30 @@ with gr.Blocks() as demo:
         return "", chat_history
 
     def update_prompt(prompt):
-        ragproxyagent.customized_prompt = prompt
+        rag_context["prompt"] = prompt
         return prompt
 
-    def update_context_url(context_url):
-        global assistant, ragproxyagent
-
+    def update_context_url(context_url, model, source=None):
         file_extension = Path(context_url).suffix
-        print("file_extension: ", file_extension)
+        logger.debug(f"file_extension: {file_extension}")
         if file_extension.lower() not in [f".{i}" for i in TEXT_FORMATS]:
             return f"File must be in the format of {TEXT_FORMATS}"
 
         if is_url(context_url):
             try:
-                file_path = get_file_from_url(
-                    context_url,
-                    save_path=os.path.join("/tmp", os.path.basename(context_url)),
-                )
+                fetch(context_url)
             except Exception as e:
                 return str(e)
+            # the url, not the downloaded file, is the source of the chunks, so its unchanged chunks keep their ids
+            file_path, source = context_url, None
         else:
             file_path = context_url
             context_url = os.path.basename(context_url)
+            if source is not None:
+                source = f"upload:{source}"
 
-        try:
-            chromadb.PersistentClient(path="/tmp/chromadb").delete_collection(name="autogen_rag")
-        except:  # noqa
-            pass
-        assistant, ragproxyagent = initialize_agents(config_list, docs_path=file_path)
+        # the workers sync the collection with the new docs, only the new or changed chunks are embedded
+        rag_context.update(docs_path=file_path, source=source, version=rag_context["version"] + 1)
         return context_url
 
     txt_input.submit(
@@ -303,9 +188,10 @@ with gr.Blocks() as demo:
         [txt_input, chatbot],
     )
     txt_prompt.submit(update_prompt, [txt_prompt], [txt_prompt])
-    txt_context_url.submit(update_context_url, [txt_context_url], [txt_context_url])
-    upload_button.upload(upload_file, upload_button, [txt_context_url])
+    txt_context_url.submit(update_context_url, [txt_context_url, txt_model], [txt_context_url])
+    upload_button.upload(upload_file, [upload_button, txt_model], [txt_context_url])
 
 
 if __name__ == "__main__":
+    RAG_POOL.start()  # the workers warm up while the app starts
     demo.launch(share=True, server_name="0.0.0.0")
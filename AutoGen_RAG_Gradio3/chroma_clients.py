@@ -0,0 +1,108 @@
+import os
+import threading
+from collections import defaultdict
+
+import chromadb
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+
+def _rss_bytes():
+    """Return the resident set size of the current process, or the peak RSS if the current one is unknown."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        pass
+    if resource is not None:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return None
+
+
+def _dir_size(path):
+    size = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                size += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return size
+
+
+class ChromaClientRegistry:
+    """A thread-safe registry holding one chromadb PersistentClient per path for the whole process.
+
+    Creating a PersistentClient opens the sqlite db and loads the segment indexes of the path, so sessions
+    should share one client instead of creating a new one for every agent.
+    """
+
+    def __init__(self):
+        self._clients = {}
+        self._requests = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def get_client(self, path):
+        """Return the shared client for `path`, creating it on first use."""
+        path = os.path.abspath(path)
+        with self._lock:
+            client = self._clients.get(path)
+            if client is None:
+                client = chromadb.PersistentClient(path=path)
+                self._clients[path] = client
+            self._requests[path] += 1
+            return client
+
+    def close(self, path=None):
+        """Release the client for `path`, or all clients if `path` is None."""
+        with self._lock:
+            paths = list(self._clients) if path is None else [os.path.abspath(path)]
+            for _path in paths:
+                client = self._clients.pop(_path, None)
+                self._requests.pop(_path, None)
+                if client is None:
+                    continue
+                try:
+                    client._system.stop()
+                    # drop chromadb's own per-path cache so that the next client reopens the path
+                    type(client)._identifer_to_system.pop(client._identifier, None)
+                except Exception:  # noqa
+                    pass
+
+    def _forget_after_fork(self):
+        """Drop the clients inherited by a forked worker, they hold the sqlite connections of the parent."""
+        self._lock = threading.Lock()
+        for client in self._clients.values():
+            type(client)._identifer_to_system.pop(client._identifier, None)
+        self._clients = {}
+        self._requests = defaultdict(int)
+
+    def stats(self):
+        """Return open handles per path and the memory used by the process."""
+        with self._lock:
+            clients = dict(self._clients)
+            requests = dict(self._requests)
+        paths = {}
+        for path, client in clients.items():
+            try:
+                n_collections = len(client.list_collections())
+            except Exception:  # noqa
+                n_collections = None
+            paths[path] = {
+                "requests": requests.get(path, 0),
+                "collections": n_collections,
+                "disk_bytes": _dir_size(path),
+            }
+        return {"open_clients": len(clients), "rss_bytes": _rss_bytes(), "paths": paths}
+
+
+CHROMA_CLIENTS = ChromaClientRegistry()
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=CHROMA_CLIENTS._forget_after_fork)
+
+
+def get_chroma_client(path):
+    return CHROMA_CLIENTS.get_client(path)
@@ -0,0 +1,132 @@
+import hashlib
+import os
+import threading
+import time
+from collections import defaultdict
+from urllib.parse import urlparse
+
+import diskcache
+import requests
+
+# Processes sharing the directory, e.g. several workers or apps on one host, share the downloaded docs.
+CACHE_DIR = os.environ.get("DOWNLOAD_CACHE_DIR", os.path.join(".cache", "downloads"))
+CACHE_SIZE_LIMIT = int(os.environ.get("DOWNLOAD_CACHE_SIZE_LIMIT", 2**30))  # 1 GB
+FRESH_FOR = 60  # seconds a download is used without asking the server whether it changed
+TIMEOUT = 60
+LOCK_EXPIRE = 300  # seconds before the lock of a process which died while downloading is released
+
+
+class DownloadCache:
+    """Downloaded docs on disk, stored by the hash of their content and revalidated with ETag and Last-Modified.
+
+    A url checked less than `fresh_for` seconds ago is not requested again. Later, the server is asked whether the
+    doc changed, and only a changed doc is downloaded again. Docs with the same content are stored once, docs with
+    the same file name from different urls don't overwrite each other. A url is downloaded by one caller only,
+    concurrent callers, in this process or another one, wait for it. The least recently used docs are deleted once
+    the docs take more than `size_limit` bytes.
+    """
+
+    def __init__(self, directory=CACHE_DIR, size_limit=CACHE_SIZE_LIMIT, fresh_for=FRESH_FOR, clock=time.time):
+        self.directory = directory
+        self.size_limit = size_limit
+        self.fresh_for = fresh_for
+        self.clock = clock
+        self._blobs = os.path.join(directory, "blobs")
+        os.makedirs(self._blobs, exist_ok=True)
+        # url -> its doc and validators, blob -> its size and last use
+        self._index = diskcache.Cache(os.path.join(directory, "index"))
+        self._locks = defaultdict(threading.Lock)
+        self.counts = {"fresh": 0, "not_modified": 0, "downloaded": 0, "evicted": 0}
+
+    def _download(self, url, entry):
+        headers = {}
+        if entry is not None:
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+        with requests.get(url, headers=headers, stream=True, timeout=TIMEOUT) as response:
+            if response.status_code == 304 and entry is not None:
+                self.counts["not_modified"] += 1
+                return entry
+            response.raise_for_status()
+            h = hashlib.sha256()
+            tmp = os.path.join(self._blobs, f".{os.getpid()}.{threading.get_ident()}.tmp")
+            with open(tmp, "wb") as f:
+                for chunk in response.iter_content(chunk_size=1 << 16):
+                    h.update(chunk)
+                    f.write(chunk)
+            # keep the extension, autogen tells the pdf files from the text ones by it
+            blob = h.hexdigest() + os.path.splitext(urlparse(url).path)[1].lower()
+            size = os.path.getsize(tmp)
+            os.replace(tmp, os.path.join(self._blobs, blob))
+            self.counts["downloaded"] += 1
+            return {
+                "blob": blob,
+                "size": size,
+                "etag": response.headers.get("ETag"),
+                "last_modified": response.headers.get("Last-Modified"),
+            }
+
+    def fetch(self, url):
+        """Return the path of the local copy of `url`, downloading it only if it's new or changed."""
+        with self._locks[url], diskcache.Lock(self._index, f"lock:{url}", expire=LOCK_EXPIRE):
+            entry = self._index.get(f"url:{url}", retry=True)
+            if entry is not None and not os.path.exists(os.path.join(self._blobs, entry["blob"])):
+                entry = None  # evicted
+            now = self.clock()
+            if entry is not None and now - entry["checked"] < self.fresh_for:
+                self.counts["fresh"] += 1
+            else:
+                entry = {**self._download(url, entry), "checked": now}
+                self._index.set(f"url:{url}", entry, retry=True)
+            self._index.set(f"blob:{entry['blob']}", {"size": entry["size"], "used": now}, retry=True)
+        self._evict(keep=entry["blob"])
+        return os.path.join(self._blobs, entry["blob"])
+
+    def _evict(self, keep=None):
+        blobs = []
+        for key in list(self._index.iterkeys()):
+            if isinstance(key, str) and key.startswith("blob:"):
+                meta = self._index.get(key)
+                if meta is not None:
+                    blobs.append((meta["used"], key[len("blob:") :], meta["size"]))
+        total = sum(size for _, _, size in blobs)
+        for _, blob, size in sorted(blobs):
+            if total <= self.size_limit:
+                break
+            if blob == keep:
+                continue
+            try:
+                os.remove(os.path.join(self._blobs, blob))
+            except OSError:
+                pass
+            self._index.delete(f"blob:{blob}", retry=True)
+            total -= size
+            self.counts["evicted"] += 1
+
+    def stats(self):
+        n_blobs, size = 0, 0
+        for name in os.listdir(self._blobs):
+            if not name.endswith(".tmp"):
+                n_blobs += 1
+                size += os.path.getsize(os.path.join(self._blobs, name))
+        return {"docs": n_blobs, "bytes": size, "size_limit": self.size_limit, **self.counts}
+
+
+_caches = {}
+_lock = threading.Lock()
+
+
+def get_download_cache(directory=CACHE_DIR):
+    """Return the download cache of this process, forked processes open their own connection to the index."""
+    key = (os.getpid(), os.path.abspath(directory))
+    with _lock:
+        cache = _caches.get(key)
+        if cache is None:
+            cache = _caches[key] = DownloadCache(directory)
+        return cache
+
+
+def fetch(url):
+    return get_download_cache().fetch(url)
@@ -0,0 +1,150 @@
+import hashlib
+import json
+import os
+import threading
+
+import diskcache
+
+try:
+    from autogen import OpenAIWrapper
+except ImportError:  # pyautogen<0.2 has no OpenAIWrapper, use `cached_create` with `oai.ChatCompletion.create`
+    OpenAIWrapper = None
+
+# Processes sharing the directory, e.g. several workers or apps on one host, share the cached responses.
+CACHE_DIR = os.environ.get("LLM_CACHE_DIR", os.path.join(".cache", "llm_responses"))
+CACHE_SIZE_LIMIT = int(os.environ.get("LLM_CACHE_SIZE_LIMIT", 2**28))  # 256 MB
+CACHE_TTL = int(os.environ.get("LLM_CACHE_TTL", 7 * 24 * 3600))  # seconds
+LOCK_EXPIRE = 300  # seconds before the lock of a process which died while calling the LLM is released
+
+# create arguments which don't change the response
+IGNORED_PARAMS = {
+    "timeout",
+    "request_timeout",
+    "max_retries",
+    "cache_seed",
+    "use_cache",
+    "stream",
+    "filter_func",
+    "raise_on_ratelimit_or_timeout",
+}
+# the endpoint a config calls, responses of different endpoints, deployments or accounts are never shared
+ENDPOINT_PARAMS = ("api_type", "api_base", "base_url", "azure_endpoint", "api_version", "organization")
+MESSAGE_KEYS = ("role", "content", "name", "function_call")
+
+
+def _normalize_message(message):
+    return {k: message[k] for k in MESSAGE_KEYS if message.get(k) is not None}
+
+
+def _normalize_params(params):
+    params = {k: v for k, v in params.items() if k not in IGNORED_PARAMS and v is not None}
+    endpoint = {k: str(params.pop(k)) for k in ENDPOINT_PARAMS if k in params}
+    api_key = params.pop("api_key", None)
+    if api_key:
+        # a one-way fingerprint, the key itself is never stored
+        endpoint["api_key"] = hashlib.sha256(str(api_key).encode("utf-8")).hexdigest()
+    if endpoint:
+        params["endpoint"] = endpoint
+    return params
+
+
+def response_key(messages=None, config_list=None, **params):
+    """Return the cache key of a completion, from the normalized messages, the models, the endpoints with a
+    fingerprint of their credentials, and the parameters."""
+    payload = {
+        "messages": [_normalize_message(m) for m in messages or []],
+        "config_list": [_normalize_params(c) for c in config_list or []],
+        "params": _normalize_params(params),
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """A bounded LLM response cache on disk, safe to share between threads and processes.
+
+    Entries expire after `ttl` seconds and the least recently used ones are evicted once the cache is bigger than
+    `size_limit` bytes. A miss is computed by one caller only, concurrent callers with the same key, in this
+    process or another one, wait for its response instead of calling the LLM too.
+    """
+
+    def __init__(self, directory=CACHE_DIR, size_limit=CACHE_SIZE_LIMIT, ttl=CACHE_TTL):
+        self.directory = directory
+        self.ttl = ttl
+        self._cache = diskcache.Cache(directory, size_limit=size_limit, eviction_policy="least-recently-used")
+        self._cache.stats(enable=True)
+
+    def get(self, key):
+        return self._cache.get(key, default=None, retry=True)
+
+    def set(self, key, response):
+        self._cache.set(key, response, expire=self.ttl, retry=True)
+
+    def get_or_create(self, key, create):
+        """Return the cached response for `key`, calling `create()` on a miss."""
+        response = self.get(key)
+        if response is not None:
+            return response
+        with diskcache.Lock(self._cache, f"lock:{key}", expire=LOCK_EXPIRE):
+            if key in self._cache:
+                response = self.get(key)
+            if response is None:
+                response = create()
+                if response is not None:
+                    self.set(key, response)
+        return response
+
+    def stats(self):
+        """Return hits and misses of all processes sharing the cache, its number of entries and its size."""
+        hits, misses = self._cache.stats()
+        return {
+            "hits": hits,
+            "misses": misses,
+            "entries": len(self._cache),
+            "bytes": self._cache.volume(),
+            "size_limit": self._cache.size_limit,
+            "directory": self.directory,
+        }
+
+    def clear(self):
+        self._cache.clear(retry=True)
+        self._cache.stats(reset=True)
+
+
+_caches = {}
+_lock = threading.Lock()
+
+
+def get_response_cache(directory=CACHE_DIR):
+    """Return the response cache of this process, forked processes open their own connection to the db."""
+    key = (os.getpid(), os.path.abspath(directory))
+    with _lock:
+        cache = _caches.get(key)
+        if cache is None:
+            cache = _caches[key] = ResponseCache(directory)
+        return cache
+
+
+def cached_create(create, **config):
+    """Call `create(**config)`, e.g. `oai.ChatCompletion.create`, through the response cache unless `use_cache` is
+    False."""
+    if config.get("use_cache") is False:
+        return create(**config)
+    key = response_key(**config)
+    return get_response_cache().get_or_create(key, lambda: create(**config))
+
+
+if OpenAIWrapper is not None:
+
+    class CachedOpenAIWrapper(OpenAIWrapper):
+        """An OpenAIWrapper using the shared response cache instead of its own unbounded one per cache_seed."""
+
+        def __init__(self, **base_config):
+            super().__init__(**base_config)
+            # the config list overrides the create config, turn off the per cache_seed cache there
+            for config in self._config_list:
+                config["cache_seed"] = None
+
+        def create(self, **config):
+            key = response_key(config_list=self._config_list, **config)
+            create = super().create
+            return get_response_cache().get_or_create(key, lambda: create(**config))
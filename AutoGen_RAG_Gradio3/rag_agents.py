@@ -0,0 +1,127 @@
+import logging
+from functools import partial
+
+from autogen import Agent, oai
+from autogen.agentchat.contrib.retrieve_assistant_agent import RetrieveAssistantAgent
+from autogen.agentchat.contrib.retrieve_user_proxy_agent import (
+    PROMPT_CODE,
+    RetrieveUserProxyAgent,
+)
+from chroma_clients import get_chroma_client
+from embedding_server import get_embedding_function
+from embeddings import embedding_id
+from llm_cache import cached_create
+from rag_ingest import sync_collection
+
+logger = logging.getLogger(__name__)
+
+TIMEOUT = 60
+CHROMA_PATH = "/tmp/chromadb"
+EMBEDDING_MODEL = "all-mpnet-base-v2"
+# the int8 backend gives other vectors, its collection is kept apart
+COLLECTION_NAME = "autogen_rag" if embedding_id(EMBEDDING_MODEL) == EMBEDDING_MODEL else "autogen_rag_int8"
+CHUNK_TOKEN_SIZE = 2000
+DEFAULT_DOCS = "https://raw.githubusercontent.com/microsoft/autogen/main/README.md"
+
+
+def cached_oai_reply(recipient, messages=None, sender=None, config=None):
+    """Generate a reply using autogen.oai, through the response cache shared by the demo apps unless `use_cache` is
+    False in the llm config."""
+    llm_config = recipient.llm_config if config is None else config
+    if llm_config is False:
+        return False, None
+    if messages is None:
+        messages = recipient._oai_messages[sender]
+    response = cached_create(
+        # cached once, in the shared cache, not in autogen's own disk cache too
+        partial(oai.ChatCompletion.create, use_cache=False),
+        context=messages[-1].pop("context", None),
+        messages=recipient._oai_system_message + messages,
+        **llm_config,
+    )
+    return True, oai.ChatCompletion.extract_text_or_function_call(response)[0]
+
+
+def initialize_agents(config_list):
+    """Create the agents retrieving from the collection, its docs are ingested by `sync_collection`."""
+    assistant = RetrieveAssistantAgent(
+        name="assistant",
+        system_message="You are a helpful assistant.",
+    )
+    # right before generate_oai_reply, which is the last reply function
+    assistant.register_reply([Agent, None], cached_oai_reply, position=len(assistant._reply_func_list) - 1)
+
+    ragproxyagent = RetrieveUserProxyAgent(
+        name="ragproxyagent",
+        human_input_mode="NEVER",
+        max_consecutive_auto_reply=5,
+        retrieve_config={
+            "task": "code",
+            "docs_path": None,
+            "chunk_token_size": CHUNK_TOKEN_SIZE,
+            "model": config_list[0]["model"],
+            "client": get_chroma_client(CHROMA_PATH),
+            "embedding_model": EMBEDDING_MODEL,
+            # the model is loaded once per host by the embedding server, not by every worker
+            "embedding_function": get_embedding_function(EMBEDDING_MODEL),
+            "customized_prompt": PROMPT_CODE,
+            "collection_name": COLLECTION_NAME,
+        },
+    )
+
+    return assistant, ragproxyagent
+
+
+def init_worker():
+    """Connect to the embedding server, or load the embedding model, and open the vector db once per RAG worker, not
+    once per question."""
+    get_embedding_function(EMBEDDING_MODEL)(["warm up"])
+    get_chroma_client(CHROMA_PATH)
+    return {"context": None, "agents": None}
+
+
+def _stop_if_cancelled(cancel):
+    def reply_func(recipient, messages=None, sender=None, config=None):
+        # no reply ends the chat, the worker is free again at the next turn
+        return (True, None) if cancel.is_set() else (False, None)
+
+    return reply_func
+
+
+def answer(
+    state, cancel, config_list, problem, docs_path=None, context_version=0, prompt=None, source=None, n_results=3
+):
+    """Answer `problem` in a RAG worker, with the agents of the worker built once per context.
+
+    The collection is synced with the docs by the first question on a new context only, only the new or changed chunks
+    are embedded, the following questions query the collection. `source` is the source of the chunks of the local file
+    `docs_path`, e.g. the name of an uploaded file.
+    """
+    context = (docs_path, context_version)
+    if state["context"] != context:
+        sync_collection(
+            get_chroma_client(CHROMA_PATH),
+            COLLECTION_NAME,
+            docs_path or DEFAULT_DOCS,
+            CHUNK_TOKEN_SIZE,
+            embedding_function=get_embedding_function(EMBEDDING_MODEL),
+            sources={docs_path: source} if docs_path and source else None,
+        )
+        assistant, ragproxyagent = initialize_agents(config_list)
+        for agent in (assistant, ragproxyagent):
+            agent.register_reply([Agent, None], _stop_if_cancelled(cancel))
+        state["context"], state["agents"] = context, (assistant, ragproxyagent)
+    assistant, ragproxyagent = state["agents"]
+    assistant.llm_config.update({"request_timeout": TIMEOUT, "config_list": config_list})
+    ragproxyagent._model = config_list[0]["model"]
+    ragproxyagent.customized_prompt = prompt or PROMPT_CODE
+    assistant.reset()
+    try:
+        ragproxyagent.initiate_chat(assistant, problem=problem, silent=False, n_results=n_results)
+        messages = ragproxyagent.chat_messages
+        messages = [messages[k] for k in messages.keys()][0]
+        messages = [m["content"] for m in messages if m["role"] == "user"]
+        logger.debug(f"messages: {messages}")
+    except Exception as e:
+        messages = [str(e)]
+    return messages
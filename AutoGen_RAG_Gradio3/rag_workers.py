@@ -0,0 +1,177 @@
+import itertools
+import logging
+import multiprocessing as mp
+import os
+import queue
+import threading
+
+logger = logging.getLogger(__name__)
+
+RAG_WORKERS = int(os.environ.get("RAG_WORKERS", 2))  # questions answered at the same time
+MAX_TASKS_PER_WORKER = int(os.environ.get("RAG_MAX_TASKS_PER_WORKER", 100))  # a worker is replaced after as many
+CANCEL_GRACE = 30  # seconds a cancelled question may take to stop before its worker is killed
+
+
+class WorkerError(Exception):
+    """A question failed in the worker, its message is the one of the exception raised there."""
+
+
+def _worker_main(conn, cancel, initializer, handler):
+    # the state, e.g. the embedding model and the agents, lives as long as the worker
+    state = initializer() if initializer is not None else {}
+    while True:
+        try:
+            task = conn.recv()
+        except (EOFError, KeyboardInterrupt):
+            break
+        if task is None:
+            break
+        task_id, args = task
+        try:
+            result = ("ok", handler(state, cancel, *args))
+        except Exception as e:  # noqa
+            result = ("error", str(e))
+        try:
+            conn.send((task_id, *result))
+        except (OSError, EOFError):
+            break
+
+
+class _Worker:
+    def __init__(self, ctx, initializer, handler):
+        self.conn, child_conn = ctx.Pipe()
+        self.cancel = ctx.Event()
+        self.process = ctx.Process(
+            target=_worker_main, args=(child_conn, self.cancel, initializer, handler), daemon=True
+        )
+        self.process.start()
+        child_conn.close()
+        self.tasks = 0
+
+    def stop(self, timeout=5):
+        try:
+            self.conn.send(None)
+        except (OSError, EOFError):
+            pass
+        self.process.join(timeout)
+        self.kill()
+
+    def kill(self):
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.conn.close()
+
+
+class WorkerPool:
+    """A pool of long lived processes answering questions one at a time each.
+
+    `initializer()` runs once in each worker and returns its state, e.g. with the embedding model loaded and the vector
+    db opened, `handler(state, cancel, *args)` answers one question. A question not answered within its timeout is
+    cancelled: `cancel` is set, the handler is expected to check it between the turns of the chat and stop early, its
+    late answer is dropped. Only a worker not stopping within CANCEL_GRACE is killed and replaced. Each worker is
+    replaced after `max_tasks` questions, so that a leak in a worker doesn't grow forever.
+    """
+
+    def __init__(
+        self,
+        initializer,
+        handler,
+        n_workers=RAG_WORKERS,
+        max_tasks=MAX_TASKS_PER_WORKER,
+        grace=CANCEL_GRACE,
+        context=None,
+    ):
+        self.initializer = initializer
+        self.handler = handler
+        self.n_workers = n_workers
+        self.max_tasks = max_tasks
+        self.grace = grace
+        self._ctx = context or mp.get_context()
+        self._idle = queue.Queue()
+        self._workers = set()
+        self._lock = threading.Lock()
+        self._ids = itertools.count()
+        self._started = False
+        self.counts = {"answered": 0, "failed": 0, "timeouts": 0, "recycled": 0, "killed": 0}
+
+    def start(self):
+        """Start the workers, they warm up in the background, e.g. while the UI loads."""
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+            for _ in range(self.n_workers):
+                self._spawn()
+
+    def _spawn(self):
+        worker = _Worker(self._ctx, self.initializer, self.handler)
+        self._workers.add(worker)
+        self._idle.put(worker)
+
+    def _replace(self, worker, reason):
+        with self._lock:
+            self._workers.discard(worker)
+            self.counts[reason] += 1
+            if self._started:
+                self._spawn()
+
+    def _release(self, worker):
+        worker.tasks += 1
+        if self.max_tasks and worker.tasks >= self.max_tasks:
+            self._replace(worker, "recycled")
+            threading.Thread(target=worker.stop, daemon=True).start()
+        else:
+            self._idle.put(worker)
+
+    def _drain(self, worker, task_id):
+        """Wait for the cancelled question to stop, then reuse the worker, or kill it."""
+        try:
+            while worker.conn.poll(self.grace):
+                if worker.conn.recv()[0] == task_id:
+                    worker.cancel.clear()
+                    self._release(worker)
+                    return
+        except (OSError, EOFError):
+            pass
+        logger.warning(f"killed RAG worker {worker.process.pid}, it didn't stop within {self.grace} seconds")
+        self._replace(worker, "killed")
+        worker.kill()
+
+    def run(self, *args, timeout=None):
+        """Answer a question in the first free worker, raise TimeoutError if it takes longer than `timeout`."""
+        self.start()
+        worker = self._idle.get()
+        task_id = next(self._ids)
+        try:
+            worker.conn.send((task_id, args))
+            answered = worker.conn.poll(timeout)
+            if answered:
+                _, status, result = worker.conn.recv()
+        except (OSError, EOFError):
+            # the worker died, e.g. out of memory
+            self._replace(worker, "killed")
+            worker.kill()
+            raise WorkerError("The worker answering the question stopped, please try again.")
+        if not answered:
+            worker.cancel.set()
+            self.counts["timeouts"] += 1
+            threading.Thread(target=self._drain, args=(worker, task_id), daemon=True).start()
+            raise TimeoutError(f"No answer within {timeout} seconds, please try again.")
+        self._release(worker)
+        if status == "error":
+            self.counts["failed"] += 1
+            raise WorkerError(result)
+        self.counts["answered"] += 1
+        return result
+
+    def close(self):
+        with self._lock:
+            self._started = False
+            workers, self._workers = list(self._workers), set()
+        for worker in workers:
+            worker.stop()
+
+    def stats(self):
+        with self._lock:
+            return {"workers": len(self._workers), "idle": self._idle.qsize(), **self.counts}
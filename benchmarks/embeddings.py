@@ -0,0 +1,69 @@
+"""Embed the chunks of the docs and code of the repo with each embedding backend, report the chunks per second and the
+recall of the top 10 chunks of questions against the torch fp32 model, e.g.
+`python benchmarks/embeddings.py --model all-mpnet-base-v2 --batch-size 32 --threads 4`.
+"""
+import argparse
+import glob
+import os
+import random
+import sys
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "AutoGen_Panel"))
+
+from embeddings import BACKENDS, BATCH_SIZE, THREADS, load_backend  # noqa: E402
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--model", default="all-mpnet-base-v2")
+parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+parser.add_argument("--threads", type=int, default=THREADS)
+parser.add_argument("--chunks", type=int, default=1000)
+parser.add_argument("--queries", type=int, default=100)
+args = parser.parse_args()
+
+chunks = []
+for path in sorted(glob.glob(os.path.join(ROOT, "**", "*.md"), recursive=True)) + sorted(
+    glob.glob(os.path.join(ROOT, "**", "*.py"), recursive=True)
+):
+    with open(path, encoding="utf-8", errors="ignore") as f:
+        chunks += [c.strip() for c in f.read().split("\n\n") if len(c.strip()) > 80]
+rng = random.Random(0)
+chunks = rng.sample(chunks, min(args.chunks, len(chunks)))
+# a question about a chunk: one of its lines
+queries = [rng.choice([line for line in chunk.splitlines() if line.strip()]) for chunk in chunks[: args.queries]]
+print(f"{len(chunks)} chunks, {len(queries)} queries, batch size {args.batch_size}, {args.threads} threads")
+
+
+def top_k(backend, k=10):
+    vectors = np.array(backend(chunks), dtype=np.float32)
+    questions = np.array(backend(queries), dtype=np.float32)
+    return np.argsort(-questions @ vectors.T, axis=1)[:, :k], vectors
+
+
+reference = None
+for name in BACKENDS:
+    try:
+        backend = load_backend(args.model, name, args.batch_size, args.threads)
+    except Exception as e:  # noqa
+        print(f"  {name:>9}: not available, {e!r}")
+        continue
+    backend(chunks[: args.batch_size])  # warm up
+    start = time.perf_counter()
+    backend(chunks)
+    rate = len(chunks) / (time.perf_counter() - start)
+    neighbors, vectors = top_k(backend)
+    if reference is None and name == "torch":
+        reference = (neighbors, vectors)
+    if reference is not None:
+        recall = np.mean([len(set(a) & set(b)) / len(a) for a, b in zip(reference[0], neighbors)])
+        cosine = np.mean(
+            np.sum(reference[1] * vectors, axis=1)
+            / (np.linalg.norm(reference[1], axis=1) * np.linalg.norm(vectors, axis=1))
+        )
+        drift = f"recall@10 {recall:.3f}, cosine to fp32 {cosine:.4f}"
+    else:
+        drift = "no torch fp32 reference"
+    print(f"  {name:>9}: {rate:7.1f} chunks/s, {drift}")
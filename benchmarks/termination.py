@@ -0,0 +1,53 @@
+"""Compare the speed of the termination checks of the apps with the previous implementation, on the long code
+replies of a 9 agents group chat, e.g. `python benchmarks/termination.py`.
+"""
+import os
+import sys
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "AutoGen_Panel"))
+
+from autogen.code_utils import extract_code  # noqa: E402
+from termination import (  # noqa: E402
+    TERMINATE,
+    _has_python_code,
+    _has_terminate,
+    is_code_free_msg,
+    termination_msg,
+)
+
+
+def previous_termination_msg(x):
+    _msg = str(x.get("content", "")).upper().strip().strip("\n").strip(".")
+    return isinstance(x, dict) and (_msg.endswith(TERMINATE) or _msg.startswith(TERMINATE))
+
+
+def previous_is_code_free_msg(message):
+    if isinstance(message, dict):
+        message = message.get("content")
+        if message is None:
+            return False
+    return not any(c[0] == "python" for c in extract_code(message))
+
+
+code = "\n".join(f"    total += compute_{i}(x) * {i}" for i in range(150))
+long_code = f"Here is the code:\n```python\ndef f(x):\n    total = 0\n{code}\n    return total\n```\n"
+n_agents, n_rounds = 9, 12
+replies = [{"content": long_code + f"# round {i}\n"} for i in range(n_rounds)]
+payload = sum(len(r["content"]) for r in replies) // n_rounds
+print(f"{n_agents} agents x {n_rounds} rounds over {payload} chars replies:")
+for name, term, code_free in [
+    ("previous", previous_termination_msg, previous_is_code_free_msg),
+    ("uncached", lambda x: _has_terminate(x["content"]), lambda x: not _has_python_code(x["content"])),
+    ("cached", termination_msg, is_code_free_msg),
+]:
+
+    def _run():
+        for reply in replies:
+            for _ in range(n_agents):
+                term(reply)
+                code_free(reply)
+
+    seconds = min(timeit.repeat(_run, number=10, repeat=3)) / 10
+    print(f"  {name:>8}: {seconds * 1000:.3f} ms per chat")
@@ -0,0 +1,44 @@
+"""Compare recounting the tokens of the whole history on every turn with the token ledger of the agents as the
+transcript grows, e.g. `python benchmarks/token_accounting.py`.
+"""
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "AutoGen_Panel"))
+
+import autogen  # noqa: E402
+from llm_client import count_prompt_tokens  # noqa: E402
+from token_accounting import attach_ledger  # noqa: E402
+
+rng = random.Random(0)
+words = "the model agent plan code data result paper table summary debate argument".split()
+agent = autogen.AssistantAgent("Critic", llm_config=False)
+sender = autogen.AssistantAgent("Planner", llm_config=False)
+ledger = attach_ledger(agent, "gpt-4")
+n_turns = 2000
+# new content on every turn, as in a chat, so the content cache doesn't hide the counting
+contents = [" ".join(rng.choices(words, k=rng.randint(20, 200))) + f" {i}" for i in range(n_turns)]
+
+
+def recount(messages):
+    return sum(count_prompt_tokens(m["content"], "gpt-4") or len(m["content"]) // 4 for m in messages)
+
+
+checkpoints = {100, 500, 1000, 2000}
+print(f"Time per turn of a chat of {n_turns} messages:")
+for turn, content in enumerate(contents, 1):
+    agent._append_oai_message({"content": content}, "user", sender)
+    if turn in checkpoints:
+        start = time.perf_counter()
+        recount(agent._oai_messages[sender])
+        full = time.perf_counter() - start
+        start = time.perf_counter()
+        ledger.update(agent, sender)
+        incremental = time.perf_counter() - start
+        print(f"  {turn:>5} messages: recount {full * 1e6:>8.0f} µs, ledger {incremental * 1e6:>5.0f} µs")
+    else:
+        ledger.update(agent, sender)
+print(f"{ledger.totals()['Planner']['tokens']} tokens counted once each.")
@@ -0,0 +1,20 @@
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Each app is a flat directory of modules deployed on its own. The modules shared by several apps are identical
+# copies, tested once, from the Panel app.
+for app in ("AutoGen_RAG_Gradio3", "AutoGen_Panel"):
+    sys.path.insert(0, os.path.join(ROOT, app))
+
+# the caches and stores shared by the processes of a host, kept out of the working directory
+CACHE_ROOT = tempfile.mkdtemp(prefix="autogen_demos_tests_")
+for name, directory in [
+    ("LLM_CACHE_DIR", "llm_responses"),
+    ("DOWNLOAD_CACHE_DIR", "downloads"),
+    ("RAG_MANIFEST_DIR", "rag_manifests"),
+    ("SHARED_STORE_DIR", "shared"),
+]:
+    os.environ.setdefault(name, os.path.join(CACHE_ROOT, directory))
@@ -0,0 +1,100 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from llm_cache import CachedOpenAIWrapper
+from llm_client import StreamingOpenAIWrapper
+from rate_limiter import TokenBucket
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024  # accept all the connections of a burst
+
+
+class MockOpenAI:
+    """A local OpenAI compatible chat completions server, to test the LLM client without an API key.
+
+    Each completion takes `latency()` seconds. With `requests_per_minute`, the requests over the limit get a 429,
+    the limit is replenished continuously like the providers do. `stats["max_in_flight"]` is the largest number of
+    completions running at the same time.
+    """
+
+    def __init__(self, latency=lambda: 0.05, requests_per_minute=None, content="ok"):
+        self.latency = latency
+        self.requests_per_minute = requests_per_minute
+        self.content = content
+        self._lock = threading.Lock()
+        self.reset()
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                if not mock._admit():
+                    error = {"error": {"message": "Rate limit reached", "type": "requests", "code": "rate_limit"}}
+                    self._reply(429, error, {"retry-after": "1"})
+                    return
+                with mock._lock:
+                    mock._in_flight += 1
+                    mock.stats["max_in_flight"] = max(mock.stats["max_in_flight"], mock._in_flight)
+                try:
+                    time.sleep(mock.latency())
+                finally:
+                    with mock._lock:
+                        mock._in_flight -= 1
+                completion = {
+                    "id": "chatcmpl-mock",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": body["model"],
+                    "choices": [
+                        {"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": mock.content}}
+                    ],
+                    "usage": {"prompt_tokens": 20, "completion_tokens": 1, "total_tokens": 21},
+                }
+                self._reply(200, completion)
+
+            def _reply(self, status, payload, headers=()):
+                data = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in dict(headers).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+        self._server = _Server(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        self.base_url = f"http://127.0.0.1:{self._server.server_port}/v1"
+
+    def reset(self):
+        """Clear the stats and refill the rate limit."""
+        with self._lock:
+            self.stats = {"ok": 0, "429": 0, "max_in_flight": 0}
+            self._in_flight = 0
+            self._bucket = TokenBucket(self.requests_per_minute) if self.requests_per_minute else None
+
+    def _admit(self):
+        with self._lock:
+            now = time.monotonic()
+            limited = self._bucket is not None and self._bucket.delay(1, now) > 0
+            if not limited and self._bucket is not None:
+                self._bucket.take(1, now)
+            self.stats["429" if limited else "ok"] += 1
+            return not limited
+
+    def shutdown(self):
+        self._server.shutdown()
+
+
+class UncachedClient(StreamingOpenAIWrapper):
+    """The client of the agents without the response cache, so that every call reaches the server."""
+
+    def create(self, **config):
+        return super(CachedOpenAIWrapper, self).create(**config)
@@ -0,0 +1,28 @@
+import multiprocessing as mp
+
+from chroma_clients import CHROMA_CLIENTS, get_chroma_client
+
+
+def _child_clients(queue, path):
+    # a forked worker opens its own client instead of the sqlite connection of its parent
+    inherited = CHROMA_CLIENTS.stats()["open_clients"]
+    client = get_chroma_client(path)
+    client.get_or_create_collection("child")
+    queue.put((inherited, sorted(c.name for c in client.list_collections())))
+
+
+def test_one_client_per_path(tmp_path):
+    assert get_chroma_client(str(tmp_path)) is get_chroma_client(str(tmp_path / ".." / tmp_path.name))
+    CHROMA_CLIENTS.close(str(tmp_path))
+
+
+def test_a_forked_worker_does_not_inherit_the_clients(tmp_path):
+    get_chroma_client(str(tmp_path)).get_or_create_collection("parent")
+    ctx = mp.get_context("fork")
+    queue = ctx.Queue()
+    process = ctx.Process(target=_child_clients, args=(queue, str(tmp_path)))
+    process.start()
+    inherited, collections = queue.get(timeout=30)
+    process.join()
+    CHROMA_CLIENTS.close(str(tmp_path))
+    assert inherited == 0 and collections == ["child", "parent"]
@@ -0,0 +1,131 @@
+import random
+import threading
+from types import SimpleNamespace
+
+import pytest
+from context_manager import ContextWindow, SummaryCache, context_window
+from role_alternation import AlternatingView
+from token_accounting import message_tokens
+
+BUDGET = 3000
+WORDS = "the model agent plan code data result paper table summary debate argument".split()
+
+
+class SummaryClient:
+    """Summarize instantly, or once `release` is set."""
+
+    def __init__(self, blocked=False):
+        self.release = threading.Event()
+        if not blocked:
+            self.release.set()
+        self.calls = 0
+
+    def create(self, messages, max_tokens):
+        self.calls += 1
+        self.release.wait(10)
+        return SimpleNamespace(text=" ".join(["summary"] * 50))
+
+    def extract_text_or_function_call(self, response):
+        return [response.text]
+
+
+def history(n=120, seed=0):
+    rng = random.Random(seed)
+    return [
+        {
+            "role": "user" if i % 2 else "assistant",
+            "name": f"agent_{i % 3}",
+            "content": " ".join(rng.choices(WORDS, k=150)),
+        }
+        for i in range(n)
+    ]
+
+
+def tokens(messages):
+    return sum(message_tokens(m, "gpt-4") for m in messages)
+
+
+def settle(window):
+    # the summaries are made in the background
+    for _ in range(1000):
+        if window._pending is None:
+            return
+        threading.Event().wait(0.01)
+    raise AssertionError("the summary wasn't made")
+
+
+def test_a_history_within_the_budget_is_sent_as_is():
+    messages = history(5)
+    window = ContextWindow(budget=BUDGET, summaries=SummaryCache(store=None))
+    assert window.window(messages, SummaryClient(), "gpt-4") is messages
+
+
+def test_the_history_is_summarized_within_the_budget():
+    window = ContextWindow(budget=BUDGET, summaries=SummaryCache(store=None))
+    client = SummaryClient()
+    sent = []
+    for message in history():
+        sent.append(message)
+        window.window(sent, client, "gpt-4")
+        settle(window)
+    windowed = window.window(sent, client, "gpt-4")
+    assert windowed[0]["name"] == "summary" and windowed[-1] is sent[-1]
+    assert tokens(windowed) <= BUDGET < tokens(sent)
+    assert window.summaries.summarized > 1
+
+
+def test_no_message_is_left_out_before_a_summary_covers_it():
+    window = ContextWindow(budget=BUDGET, summaries=SummaryCache(store=None))
+    client = SummaryClient(blocked=True)
+    messages = history()
+    sent = []
+    for message in messages:
+        sent.append(message)
+        # the summary is still being made, the full history is sent
+        assert window.window(sent, client, "gpt-4") == sent
+    # one summary at a time
+    assert window._pending is not None and window.summaries.summarized == 0
+    client.release.set()
+    settle(window)
+    windowed = window.window(sent, client, "gpt-4")
+    # the summary and all the messages after the ones it covers
+    assert windowed[0]["name"] == "summary" and windowed[1:] == sent[window._summary[0] :]
+
+
+def test_the_messages_sent_only_change_with_a_new_summary():
+    # the alternating roles of ERNIE are computed incrementally while the messages sent grow
+    window = ContextWindow(budget=BUDGET, summaries=SummaryCache(store=None))
+    client = SummaryClient()
+    view, previous, rebuilds = AlternatingView(), None, 0
+    sent = []
+    for message in history():
+        sent.append(message)
+        windowed = window.window(sent, client, "gpt-4")
+        settle(window)
+        if previous is not None and not all(a is b for a, b in zip(previous, windowed)):
+            rebuilds += 1
+        alternated = view.update([], windowed)
+        assert [m["content"] for m in alternated[: len(windowed)]] == [m["content"] for m in windowed]
+        previous = windowed
+    assert 0 < rebuilds == window.summaries.summarized
+
+
+def test_the_summaries_are_reused():
+    summaries = SummaryCache(store=None)
+    messages = history()
+    for _ in range(2):
+        window, sent = ContextWindow(budget=BUDGET, summaries=summaries), []
+        for message in messages:
+            sent.append(message)
+            window.window(sent, SummaryClient(), "gpt-4")
+            settle(window)
+    assert summaries.hits == summaries.summarized > 0
+
+
+@pytest.mark.parametrize("budget", [None, 0])
+def test_the_full_history_is_sent_by_default(budget):
+    agent = SimpleNamespace(client=SummaryClient())
+    if budget is not None:
+        agent.context_tokens = budget
+    messages = history()
+    assert context_window(agent, messages, sender=None) is messages
@@ -0,0 +1,103 @@
+import os
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from download_cache import FRESH_FOR, DownloadCache
+
+
+@pytest.fixture
+def server():
+    """A stand-in http server supporting ETag, its docs and versions can be changed by the test."""
+    docs = {"/a/README.md": b"# A\n" * 1000, "/b/README.md": b"# B\n" * 1000, "/c/big.md": b"# C\n" * 3000}
+    versions = {path: 0 for path in docs}
+    requests_seen = defaultdict(int)
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            requests_seen[self.path] += 1
+            etag = f'"{versions[self.path]}"'
+            if self.headers.get("If-None-Match") == etag:
+                self.send_response(304)
+                self.end_headers()
+                return
+            time.sleep(0.2)  # the download
+            self.send_response(200)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", str(len(docs[self.path])))
+            self.end_headers()
+            self.wfile.write(docs[self.path])
+
+        def log_message(self, *args):
+            pass
+
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    httpd.base = f"http://127.0.0.1:{httpd.server_address[1]}"
+    httpd.docs, httpd.versions, httpd.requests_seen = docs, versions, requests_seen
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.fixture
+def clock():
+    return [0.0]
+
+
+@pytest.fixture
+def cache(tmp_path, clock):
+    return DownloadCache(str(tmp_path), size_limit=10000, clock=lambda: clock[0])
+
+
+def _read(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def test_concurrent_fetches_download_once(server, cache):
+    with ThreadPoolExecutor(8) as executor:
+        paths = set(executor.map(lambda _: cache.fetch(f"{server.base}/a/README.md"), range(8)))
+    assert len(paths) == 1 and server.requests_seen["/a/README.md"] == 1, server.requests_seen
+    # same file name from another url, stored apart
+    path_b = cache.fetch(f"{server.base}/b/README.md")
+    assert path_b not in paths and _read(path_b) == server.docs["/b/README.md"]
+    assert _read(paths.pop()) == server.docs["/a/README.md"]
+
+
+def test_stale_docs_are_revalidated(server, cache, clock):
+    url = f"{server.base}/a/README.md"
+    cache.fetch(url)
+    # fresh: no request
+    cache.fetch(url)
+    assert server.requests_seen["/a/README.md"] == 1 and cache.counts["fresh"] == 1
+    # stale: revalidated without a download
+    clock[0] = FRESH_FOR + 1
+    cache.fetch(url)
+    assert server.requests_seen["/a/README.md"] == 2 and cache.counts["not_modified"] == 1
+    # changed on the server: downloaded again
+    server.docs["/a/README.md"], server.versions["/a/README.md"] = b"# A2\n" * 1000, 1
+    clock[0] = 2 * FRESH_FOR + 2
+    assert _read(cache.fetch(url)) == server.docs["/a/README.md"]
+    assert cache.counts["downloaded"] == 2
+
+
+def test_least_recently_used_docs_are_evicted(server, tmp_path, clock):
+    # room for a and c, not b too
+    cache = DownloadCache(str(tmp_path), size_limit=16000, clock=lambda: clock[0])
+    path_a = cache.fetch(f"{server.base}/a/README.md")
+    clock[0] += 1
+    path_b = cache.fetch(f"{server.base}/b/README.md")
+    clock[0] += 1
+    cache.fetch(f"{server.base}/a/README.md")
+    clock[0] += 1
+    path_c = cache.fetch(f"{server.base}/c/big.md")
+    stats = cache.stats()
+    assert stats["bytes"] <= 16000 and stats["evicted"] == 1, stats
+    # b is the least recently used, a was fetched again after it
+    assert not os.path.exists(path_b) and os.path.exists(path_a) and os.path.exists(path_c)
+    # an evicted doc is downloaded again
+    assert _read(cache.fetch(f"{server.base}/b/README.md")) == server.docs["/b/README.md"]
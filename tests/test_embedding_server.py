@@ -0,0 +1,96 @@
+import hashlib
+import tempfile
+import threading
+import time
+from array import array
+
+import embedding_server
+import pytest
+from embedding_server import EmbeddingClient, EmbeddingServer, socket_path
+
+
+def _encode(texts):
+    # a stand-in model whose forward pass has a fixed cost plus a cost per text
+    time.sleep(0.004 + 0.0002 * len(texts))
+    return [[b / 255 for b in hashlib.sha256(text.encode("utf-8")).digest()] for text in texts]
+
+
+def _expected(text):
+    # the vectors go through the socket as float32
+    return [float(array("f", [v])[0]) for v in _encode([text])[0]]
+
+
+def _serve(path, max_batch=embedding_server.MAX_BATCH):
+    server = EmbeddingServer(path, _encode, "stand-in", max_batch=max_batch)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def _stop(server):
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def path():
+    return socket_path("stand-in", directory=tempfile.mkdtemp())
+
+
+def _embed_concurrently(client, n_callers=16, n_calls=25):
+    def _caller(i):
+        for j in range(n_calls):
+            text = f"question {i} {j}"
+            assert client([text]) == [_expected(text)]
+
+    threads = [threading.Thread(target=_caller, args=(i,)) for i in range(n_callers)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return n_callers * n_calls / (time.perf_counter() - start)
+
+
+def test_concurrent_callers_are_batched(path):
+    server = _serve(path, max_batch=1)
+    unbatched = _embed_concurrently(EmbeddingClient("stand-in", path=path))
+    _stop(server)
+
+    server = _serve(path)
+    client = EmbeddingClient("stand-in", path=path)
+    batched = _embed_concurrently(client)
+    stats = client.stats()
+    _stop(server)
+    assert stats["requests"] == 400 and stats["batches"] < stats["requests"] / 2, stats
+    assert stats["fallbacks"] == 0
+    assert batched > 3 * unbatched, (batched, unbatched)
+
+
+def test_falls_back_to_this_process_and_retries_the_server(path, monkeypatch):
+    class StandInEmbeddings:
+        def __init__(self, model_name, backend):
+            pass
+
+        def __call__(self, input):
+            return [_expected(text) for text in input]
+
+    # no server is started, a down server can't be reached
+    monkeypatch.setattr(
+        embedding_server, "ensure_server", lambda model_name, backend, path: embedding_server._connect(path)
+    )
+    monkeypatch.setattr(embedding_server, "LocalEmbeddings", StandInEmbeddings)
+    clock = [0.0]
+    client = EmbeddingClient("stand-in", path=path, retry_after=30, clock=lambda: clock[0])
+
+    assert client(["a"]) == [_expected("a")]
+    server = _serve(path)
+    clock[0] = 10
+    assert client(["b"]) == [_expected("b")]
+    assert client.fallbacks == 2 and server.batcher.counts["requests"] == 0
+    # the server is tried again after the backoff, and used from then on
+    clock[0] = 30
+    assert client(["c"]) == [_expected("c")]
+    assert client(["d"]) == [_expected("d")]
+    stats = client.stats()
+    _stop(server)
+    assert stats["requests"] == 2 and stats["fallbacks"] == 2, stats
@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+from embeddings import OnnxBackend, embedding_id, load_backend
+from tokenizers import Tokenizer
+from tokenizers.models import WordLevel
+from tokenizers.pre_tokenizers import Whitespace
+
+
+class _Input:
+    def __init__(self, name):
+        self.name = name
+
+
+class StandInSession:
+    """An onnx session whose token vectors are the ids of the tokens, and which records the lengths of its batches."""
+
+    def __init__(self):
+        self.batches = []
+
+    def get_inputs(self):
+        return [_Input("input_ids"), _Input("attention_mask")]
+
+    def run(self, outputs, feeds):
+        input_ids = feeds["input_ids"]
+        self.batches.append(input_ids.shape)
+        return [np.stack([input_ids, np.ones_like(input_ids)], axis=-1).astype(np.float32)]
+
+
+def _backend(batch_size=2, mean_pooling=True, normalize=False):
+    vocab = {"[PAD]": 0, "[UNK]": 1, **{str(i): i for i in range(2, 10)}}
+    tokenizer = Tokenizer(WordLevel(vocab, unk_token="[UNK]"))
+    tokenizer.pre_tokenizer = Whitespace()
+    backend = OnnxBackend.__new__(OnnxBackend)
+    backend._init(StandInSession(), tokenizer, max_length=8, batch_size=batch_size)
+    backend.mean_pooling = mean_pooling
+    backend.normalize = normalize
+    return backend
+
+
+def test_embedding_id_keeps_the_int8_vectors_apart():
+    assert embedding_id("all-mpnet-base-v2", "torch") == "all-mpnet-base-v2"
+    assert embedding_id("all-mpnet-base-v2", "onnx") == "all-mpnet-base-v2"
+    assert embedding_id("all-mpnet-base-v2", "onnx-int8") == "all-mpnet-base-v2-int8"
+
+
+def test_unknown_backend_is_rejected():
+    with pytest.raises(ValueError):
+        load_backend("all-mpnet-base-v2", "tensorflow")
+
+
+def test_mean_pooling_ignores_the_padding():
+    backend = _backend()
+    # the texts are batched by length, their embeddings are returned in their order
+    assert backend(["2 4 6", "3", "9 9 9 9", "5"]) == [[4.0, 1.0], [3.0, 1.0], [9.0, 1.0], [5.0, 1.0]]
+    assert backend.session.batches == [(2, 1), (2, 4)]
+    # the padded token of the short text isn't averaged
+    assert backend(["4 8", "2"]) == [[6.0, 1.0], [2.0, 1.0]]
+
+
+def test_cls_pooling_and_normalization():
+    backend = _backend(mean_pooling=False, normalize=True)
+    (embedding,) = backend(["3 4"])
+    assert embedding == pytest.approx([3 / 10**0.5, 1 / 10**0.5])
@@ -0,0 +1,47 @@
+from llm_cache import ResponseCache, cached_create, get_response_cache, response_key
+
+MESSAGES = [{"role": "user", "content": "What is AutoGen?"}]
+
+
+def test_same_request_same_key():
+    config = {"model": "gpt-4", "api_key": "sk-a", "request_timeout": 60}
+    assert response_key(MESSAGES, [config]) == response_key(MESSAGES, [{**config, "request_timeout": 120}])
+    assert response_key(MESSAGES, [config]) != response_key(MESSAGES, [{**config, "temperature": 0}])
+
+
+def test_credentials_and_endpoints_are_not_shared():
+    config = {"model": "gpt-4", "api_key": "sk-a"}
+    key = response_key(MESSAGES, [config])
+    assert key != response_key(MESSAGES, [{**config, "api_key": "sk-b"}])
+    assert key != response_key(MESSAGES, [{**config, "base_url": "http://localhost:8000/v1"}])
+    azure = {**config, "api_type": "azure", "api_version": "2023-08-01-preview"}
+    assert response_key(MESSAGES, [{**azure, "base_url": "https://a.openai.azure.com"}]) != response_key(
+        MESSAGES, [{**azure, "base_url": "https://b.openai.azure.com"}]
+    )
+    # the pyautogen<0.2 way, the endpoint in the create arguments
+    assert response_key(MESSAGES, api_key="sk-a") != response_key(MESSAGES, api_key="sk-b")
+
+
+def test_the_api_key_is_not_stored(tmp_path):
+    cache = ResponseCache(str(tmp_path))
+    config = {"model": "gpt-4", "api_key": "sk-secret-key"}
+    cache.set(response_key(MESSAGES, [config]), {"choices": []})
+    for path in tmp_path.rglob("*"):
+        if path.is_file():
+            assert b"sk-secret-key" not in path.read_bytes()
+
+
+def test_use_cache_false_skips_the_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr("llm_cache.get_response_cache", lambda: get_response_cache(str(tmp_path)))
+    calls = []
+
+    def create(**config):
+        calls.append(config)
+        return {"choices": [{"message": {"content": "ok"}}]}
+
+    for _ in range(2):
+        cached_create(create, messages=MESSAGES, model="gpt-4", use_cache=False)
+    assert len(calls) == 2
+    for _ in range(2):
+        cached_create(create, messages=MESSAGES, model="gpt-4")
+    assert len(calls) == 3
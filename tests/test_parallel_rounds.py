@@ -0,0 +1,100 @@
+import asyncio
+import contextlib
+import io
+import threading
+from types import SimpleNamespace
+
+import autogen
+import pytest
+from autogen_utils import register_stream_reply
+from mock_openai import MockOpenAI, UncachedClient
+from parallel_rounds import ParallelGroupChatManager, parse_parallel_groups
+
+NAMES = ["Host"] + [
+    f"team_{team}_member_{member}" for member in ("one", "two", "three", "four") for team in ("one", "two")
+]
+GROUPS = (
+    "team_one_member_one, team_two_member_one; team_one_member_two, team_two_member_two\n"
+    "team_one_member_three, team_two_member_three; team_one_member_four, team_two_member_four"
+)
+
+
+def test_parse_parallel_groups():
+    names = ["Critic", "Scientist", "Engineer", "Planner"]
+    assert parse_parallel_groups("Critic, Scientist; Engineer, Planner", names) == (
+        ("Critic", "Scientist"),
+        ("Engineer", "Planner"),
+    )
+    # unknown and repeated names, and groups of a single agent, are dropped
+    assert parse_parallel_groups("Critic, Nobody\nCritic, Engineer, Planner;;Scientist", names) == (
+        ("Engineer", "Planner"),
+    )
+    assert parse_parallel_groups("", names) == () and parse_parallel_groups(None, names) == ()
+
+
+@pytest.fixture
+def server():
+    server = MockOpenAI(latency=lambda: 0.1, content="我方观点如下。")
+    yield server
+    server.shutdown()
+
+
+def run_debate(server, parallel_groups):
+    llm_config = {"config_list": [{"model": "gpt-4", "api_key": "sk-mock", "base_url": server.base_url}]}
+    # the async LLM calls of the app, without a chat interface to stream to
+    instance = SimpleNamespace(stream_replies=False)
+    user = autogen.UserProxyAgent(
+        "User_Proxy", human_input_mode="NEVER", code_execution_config=False, default_auto_reply="继续"
+    )
+    agents = [user]
+    for name in NAMES:
+        agent = autogen.AssistantAgent(name, system_message=f"你是{name}。", llm_config=llm_config)
+        agent.client = UncachedClient(**agent.llm_config)
+        register_stream_reply(agent, instance)
+        agents.append(agent)
+    groupchat = autogen.GroupChat(
+        agents=agents, messages=[], max_round=len(agents), speaker_selection_method="round_robin"
+    )
+    manager = ParallelGroupChatManager(
+        groupchat, parallel_groups=parse_parallel_groups(parallel_groups, NAMES), llm_config=False
+    )
+    server.reset()
+    with contextlib.redirect_stdout(io.StringIO()):
+        asyncio.run(user.a_initiate_chat(manager, message="辩题：人工智能利大于弊。"))
+    return server.stats["max_in_flight"], [message["name"] for message in groupchat.messages]
+
+
+def test_parallel_rounds_keep_the_order_of_the_speakers(server):
+    sequential, order = run_debate(server, "")
+    parallel, parallel_order = run_debate(server, GROUPS)
+    # same speakers in the same order, the replies of a parallel round are added in the order of its group
+    assert parallel_order == order == ["User_Proxy"] + NAMES
+    # one reply at a time, then the agents of a group reply at the same time
+    assert sequential == 1 and parallel == 2, (sequential, parallel)
+
+
+def test_speaker_selection_does_not_block_the_event_loop():
+    released = threading.Event()
+
+    class WaitingGroupChat(autogen.GroupChat):
+        def select_speaker(self, last_speaker, selector):
+            # like an "auto" selection waiting for the rate limits, until a coroutine of another session runs
+            assert released.wait(5), "the speaker selection blocked the event loop"
+            return super().select_speaker(last_speaker, selector)
+
+    agents = [
+        autogen.UserProxyAgent(name, human_input_mode="NEVER", code_execution_config=False, default_auto_reply="ok")
+        for name in ("User_Proxy", "Critic", "Scientist")
+    ]
+    groupchat = WaitingGroupChat(agents=agents, messages=[], max_round=3, speaker_selection_method="round_robin")
+    manager = ParallelGroupChatManager(groupchat, llm_config=False)
+
+    async def _sessions():
+        chat = asyncio.create_task(agents[0].a_initiate_chat(manager, message="hello"))
+        await asyncio.sleep(0.05)
+        released.set()
+        await chat
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        asyncio.run(_sessions())
+    assert [message["name"] for message in groupchat.messages] == ["User_Proxy", "Critic", "Scientist"]
@@ -0,0 +1,24 @@
+from types import SimpleNamespace
+
+import rag_agents
+from llm_cache import get_response_cache
+
+
+def test_rag_replies_go_through_the_shared_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr("llm_cache.get_response_cache", lambda: get_response_cache(str(tmp_path)))
+    calls = []
+
+    def create(**config):
+        calls.append(config)
+        return {"choices": [{"message": {"content": "the answer", "role": "assistant"}}]}
+
+    monkeypatch.setattr(rag_agents.oai.ChatCompletion, "create", create)
+    assistant = SimpleNamespace(
+        llm_config={"request_timeout": rag_agents.TIMEOUT, "config_list": [{"model": "gpt-4", "api_key": "sk-a"}]},
+        _oai_system_message=[{"role": "system", "content": "You are a helpful assistant."}],
+    )
+    for _ in range(2):
+        messages = [{"role": "user", "content": "What is AutoGen?"}]
+        assert rag_agents.cached_oai_reply(assistant, messages) == (True, "the answer")
+    # cached once, in the shared cache only
+    assert len(calls) == 1 and calls[0]["use_cache"] is False
@@ -0,0 +1,95 @@
+import hashlib
+import os
+import random
+
+import chromadb
+import pytest
+from rag_ingest import sync_collection
+
+
+class CountingEmbeddings:
+    def __init__(self):
+        self.n_embedded = 0
+
+    def __call__(self, input):
+        self.n_embedded += len(input)
+        return [[b / 255 for b in hashlib.sha256(text.encode("utf-8")).digest()] for text in input]
+
+
+def split_sections(text):
+    # one chunk per section, the default splitter counts tokens with tiktoken, which downloads its encoding
+    return [section for section in text.split("\n\n## ") if section.strip()]
+
+
+@pytest.fixture
+def sections():
+    rng = random.Random(0)
+    words = "agent retrieve chunk embedding vector query answer context document model token".split()
+    return [f"Section {i}\n" + " ".join(rng.choices(words, k=300)) for i in range(500)]
+
+
+def _write(path, sections):
+    with open(path, "w") as f:
+        f.write("\n\n## ".join(sections))
+
+
+def test_only_new_chunks_are_embedded(tmp_path, sections):
+    client = chromadb.EphemeralClient()
+    doc, other = str(tmp_path / "big.md"), str(tmp_path / "other.md")
+    _write(doc, sections)
+    _write(other, sections[:10])
+
+    def sync(docs_path):
+        embeddings = CountingEmbeddings()
+        counts = sync_collection(
+            client,
+            "rag_test",
+            docs_path,
+            2000,
+            embedding_function=embeddings,
+            custom_text_split_function=split_sections,
+            manifest_dir=str(tmp_path / "manifests"),
+        )
+        assert counts["embedded"] == embeddings.n_embedded, counts
+        return counts
+
+    first = sync(doc)
+    assert first["embedded"] == 500
+    again = sync(doc)
+    assert again["embedded"] == 0 and again["unchanged_docs"] == 1
+    sections[42] += " edited"
+    _write(doc, sections)
+    edited = sync(doc)
+    assert edited["embedded"] == 1 and edited["deleted"] == 1
+    # the sections of the other document are new chunks: their source differs
+    switched = sync(other)
+    assert switched["embedded"] == 10 and switched["deleted"] == 500
+    assert client.get_collection("rag_test").count() == 10
+    assert os.path.exists(tmp_path / "manifests" / "rag_test.json")
+
+
+def test_a_reuploaded_file_keeps_its_chunks(tmp_path, sections):
+    # each upload is stored at another temp path, its chunks are keyed by the name of the uploaded file
+    client = chromadb.EphemeralClient()
+    embeddings = CountingEmbeddings()
+
+    def upload(n, sections):
+        path = tmp_path / f"upload_{n}" / "notes.md"
+        path.parent.mkdir()
+        _write(str(path), sections)
+        return sync_collection(
+            client,
+            "rag_uploads",
+            str(path),
+            2000,
+            embedding_function=embeddings,
+            custom_text_split_function=split_sections,
+            sources={str(path): "upload:notes.md"},
+            manifest_dir=str(tmp_path / "manifests"),
+        )
+
+    assert upload(0, sections)["embedded"] == 500
+    sections[7] += " edited"
+    again = upload(1, sections)
+    assert again["embedded"] == 1 and again["deleted"] == 1, again
+    assert client.get_collection("rag_uploads").count() == 500
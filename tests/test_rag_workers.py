@@ -0,0 +1,63 @@
+import multiprocessing as mp
+import os
+import time
+
+import pytest
+from rag_workers import WorkerPool
+
+LOAD, ANSWER = 0.5, 0.05  # seconds to load the embedding model, and to answer a question
+
+
+def _load():
+    time.sleep(LOAD)
+    return {"pid": os.getpid()}
+
+
+def _answer(state, cancel, question, turns=1):
+    for _ in range(turns):
+        if cancel.is_set():
+            return ["cancelled"]
+        time.sleep(ANSWER)
+    return [f"answer to {question} from {state['pid']}"]
+
+
+def _answer_in_new_process(queue, question):
+    queue.put(_answer(_load(), mp.Event(), question))
+
+
+@pytest.fixture
+def pool():
+    pool = WorkerPool(_load, _answer, n_workers=2, max_tasks=4, grace=2)
+    pool.start()
+    time.sleep(LOAD + 0.5)  # warmed up while the UI loads
+    yield pool
+    pool.close()
+
+
+def test_warm_pool_is_faster_than_a_process_per_question(pool):
+    n_questions = 4
+    start = time.perf_counter()
+    for i in range(n_questions):
+        queue = mp.Queue()
+        process = mp.Process(target=_answer_in_new_process, args=(queue, i))
+        process.start()
+        queue.get()
+        process.join()
+    per_process = (time.perf_counter() - start) / n_questions
+
+    start = time.perf_counter()
+    for i in range(n_questions):
+        assert pool.run(i, timeout=5)[0].startswith(f"answer to {i}")
+    pooled = (time.perf_counter() - start) / n_questions
+    assert pooled < per_process / 5, (pooled, per_process)
+
+
+def test_slow_question_is_cancelled_without_killing_its_worker(pool):
+    with pytest.raises(TimeoutError):
+        pool.run("slow", 100, timeout=0.2)
+    time.sleep(0.5)
+    # the cancelled worker stopped at the next turn and answers again
+    for i in range(8):
+        assert pool.run(i, timeout=5)[0].startswith("answer")
+    stats = pool.stats()
+    assert stats["killed"] == 0 and stats["timeouts"] == 1 and stats["recycled"] >= 1, stats
@@ -0,0 +1,79 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import pytest
+from mock_openai import MockOpenAI, UncachedClient
+from rate_limiter import RateLimitScheduler, endpoint_key, session_scope
+
+
+@pytest.mark.parametrize("model", ["gpt-4", "ft:gpt-3.5-turbo:org::abc123", "llama2:13b"])
+def test_the_model_of_a_key_is_the_whole_model_name(model):
+    client = SimpleNamespace(api_key="sk-a", base_url="http://localhost:11434/v1")
+    key = endpoint_key(client, model)
+    assert key[1] == model
+    assert key != endpoint_key(SimpleNamespace(api_key="sk-b", base_url="http://localhost:11434/v1"), model)
+    limits = {
+        "default": {"requests_per_minute": 10, "tokens_per_minute": None},
+        model: {"requests_per_minute": 20, "tokens_per_minute": None},
+    }
+    assert RateLimitScheduler(limits=limits, procs=2)._limits(key) == {
+        "requests_per_minute": 10,
+        "tokens_per_minute": None,
+    }
+
+
+def test_all_calls_succeed_within_the_provider_limit():
+    # sessions of different sizes against a server enforcing its own limit, a burst of its limit then 5 calls/s
+    server_rpm = 300
+    server = MockOpenAI(requests_per_minute=server_rpm)
+    client = UncachedClient(
+        config_list=[{"model": "gpt-4", "api_key": "sk-mock", "base_url": server.base_url}], cache_seed=None
+    )
+    client.scheduler = RateLimitScheduler(
+        limits={"gpt-4": {"requests_per_minute": server_rpm, "tokens_per_minute": None}}, procs=1
+    )
+
+    def _call(session, i):
+        with session_scope(session):
+            client.create(messages=[{"role": "user", "content": f"{session} {i}"}])
+
+    calls = [(s, i) for i in range(300) for s, n in [("debate", 300), ("research", 8), ("chat", 2)] if i < n]
+    try:
+        with ThreadPoolExecutor(max_workers=64) as pool:
+            list(pool.map(lambda a: _call(*a), calls))
+    finally:
+        server.shutdown()
+    # the calls are admitted at the rate of the provider, the odd 429 of calls arriving closer together than they
+    # were admitted is retried by the scheduler
+    assert server.stats["ok"] == len(calls) and server.stats["429"] <= len(calls) // 20, server.stats
+    assert client.scheduler.metrics()["total"]["rate_limited"] == server.stats["429"]
+
+
+def test_a_saturating_session_does_not_starve_another():
+    scheduler = RateLimitScheduler(limits={"gpt-4": {"requests_per_minute": 1200, "tokens_per_minute": None}}, procs=1)
+    key = ("http://mock/v1#0", "gpt-4")
+    scheduler.penalize(key, 0)  # an empty bucket, the calls are admitted one by one, 20 per second
+    granted, stop = [], threading.Event()
+
+    def _flood():
+        while not stop.is_set():
+            ticket = scheduler.acquire(key, 100, "flood")
+            granted.append("flood")
+            scheduler.release(ticket)
+
+    threads = [threading.Thread(target=_flood) for _ in range(20)]
+    for thread in threads:
+        thread.start()
+    while len(scheduler._endpoints[key].queue) < 19:
+        time.sleep(0.01)
+    # a whole queue of the flooding session is waiting, the first call of another session comes next
+    queued_at = len(granted)
+    ticket = scheduler.acquire(key, 100, "chat")
+    granted_before = len(granted) - queued_at
+    scheduler.release(ticket)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    assert granted_before <= 1, granted_before
@@ -0,0 +1,87 @@
+import copy
+import random
+
+import pytest
+from configs import DEFAULT_AUTO_REPLY
+from role_alternation import AlternatingView
+
+SYSTEM = [{"content": "You are a debater.", "role": "system"}]
+
+
+def full_rewrite(system_messages, messages):
+    # the previous implementation, rewriting the roles of the whole conversation in place on every call
+    _messages = system_messages + messages
+    for idx, msg in enumerate(_messages):
+        if idx == 0:
+            continue
+        if idx % 2 == 1:
+            msg["role"] = "user" if msg.get("role") != "function" else "function"
+        else:
+            msg["role"] = "assistant"
+    if len(_messages) % 2 == 1:
+        _messages.append({"content": DEFAULT_AUTO_REPLY, "role": "user"})
+    return _messages
+
+
+def new_message(rng, i):
+    msg = {"content": f"message {i}", "role": rng.choice(["user", "assistant", "function"])}
+    if msg["role"] == "function":
+        msg["name"] = "f"
+    return msg
+
+
+def check(view, history):
+    snapshot = copy.deepcopy(history)
+    expected = full_rewrite(copy.deepcopy(SYSTEM), copy.deepcopy(history))
+    assert view.update(SYSTEM, history) == expected
+    # the agent's history is never modified
+    assert history == snapshot
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_append_only(seed):
+    rng = random.Random(seed)
+    history, view = [], AlternatingView()
+    for turn in range(30):
+        history.extend(new_message(rng, turn) for _ in range(rng.randint(1, 3)))
+        check(view, history)
+
+
+def test_append_only_processes_only_the_new_messages():
+    rng = random.Random(0)
+    history, view = [new_message(rng, i) for i in range(10)], AlternatingView()
+    first = view.update(SYSTEM, history)
+    history.append(new_message(rng, 10))
+    second = view.update(SYSTEM, history)
+    # the alternated copies of the first messages are reused
+    assert all(a is b for a, b in zip(first[1:11], second[1:11]))
+
+
+def test_cleared_history():
+    rng = random.Random(0)
+    history, view = [new_message(rng, i) for i in range(10)], AlternatingView()
+    check(view, history)
+    history.clear()
+    check(view, history)
+    history.append(new_message(rng, 10))
+    check(view, history)
+
+
+def test_other_system_messages():
+    rng = random.Random(0)
+    history, view = [new_message(rng, i) for i in range(5)], AlternatingView()
+    check(view, history)
+    assert view.update([], history) == full_rewrite([], copy.deepcopy(history))
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_non_prefix_history(seed):
+    # a history whose older messages were dropped or replaced, e.g. by a compressing agent or a context window
+    rng = random.Random(seed)
+    history, view = [], AlternatingView()
+    for turn in range(30):
+        history.extend(new_message(rng, turn) for _ in range(rng.randint(1, 3)))
+        if turn % 5 == 4:
+            summary = {"content": f"summary of {len(history) - 2} messages", "role": "user"}
+            history = [summary] + history[-2:]
+        check(view, history)
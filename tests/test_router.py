@@ -0,0 +1,117 @@
+import random
+import socket
+
+import pytest
+import router
+from mock_openai import MockOpenAI, UncachedClient
+from rate_limiter import endpoint_key, endpoint_label
+from router import Router
+
+
+def make_client(config_list, hedge=False):
+    client = UncachedClient(config_list=config_list, cache_seed=None)
+    client.scheduler = None
+    client.router = Router()
+    client.hedge = hedge
+    return client
+
+
+def ask(client, i=0):
+    return client.create(messages=[{"role": "user", "content": f"question {i}"}])
+
+
+@pytest.fixture
+def servers():
+    rng = random.Random(0)
+    slow = MockOpenAI(latency=lambda: rng.uniform(0.15, 0.2))
+    fast = MockOpenAI(latency=lambda: rng.uniform(0.01, 0.02))
+    yield slow, fast
+    slow.shutdown()
+    fast.shutdown()
+
+
+def test_calls_go_to_the_fastest_endpoint(servers):
+    slow, fast = servers
+    client = make_client(
+        [
+            {"model": "gpt-4", "api_key": "sk-mock", "base_url": slow.base_url},
+            {"model": "gpt-4", "api_key": "sk-mock", "base_url": fast.base_url},
+        ]
+    )
+    for i in range(20):
+        ask(client, i)
+    # the slow endpoint, listed first, is only tried until its latency is known
+    assert slow.stats["ok"] == 1 and fast.stats["ok"] == 19
+
+
+def test_failed_endpoint_is_skipped(servers):
+    _, fast = servers
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        down = f"http://127.0.0.1:{sock.getsockname()[1]}/v1"
+    client = make_client(
+        [
+            {"model": "gpt-4", "api_key": "sk-mock", "base_url": down, "max_retries": 0},
+            {"model": "gpt-4", "api_key": "sk-mock", "base_url": fast.base_url},
+        ]
+    )
+    for i in range(5):
+        assert ask(client, i).config_id == 1
+    # tried once, then ranked after the endpoint which answers
+    down_key = endpoint_label(endpoint_key(client._clients[0], "gpt-4"))
+    assert client.router.metrics()["endpoints"][down_key]["calls"] == 1 and fast.stats["ok"] == 5
+
+
+def test_hedged_calls_are_answered_by_the_backup(servers):
+    slow, fast = servers
+    config_list = [
+        {"model": "gpt-4", "api_key": "sk-mock", "base_url": slow.base_url},
+        {"model": "gpt-4", "api_key": "sk-mock", "base_url": fast.base_url},
+    ]
+    client = make_client(config_list, hedge=True)
+    # the slow endpoint is the only one known, with a fast p95, then becomes slow
+    slow_key, fast_key = (endpoint_key(c, "gpt-4") for c in client._clients)
+    for _ in range(router.HEDGE_MIN_SAMPLES):
+        client.router.observe(slow_key, 0.01, True)
+    client.router.observe(fast_key, 1.0, True)
+    client.router.routed = 100
+    assert ask(client).config_id == 1
+    assert client.router.metrics()["total"]["hedge_wins"] == 1
+
+
+def test_openai_import_error_is_raised(monkeypatch, servers):
+    slow, _ = servers
+    client = make_client([{"model": "gpt-4", "api_key": "sk-mock", "base_url": slow.base_url}])
+    monkeypatch.setattr(router, "ERROR", ImportError("Please install openai>=1 and diskcache"))
+    with pytest.raises(ImportError):
+        ask(client)
+    assert slow.stats["ok"] == 0
+
+
+def test_the_other_hedged_response_is_tried_before_the_next_endpoint():
+    rng = random.Random(0)
+    slow = MockOpenAI(latency=lambda: rng.uniform(0.15, 0.2), content="ok")
+    filtered = MockOpenAI(latency=lambda: 0.01, content="filtered out")
+    last = MockOpenAI(latency=lambda: 0.01, content="ok")
+    config_list = [
+        {"model": "gpt-4", "api_key": "sk-mock", "base_url": server.base_url} for server in (slow, filtered, last)
+    ]
+    client = make_client(config_list, hedge=True)
+    slow_key, filtered_key, last_key = (endpoint_key(c, "gpt-4") for c in client._clients)
+    for _ in range(router.HEDGE_MIN_SAMPLES):
+        client.router.observe(slow_key, 0.01, True)
+    client.router.observe(filtered_key, 0.5, True)
+    client.router.observe(last_key, 1.0, True)
+    client.router.routed = 100
+    try:
+        response = client.create(
+            messages=[{"role": "user", "content": "question"}],
+            filter_func=lambda context, response: response.choices[0].message.content == "ok",
+        )
+    finally:
+        for server in (slow, filtered, last):
+            server.shutdown()
+    # the backup answered first and was filtered out, the slow call it hedged passed the filter
+    assert response.config_id == 0 and response.pass_filter
+    assert filtered.stats["ok"] == 1 and last.stats["ok"] == 0
+    assert client.router.metrics()["total"]["hedge_wins"] == 0
@@ -0,0 +1,20 @@
+from session_config import Credentials, resolve_config
+
+
+def test_azure_endpoints_come_first():
+    credentials = Credentials(
+        model="gpt-4",
+        openai_key="sk-openai",
+        openai_base="https://openai.example/v1",
+        aoai_key="aoai-1\naoai-2",
+        aoai_base="https://one.azure.example\nhttps://two.azure.example",
+    )
+    config_list = resolve_config(credentials).to_config_list()
+    assert [config["api_key"] for config in config_list] == ["aoai-1", "aoai-2", "sk-openai"]
+    assert [config.get("api_type") for config in config_list] == ["azure", "azure", None]
+    assert all(config["model"] == "gpt-4" for config in config_list)
+
+
+def test_an_uploaded_config_file_wins_over_the_keys():
+    credentials = Credentials(openai_key="sk-openai", config_file=b'[{"model": "gpt-4", "api_key": "sk-file"}]')
+    assert resolve_config(credentials).to_config_list() == [{"model": "gpt-4", "api_key": "sk-file"}]
@@ -0,0 +1,55 @@
+import autogen
+import pytest
+from sessions import SessionRegistry, team_memory
+
+
+@pytest.fixture
+def clock():
+    return [0.0]
+
+
+@pytest.fixture
+def registry(clock):
+    return SessionRegistry(ttl=800, max_memory=2 * 2**20, max_rss=None, clock=lambda: clock[0])
+
+
+def add_team(registry, teams, session_id, n_messages):
+    agents = [autogen.AssistantAgent(f"agent_{i}", llm_config=False) for i in range(3)]
+    for i in range(n_messages):
+        agents[0]._append_oai_message({"content": f"{session_id} {i} " + "x" * 1000}, "user", agents[1])
+    teams[session_id] = agents
+    registry.register(
+        session_id,
+        release=lambda: teams.pop(session_id),
+        measure=lambda: (team_memory(teams[session_id]), sum(len(m) for m in agents[0]._oai_messages.values())),
+    )
+    with registry.active(session_id):
+        pass
+
+
+def test_idle_and_largest_sessions_are_released(registry, clock):
+    teams = {}
+    for n, session_id in enumerate(["a", "b", "c", "d"]):
+        clock[0] = n * 300
+        add_team(registry, teams, session_id, 1200 if session_id in "bc" else 50)
+    clock[0] = 1000
+    # a is idle for 1000 s, b is the least recently active of the sessions over the memory limit
+    assert registry.sweep() == ["a", "b"]
+    assert sorted(teams) == ["c", "d"]
+    assert registry.stats()["idle"] == 1 and registry.stats()["memory"] == 1
+
+
+def test_chatting_sessions_are_never_released(registry, clock):
+    teams = {}
+    add_team(registry, teams, "a", 3000)
+    with registry.active("a"):
+        clock[0] = 10000
+        assert registry.sweep() == []
+    assert registry.sweep() == ["a"]
+
+
+def test_team_memory_grows_with_the_history():
+    agents = [autogen.AssistantAgent(f"agent_{i}", llm_config=False) for i in range(2)]
+    empty = team_memory(agents)
+    agents[0]._append_oai_message({"content": "x" * 100000}, "user", agents[1])
+    assert team_memory(agents) - empty >= 100000
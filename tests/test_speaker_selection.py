@@ -0,0 +1,75 @@
+import autogen
+from speaker_selection import LocalGroupChat
+
+
+def research_agents():
+    return [
+        autogen.UserProxyAgent(
+            "Admin",
+            system_message="A human admin. Interact with the planner to discuss the plan. "
+            "Plan execution needs to be approved by this admin.",
+            code_execution_config=False,
+            human_input_mode="NEVER",
+        ),
+        autogen.AssistantAgent(
+            "Engineer",
+            system_message="Engineer. You follow an approved plan. You write python/shell code to solve tasks. "
+            "Check the execution result returned by the executor.",
+            llm_config=False,
+        ),
+        autogen.AssistantAgent(
+            "Scientist",
+            system_message="Scientist. You follow an approved plan. You are able to categorize papers after seeing "
+            "their abstracts printed. You don't write code.",
+            llm_config=False,
+        ),
+        autogen.AssistantAgent(
+            "Planner",
+            system_message="Planner. Suggest a plan. Revise the plan based on feedback from admin and critic, until "
+            "admin approval. The plan may involve an engineer who can write code and a scientist who doesn't write "
+            "code.",
+            llm_config=False,
+        ),
+        autogen.AssistantAgent(
+            "Critic",
+            system_message="Critic. Double check plan, claims, code from other agents and provide feedback. Check "
+            "whether the plan includes adding verifiable info such as source URL.",
+            llm_config=False,
+        ),
+        autogen.UserProxyAgent(
+            "Executor",
+            system_message="Executor. Execute the code written by the engineer and report the result.",
+            code_execution_config=False,
+            human_input_mode="NEVER",
+        ),
+    ]
+
+
+CODE = "```python\nimport arxiv\nprint(arxiv.Search('LLM applications'))\n```"
+# speaker, message, the next speaker expected
+TRANSCRIPT = [
+    ("Admin", "find papers on LLM applications from arxiv in the last week, create a markdown table", "Planner"),
+    (
+        "Planner",
+        "Plan: 1. The engineer writes code to search arxiv. 2. The scientist categorizes the papers.",
+        "Critic",
+    ),
+    ("Critic", "The plan looks good, please add the source URL of each paper. Admin, please approve.", "Admin"),
+    ("Admin", "Approved. Engineer, please start.", "Engineer"),
+    ("Engineer", f"Here is the code to search arxiv:\n{CODE}", "Executor"),
+    ("Executor", "exitcode: 0 (execution succeeded)\nCode output: 12 papers found", "Engineer"),
+    ("Engineer", "The abstracts of the papers are printed above, please categorize them.", "Scientist"),
+    ("Scientist", "| Domain | Paper |\n|---|---|\n| Healthcare | ... |", "Critic"),
+]
+
+
+def test_research_chat():
+    agents = research_agents()
+    by_name = {agent.name: agent for agent in agents}
+    groupchat = LocalGroupChat(agents=agents, messages=[], speaker_selection_method="local", allow_repeat_speaker=False)
+    selections = []
+    for speaker, content, _ in TRANSCRIPT:
+        groupchat.messages.append({"role": "user", "name": speaker, "content": content})
+        selections.append(groupchat.select_speaker(by_name[speaker], None).name)
+    # addressed agents, code to the executor and its output back to the engineer
+    assert selections[2:6] == ["Admin", "Engineer", "Executor", "Engineer"]
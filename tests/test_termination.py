@@ -0,0 +1,60 @@
+import pytest
+from autogen.code_utils import extract_code
+from termination import TERMINATE, is_code_free_msg, termination_msg
+
+
+def reference_termination_msg(x):
+    # the check the apps used before termination.py
+    _msg = str(x.get("content", "")).upper().strip().strip("\n").strip(".")
+    return isinstance(x, dict) and (_msg.endswith(TERMINATE) or _msg.startswith(TERMINATE))
+
+
+def reference_is_code_free_msg(message):
+    if isinstance(message, dict):
+        message = message.get("content")
+        if message is None:
+            return False
+    cb = extract_code(message)
+    contain_code = False
+    for c in cb:
+        if c[0] == "python":
+            contain_code = True
+            break
+    return not contain_code
+
+
+code = "\n".join(f"    total += compute_{i}(x) * {i}" for i in range(150))
+long_code = f"Here is the code:\n```python\ndef f(x):\n    total = 0\n{code}\n    return total\n```\n"
+long_sh = f"Run it:\n```sh\npython main.py\n```\n{long_code.replace('python', 'text')}"
+long_text = "Lorem ipsum dolor sit amet. " * 400
+samples = [
+    "",
+    "TERMINATE",
+    "terminate.",
+    "TERMINATE .",
+    ". TERMINATE",
+    "Done. TERMINATE\n\n",
+    "TERMINATE the process first",
+    "...",
+    "   ",
+    "```python\nprint(1)\n```",
+    "```sh\npip install x\n```",
+    "```\nprint(1)\n```",
+    "```python\nprint(1)\n```\nTERMINATE",
+    "```sh\nls\n```python\nprint(1)\n```",
+    long_code,
+    long_code + "TERMINATE",
+    long_sh,
+    long_text,
+    long_text + "TERMINATE" + " " * 1000,
+    "TERMINATE" + "." * 1000,
+    "." * 1000 + "TERMINATE",
+    " " * 1000 + "." * 1000,
+]
+messages = [{"content": s} for s in samples] + [{"content": None}, {}]
+
+
+@pytest.mark.parametrize("message", messages)
+def test_same_verdicts_as_before(message):
+    assert termination_msg(message) == reference_termination_msg(message)
+    assert is_code_free_msg(message) == reference_is_code_free_msg(message)
@@ -0,0 +1,55 @@
+import random
+
+import autogen
+from token_accounting import attach_ledger, message_tokens, session_tokens
+
+WORDS = "the model agent plan code data result paper table summary debate argument".split()
+
+
+def make_agents():
+    agent = autogen.AssistantAgent("Critic", llm_config=False)
+    sender = autogen.AssistantAgent("Planner", llm_config=False)
+    return agent, sender, attach_ledger(agent, "gpt-4")
+
+
+def recount(agent, sender):
+    return sum(message_tokens(m, "gpt-4") for m in agent._oai_messages[sender])
+
+
+def test_each_message_is_counted_once():
+    rng = random.Random(0)
+    agent, sender, ledger = make_agents()
+    for i in range(200):
+        agent._append_oai_message(
+            {"content": " ".join(rng.choices(WORDS, k=rng.randint(20, 200))) + f" {i}"}, "user", sender
+        )
+        assert ledger.update(agent, sender) == recount(agent, sender)
+    assert ledger.totals()["Planner"] == {"messages": 200, "tokens": recount(agent, sender)}
+
+
+def test_a_cleared_history_is_counted_again():
+    agent, sender, ledger = make_agents()
+    for i in range(10):
+        agent._append_oai_message({"content": f"message {i}"}, "user", sender)
+    ledger.update(agent, sender)
+    agent.clear_history()
+    agent._append_oai_message({"content": "hello"}, "user", sender)
+    assert ledger.update(agent, sender) == message_tokens({"content": "hello"}, "gpt-4")
+
+
+def test_a_rewritten_history_is_counted_again():
+    agent, sender, ledger = make_agents()
+    for i in range(10):
+        agent._append_oai_message({"content": f"message {i}"}, "user", sender)
+    ledger.update(agent, sender)
+    # e.g. compressed, the same number of messages
+    agent._oai_messages[sender][-1] = {"content": "a summary " * 50, "role": "user"}
+    assert ledger.update(agent, sender) == recount(agent, sender)
+
+
+def test_session_tokens():
+    agent, sender, ledger = make_agents()
+    agent._append_oai_message({"content": "hello"}, "user", sender)
+    agent._append_oai_message({"content": "hi"}, "assistant", sender)
+    tokens = session_tokens([agent, sender])
+    assert tokens == {"total": recount(agent, sender), "agents": {"Critic": {"Planner": recount(agent, sender)}}}